@@ -16,6 +16,10 @@ final class Life360Client {
     private let jsonDecoder = JSONDecoder()
     private let jsonEncoder = JSONEncoder()
     private let cookieStorage: HTTPCookieStorage
+    // When Life360 last answered 429, and the Retry-After it sent
+    private var rateLimitedAt: Date?
+    private var rateLimitRetryAfter: Double?
+    private let rateLimitLock = NSLock()
 
     init() {
         let id = UIDevice.current.identifierForVendor?.uuidString.uppercased() ?? UUID().uuidString.uppercased()
@@ -203,6 +207,13 @@ final class Life360Client {
         let headers = http.allHeaderFields.reduce(into: [String: String]()) { $0["\($1.key)"] = "\($1.value)" }
         let bodyString = String(data: data, encoding: .utf8) ?? "<non-text body>"
 
+        if http.statusCode == 429 {
+            rateLimitLock.lock()
+            rateLimitedAt = Date()
+            rateLimitRetryAfter = headers.first { $0.key.lowercased() == "retry-after" }.flatMap { Double($0.value) }
+            rateLimitLock.unlock()
+        }
+
         if !(200...299).contains(http.statusCode) {
             logger("✗ Request failed during \(label)")
             logger("Status code: \(http.statusCode)")
@@ -216,6 +227,14 @@ final class Life360Client {
         }
     }
 
+    /// Retry-After (0 if Life360 sent none) of a 429 received since `date`, if any
+    func rateLimit(since date: Date) -> Double? {
+        rateLimitLock.lock()
+        defer { rateLimitLock.unlock() }
+        guard let at = rateLimitedAt, at >= date else { return nil }
+        return rateLimitRetryAfter ?? 0
+    }
+
     private func urlSession() -> URLSession {
         let cfg = URLSessionConfiguration.default
         cfg.httpCookieStorage = cookieStorage
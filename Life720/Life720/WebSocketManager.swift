@@ -16,6 +16,9 @@ class WebSocketManager: ObservableObject {
     private var life360Client: Life360Client
     private var txId: String?
     private var bearer: String?
+    // Commands still being worked on, so the server can cancel them
+    private var runningTasks: [String: Task<Void, Never>] = [:]
+    private let tasksLock = NSLock()
     
     init(serverURL: String = "ws://localhost:8000", clientId: String = "ios-app") {
         self.serverURL = serverURL
@@ -34,7 +37,8 @@ class WebSocketManager: ObservableObject {
         }
         
         let session = URLSession(configuration: .default)
-        webSocketTask = session.webSocketTask(with: url)
+        // Offer the lean frame format; servers that don't know it fall back to plain JSON
+        webSocketTask = session.webSocketTask(with: url, protocols: ["life360.lean"])
         webSocketTask?.resume()
         isConnected = true
         debugPrintLog("Connecting to server: \(url.absoluteString)")
@@ -90,17 +94,47 @@ class WebSocketManager: ObservableObject {
         
         let params = json["params"] as? [String: Any]
         
-        Task {
-            await handleCommand(commandId: commandId, type: type, params: params)
+        // Registered under the lock, so a task that finishes at once still unregisters itself
+        tasksLock.lock()
+        defer { tasksLock.unlock() }
+        runningTasks[commandId] = Task {
+            defer { finishTask(commandId) }
+            let started = Date()
+            var response = await handleCommand(commandId: commandId, type: type, params: params)
+            // The server already gave up on a cancelled command
+            if Task.isCancelled {
+                debugPrintLog("Dropped cancelled command: \(commandId)")
+                return
+            }
+            response["timings"] = ["handle_ms": Date().timeIntervalSince(started) * 1000]
+            // Lets the server back off before Life360 throttles the account further
+            if let retryAfter = life360Client.rateLimit(since: started) {
+                response["rate_limited"] = ["retry_after": retryAfter]
+            }
+            await sendResponse(response)
         }
     }
     
-    private func handleCommand(commandId: String, type: String, params: [String: Any]?) async {
+    private func finishTask(_ commandId: String) {
+        tasksLock.lock()
+        runningTasks.removeValue(forKey: commandId)
+        tasksLock.unlock()
+    }
+    
+    private func cancelTask(_ commandId: String) -> Bool {
+        tasksLock.lock()
+        let task = runningTasks.removeValue(forKey: commandId)
+        tasksLock.unlock()
+        task?.cancel()
+        return task != nil
+    }
+    
+    private func handleCommand(commandId: String, type: String, params: [String: Any]?) async -> [String: Any] {
         debugPrintLog("Processing command: \(type)")
         
         switch type {
         case "ping":
-            await sendResponse(commandId: commandId, status: "success", data: ["pong": true])
+            return makeResponse(commandId: commandId, status: "success", data: ["pong": true])
             
         case "get_status":
             let statusData: [String: Any] = [
@@ -108,101 +142,97 @@ class WebSocketManager: ObservableObject {
                 "has_bearer": bearer != nil,
                 "is_authenticated": bearer != nil
             ]
-            await sendResponse(commandId: commandId, status: "success", data: statusData)
+            return makeResponse(commandId: commandId, status: "success", data: statusData)
             
         case "send_otp":
             guard let phone = params?["phone"] as? String,
                   let country = params?["country"] as? String else {
-                await sendResponse(commandId: commandId, status: "error", error: "Missing phone or country")
-                return
+                return makeResponse(commandId: commandId, status: "error", error: "Missing phone or country")
             }
             
             do {
                 txId = try await life360Client.sendOTP(phone: phone, country: country, logger: debugPrintLog)
-                await sendResponse(commandId: commandId, status: "success", data: ["transaction_id": txId ?? ""])
+                return makeResponse(commandId: commandId, status: "success", data: ["transaction_id": txId ?? ""])
             } catch {
-                await sendResponse(commandId: commandId, status: "error", error: "Send OTP failed: \(error.localizedDescription)")
+                return makeResponse(commandId: commandId, status: "error", error: "Send OTP failed: \(error.localizedDescription)")
             }
             
         case "verify_otp":
             guard let transactionId = params?["transaction_id"] as? String,
                   let code = params?["code"] as? String else {
-                await sendResponse(commandId: commandId, status: "error", error: "Missing transaction_id or code")
-                return
+                return makeResponse(commandId: commandId, status: "error", error: "Missing transaction_id or code")
             }
             
             do {
                 bearer = try await life360Client.verifyOTP(transactionId: transactionId, code: code, logger: debugPrintLog)
-                await sendResponse(commandId: commandId, status: "success", data: ["bearer_token": bearer ?? ""])
+                return makeResponse(commandId: commandId, status: "success", data: ["bearer_token": bearer ?? ""])
             } catch {
-                await sendResponse(commandId: commandId, status: "error", error: "Verify OTP failed: \(error.localizedDescription)")
+                return makeResponse(commandId: commandId, status: "error", error: "Verify OTP failed: \(error.localizedDescription)")
             }
             
         case "get_profile":
             guard let b = bearer else {
-                await sendResponse(commandId: commandId, status: "error", error: "Not authenticated")
-                return
+                return makeResponse(commandId: commandId, status: "error", error: "Not authenticated")
             }
             
             do {
                 let profile = try await life360Client.getUserProfile(bearer: b, logger: debugPrintLog)
                 if let profileData = profile.data(using: .utf8),
                    let profileJson = try? JSONSerialization.jsonObject(with: profileData) {
-                    await sendResponse(commandId: commandId, status: "success", data: profileJson)
+                    return makeResponse(commandId: commandId, status: "success", data: profileJson)
                 } else {
-                    await sendResponse(commandId: commandId, status: "success", data: ["raw": profile])
+                    return makeResponse(commandId: commandId, status: "success", data: ["raw": profile])
                 }
             } catch {
-                await sendResponse(commandId: commandId, status: "error", error: "Get profile failed: \(error.localizedDescription)")
+                return makeResponse(commandId: commandId, status: "error", error: "Get profile failed: \(error.localizedDescription)")
             }
             
         case "get_circles":
             guard let b = bearer else {
-                await sendResponse(commandId: commandId, status: "error", error: "Not authenticated")
-                return
+                return makeResponse(commandId: commandId, status: "error", error: "Not authenticated")
             }
             
             do {
                 let circlesStr = try await life360Client.getCircles(bearer: b, logger: debugPrintLog)
                 if let circlesData = circlesStr.data(using: .utf8),
                    let circlesJson = try? JSONSerialization.jsonObject(with: circlesData) {
-                    await sendResponse(commandId: commandId, status: "success", data: circlesJson)
+                    return makeResponse(commandId: commandId, status: "success", data: circlesJson)
                 } else {
-                    await sendResponse(commandId: commandId, status: "success", data: ["raw": circlesStr])
+                    return makeResponse(commandId: commandId, status: "success", data: ["raw": circlesStr])
                 }
             } catch {
-                await sendResponse(commandId: commandId, status: "error", error: "Get circles failed: \(error.localizedDescription)")
+                return makeResponse(commandId: commandId, status: "error", error: "Get circles failed: \(error.localizedDescription)")
             }
             
         case "get_circle_members":
             guard let b = bearer,
                   let circleId = params?["circle_id"] as? String else {
-                await sendResponse(commandId: commandId, status: "error", error: "Not authenticated or missing circle_id")
-                return
+                return makeResponse(commandId: commandId, status: "error", error: "Not authenticated or missing circle_id")
             }
             
             do {
                 let membersStr = try await life360Client.getCircleMembers(circleId: circleId, bearer: b, logger: debugPrintLog)
                 if let membersData = membersStr.data(using: .utf8),
                    let membersJson = try? JSONSerialization.jsonObject(with: membersData) {
-                    await sendResponse(commandId: commandId, status: "success", data: membersJson)
+                    return makeResponse(commandId: commandId, status: "success", data: membersJson)
                 } else {
-                    await sendResponse(commandId: commandId, status: "success", data: ["raw": membersStr])
+                    return makeResponse(commandId: commandId, status: "success", data: ["raw": membersStr])
                 }
             } catch {
-                await sendResponse(commandId: commandId, status: "error", error: "Get members failed: \(error.localizedDescription)")
+                return makeResponse(commandId: commandId, status: "error", error: "Get members failed: \(error.localizedDescription)")
             }
             
         case "get_device_locations":
             guard let b = bearer,
                   let circleIds = params?["circle_ids"] as? [String] else {
-                await sendResponse(commandId: commandId, status: "error", error: "Not authenticated or missing circle_ids")
-                return
+                return makeResponse(commandId: commandId, status: "error", error: "Not authenticated or missing circle_ids")
             }
             
             var allLocations: [String: Any] = [:]
             
             for circleId in circleIds {
+                // Stop calling Life360 for circles nobody is waiting for any more
+                if Task.isCancelled { break }
                 do {
                     let locationsStr = try await life360Client.getCircleDeviceLocations(circleId: circleId, bearer: b, logger: debugPrintLog)
                     if let locationsData = locationsStr.data(using: .utf8),
@@ -216,14 +246,43 @@ class WebSocketManager: ObservableObject {
                 }
             }
             
-            await sendResponse(commandId: commandId, status: "success", data: allLocations)
+            return makeResponse(commandId: commandId, status: "success", data: allLocations)
+            
+        case "batch":
+            guard let commands = params?["commands"] as? [[String: Any]] else {
+                return makeResponse(commandId: commandId, status: "error", error: "Missing commands")
+            }
+            
+            // Run sub-commands concurrently and answer them all in one frame
+            var responses = [[String: Any]?](repeating: nil, count: commands.count)
+            await withTaskGroup(of: (Int, [String: Any]).self) { group in
+                for (index, command) in commands.enumerated() {
+                    guard let subId = command["command_id"] as? String,
+                          let subType = command["type"] as? String else { continue }
+                    let subParams = command["params"] as? [String: Any]
+                    group.addTask {
+                        (index, await self.handleCommand(commandId: subId, type: subType, params: subParams))
+                    }
+                }
+                for await (index, response) in group {
+                    responses[index] = response
+                }
+            }
+            
+            return makeResponse(commandId: commandId, status: "success", data: ["responses": responses.compactMap { $0 }])
+            
+        case "cancel":
+            guard let target = params?["command_id"] as? String else {
+                return makeResponse(commandId: commandId, status: "error", error: "Missing command_id")
+            }
+            return makeResponse(commandId: commandId, status: "success", data: ["cancelled": cancelTask(target)])
             
         default:
-            await sendResponse(commandId: commandId, status: "error", error: "Unknown command type: \(type)")
+            return makeResponse(commandId: commandId, status: "error", error: "Unknown command type: \(type)")
         }
     }
     
-    private func sendResponse(commandId: String, status: String, data: Any? = nil, error: String? = nil) async {
+    private func makeResponse(commandId: String, status: String, data: Any? = nil, error: String? = nil) -> [String: Any] {
         var response: [String: Any] = [
             "command_id": commandId,
             "status": status
@@ -237,13 +296,46 @@ class WebSocketManager: ObservableObject {
             response["error"] = error
         }
         
-        guard let jsonData = try? JSONSerialization.data(withJSONObject: response),
-              let jsonString = String(data: jsonData, encoding: .utf8) else {
-            debugPrintLog("Failed to serialize response")
-            return
+        return response
+    }
+    
+    private var leanFrames: Bool {
+        let response = webSocketTask?.response as? HTTPURLResponse
+        return response?.value(forHTTPHeaderField: "Sec-WebSocket-Protocol") == "life360.lean"
+    }
+    
+    // Lean frames: the envelope as JSON, a newline, then the data as JSON, so the
+    // server can pass the data through without parsing it
+    private func leanFrame(_ response: [String: Any]) -> Data? {
+        var envelope = response
+        let data = envelope.removeValue(forKey: "data")
+        guard var frame = try? JSONSerialization.data(withJSONObject: envelope) else { return nil }
+        if let data = data {
+            guard let dataJson = try? JSONSerialization.data(withJSONObject: data, options: .fragmentsAllowed) else { return nil }
+            frame.append(0x0A)
+            frame.append(dataJson)
+        }
+        return frame
+    }
+    
+    private func sendResponse(_ response: [String: Any]) async {
+        let status = response["status"] as? String ?? ""
+        let message: URLSessionWebSocketTask.Message
+        if leanFrames {
+            guard let frame = leanFrame(response) else {
+                debugPrintLog("Failed to serialize response")
+                return
+            }
+            message = .data(frame)
+        } else {
+            guard let jsonData = try? JSONSerialization.data(withJSONObject: response),
+                  let jsonString = String(data: jsonData, encoding: .utf8) else {
+                debugPrintLog("Failed to serialize response")
+                return
+            }
+            message = .string(jsonString)
         }
         
-        let message = URLSessionWebSocketTask.Message.string(jsonString)
         webSocketTask?.send(message) { error in
             if let error = error {
                 debugPrintLog("Send error: \(error.localizedDescription)")
@@ -0,0 +1,35 @@
+"""Encode/decode cost of device frames per codec on multi-circle location payloads.
+
+Run with: python -m benchmarks.bench_codec
+"""
+import argparse
+import timeit
+
+from benchmarks.payloads import SIZES, device_locations, response_frame
+from src.codec import CODECS
+
+
+def bench(codec, frame, number: int):
+    encoded = codec.encode(frame)
+    encode_s = min(timeit.repeat(lambda: codec.encode(frame), number=number, repeat=3)) / number
+    decode_s = min(timeit.repeat(lambda: codec.decode(encoded), number=number, repeat=3)) / number
+    return len(encoded), encode_s, decode_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200, help="iterations per measurement")
+    args = parser.parse_args()
+
+    if "msgpack" not in CODECS:
+        print("msgpack not installed; only JSON will be measured (pip install msgpack)")
+    print(f"{'payload':<8} {'codec':<8} {'bytes':>10} {'encode µs':>11} {'decode µs':>11}")
+    for label, circles, members in SIZES:
+        frame = response_frame(device_locations(circles, members))
+        for codec in CODECS.values():
+            size, encode_s, decode_s = bench(codec, frame, args.number)
+            print(f"{label:<8} {codec.name:<8} {size:>10} {encode_s * 1e6:>11.1f} {decode_s * 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
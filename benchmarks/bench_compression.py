@@ -0,0 +1,82 @@
+"""Bytes on the wire and CPU cost of compressing location payloads, per scheme and level.
+
+Measures gzip as GZipMiddleware applies it to HTTP responses, and raw deflate as
+permessage-deflate applies it to device frames. Pass --payload with a response
+saved from the server (e.g. curl -X POST .../locations > locations.json) to
+measure recorded data instead of the synthetic sizes.
+
+Run with: python -m benchmarks.bench_compression
+"""
+import argparse
+import json
+import time
+import timeit
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+from benchmarks.payloads import SIZES, device_locations, response_frame
+
+
+def gzip_compressor(level: int) -> Callable[[bytes], bytes]:
+    def compress(body: bytes) -> bytes:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(body) + compressor.flush()
+    return compress
+
+
+def deflate_compressor(level: int) -> Callable[[bytes], bytes]:
+    # permessage-deflate as uvicorn negotiates it: raw deflate, 12 window bits, memLevel 5,
+    # flushed per message (measured without context takeover)
+    def compress(body: bytes) -> bytes:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -12, 5)
+        return compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return compress
+
+
+def bench(compress: Callable[[bytes], bytes], decompress: Callable[[bytes], bytes],
+          body: bytes, number: int) -> Tuple[int, float, float]:
+    """Compressed size and CPU seconds per call to compress and to decompress."""
+    compressed = compress(body)
+    compress_s = min(timeit.repeat(lambda: compress(body), timer=time.process_time,
+                                   number=number, repeat=3)) / number
+    decompress_s = min(timeit.repeat(lambda: decompress(compressed), timer=time.process_time,
+                                     number=number, repeat=3)) / number
+    return len(compressed), compress_s, decompress_s
+
+
+def payloads(path: Optional[str] = None) -> List[Tuple[str, bytes, bytes]]:
+    """(label, HTTP body, device frame) for each payload to measure."""
+    if path:
+        with open(path, "rb") as f:
+            data = json.load(f)
+        sizes = [(path.rsplit("/", 1)[-1], data)]
+    else:
+        sizes = [(label, device_locations(circles, members)) for label, circles, members in SIZES]
+    return [
+        (label, json.dumps(data, separators=(",", ":")).encode(), json.dumps(response_frame(data)).encode())
+        for label, data in sizes
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payload", help="JSON file with a recorded response to measure")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 3, 6, 9])
+    parser.add_argument("--number", type=int, default=50, help="iterations per measurement")
+    args = parser.parse_args()
+
+    gunzip = lambda body: zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    inflate = lambda body: zlib.decompressobj(-12).decompress(body)
+    print(f"{'payload':<12} {'scheme':<13} {'bytes':>10} {'ratio':>7} {'compress µs':>12} {'decompress µs':>14}")
+    for label, body, frame in payloads(args.payload):
+        print(f"{label:<12} {'identity':<13} {len(body):>10} {1.0:>7.2f} {0.0:>12.1f} {0.0:>14.1f}")
+        for scheme, make, decompress, data in (("gzip", gzip_compressor, gunzip, body),
+                                               ("ws-deflate", deflate_compressor, inflate, frame)):
+            for level in args.levels:
+                size, compress_s, decompress_s = bench(make(level), decompress, data, args.number)
+                print(f"{label:<12} {f'{scheme}-{level}':<13} {size:>10} {len(data) / size:>7.2f} "
+                      f"{compress_s * 1e6:>12.1f} {decompress_s * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
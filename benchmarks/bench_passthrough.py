@@ -0,0 +1,78 @@
+"""CPU and memory from a device frame arriving to the HTTP body being ready, per codec.
+
+json parses the whole frame, builds the Response and serializes data again for the
+response body. lean parses only the envelope and hands the data bytes through, as
+when no location listener needs the response (no geofences, history off).
+lean+listeners adds what the event loop does after the response when one does:
+decode the data, extract every member's location and update a geo index.
+
+Run with: python -m benchmarks.bench_passthrough
+"""
+import argparse
+import json
+import time
+import timeit
+import tracemalloc
+from typing import Callable, Dict
+
+from benchmarks.payloads import SIZES, device_locations, response_frame
+from benchmarks.simulated_device import lean_frame
+from src.codec import JSON, LEAN
+from src.geo import GeoIndex
+from src.locations import extract_member_locations
+from src.models import Response
+
+
+def json_path(frame: str) -> bytes:
+    response = Response(**JSON.decode(frame))
+    return json.dumps(response.data, separators=(",", ":")).encode()
+
+
+def lean_path(frame: bytes) -> bytes:
+    envelope, raw = LEAN.split(frame)
+    response = Response(**envelope)
+    response._raw_data = raw
+    return response.raw_data
+
+
+def lean_listeners_path(frame: bytes) -> bytes:
+    envelope, raw = LEAN.split(frame)
+    response = Response(**envelope)
+    response._raw_data = raw
+    geo_index = GeoIndex()
+    for circle_id, payload in response.load_data().items():
+        geo_index.update(extract_member_locations(circle_id, payload))
+    return response.raw_data
+
+
+PATHS: Dict[str, Callable] = {"json": json_path, "lean": lean_path, "lean+listeners": lean_listeners_path}
+
+
+def peak_bytes(path: Callable, frame) -> int:
+    tracemalloc.start()
+    try:
+        path(frame)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=50, help="iterations per measurement")
+    args = parser.parse_args()
+
+    print(f"{'payload':<8} {'path':<15} {'frame bytes':>12} {'cpu µs':>10} {'peak KiB':>10}")
+    for label, circles, members in SIZES:
+        message = response_frame(device_locations(circles, members))
+        frames = {"json": JSON.encode(message), "lean": lean_frame(message)}
+        for name, path in PATHS.items():
+            frame = frames["json" if name == "json" else "lean"]
+            cpu_s = min(timeit.repeat(lambda: path(frame), timer=time.process_time,
+                                      number=args.number, repeat=3)) / args.number
+            print(f"{label:<8} {name:<15} {len(frame):>12} {cpu_s * 1e6:>10.1f} "
+                  f"{peak_bytes(path, frame) / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
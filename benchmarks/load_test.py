@@ -0,0 +1,226 @@
+"""Drive the HTTP API at a fixed concurrency against a simulated device and report latency.
+
+Starts the server on localhost (or uses --server), connects a SimulatedDevice, and
+saves the run to benchmarks/results/ so later runs can be compared with --baseline.
+
+Run with: python -m benchmarks.load_test --scenario locations --concurrency 16
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.simulated_device import SimulatedDevice, add_device_arguments, device_from_args
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+Request = Callable[[httpx.AsyncClient, SimulatedDevice], Awaitable[httpx.Response]]
+
+_request_ids = itertools.count()
+
+
+def _fresh_circle_id() -> str:
+    """A circle id no earlier request used.
+
+    Concurrent commands with identical params share one device round trip, so
+    without it most requests would be coalesced rather than measured.
+    """
+    return f"bench-{next(_request_ids)}"
+
+
+# max_age=0 skips the response cache, and members/locations swap in a new circle id on
+# every request so each one reaches the device. /circles has no params to vary:
+# concurrent "circles" requests share a command (see "coalesced" under server stats).
+SCENARIOS: Dict[str, Request] = {
+    "ping": lambda client, device: client.post("/ping"),
+    "status": lambda client, device: client.get("/device/status"),
+    "circles": lambda client, device: client.get("/circles", params={"max_age": 0}),
+    "cached": lambda client, device: client.get("/circles"),
+    "members": lambda client, device: client.post(
+        f"/circles/{_fresh_circle_id()}/members", params={"max_age": 0}
+    ),
+    "locations": lambda client, device: client.post(
+        "/locations", params={"max_age": 0}, json={"circle_ids": [*device.circle_ids[:-1], _fresh_circle_id()]}
+    ),
+    "snapshot": lambda client, device: client.get("/snapshot"),
+}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+async def _request(client: httpx.AsyncClient, device: SimulatedDevice, scenario: str) -> httpx.Response:
+    if scenario == "mixed":
+        scenario = random.choice([name for name in SCENARIOS if name != "cached"])
+    return await SCENARIOS[scenario](client, device)
+
+
+async def drive(client: httpx.AsyncClient, device: SimulatedDevice, scenario: str,
+                concurrency: int, requests: int, duration: Optional[float]) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    remaining = [requests]
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker():
+        while deadline is None and remaining[0] > 0 or deadline is not None and time.perf_counter() < deadline:
+            remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                response = await _request(client, device, scenario)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "statuses": statuses,
+    }
+
+
+def start_server(port: int) -> subprocess.Popen:
+    env = {**os.environ, "LIFE360_LOG_LEVEL": os.environ.get("LIFE360_LOG_LEVEL", "WARNING")}
+    # Measure the server, not the Life360 budget; opt back in with LIFE360_RATE_LIMIT_ENABLED=true
+    env.setdefault("LIFE360_RATE_LIMIT_ENABLED", "false")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+
+
+async def wait_for(client: httpx.AsyncClient, check: Callable[[dict], bool], timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check((await client.get("/status")).json()):
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not become ready in time")
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Metrics that got worse than baseline by more than tolerance (a fraction)."""
+    regressions = []
+    for metric in ("p50_ms", "p95_ms", "p99_ms"):
+        old, new = baseline["summary"][metric], result["summary"][metric]
+        if old and new > old * (1 + tolerance):
+            regressions.append(f"{metric}: {old} -> {new}")
+    old_rps, new_rps = baseline["summary"]["rps"], result["summary"]["rps"]
+    if old_rps and new_rps < old_rps * (1 - tolerance):
+        regressions.append(f"rps: {old_rps} -> {new_rps}")
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    server = None
+    base_url = args.server
+    if base_url is None:
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = start_server(args.port)
+    ws_url = base_url.replace("http", "ws", 1) + "/ws/ios-app"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            await wait_for(client, lambda status: True)
+            device = device_from_args(ws_url, args)
+            device_task = asyncio.create_task(device.run())
+            await wait_for(client, lambda status: "ios-app" in status["clients"])
+            if args.warmup:
+                await drive(client, device, args.scenario, args.concurrency, args.warmup, None)
+            summary = await drive(
+                client, device, args.scenario, args.concurrency, args.requests, args.duration
+            )
+            server_stats = (await client.get("/status")).json().get("commands")
+            device_task.cancel()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    return {
+        "scenario": args.scenario,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "concurrency": args.concurrency,
+            "latency_ms": args.latency_ms,
+            "jitter": args.jitter,
+            "circles": args.circles,
+            "members": args.members,
+            "error_rate": args.error_rate,
+            "timeout_rate": args.timeout_rate,
+            "codec": args.codec,
+        },
+        "summary": summary,
+        "server": server_stats,
+        "device": device.stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=[*SCENARIOS, "mixed"], default="locations")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--duration", type=float, help="run for this many seconds instead of --requests")
+    parser.add_argument("--warmup", type=int, default=50, help="requests sent before measuring")
+    parser.add_argument("--timeout", type=float, default=35.0, help="HTTP client timeout")
+    parser.add_argument("--server", help="use a running server instead of starting one, e.g. http://localhost:8000")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", type=Path, help="where to save results (default: benchmarks/results/)")
+    parser.add_argument("--baseline", type=Path, help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression vs baseline")
+    add_device_arguments(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    summary = result["summary"]
+    print(f"{args.scenario}: {summary['requests']} requests at concurrency {args.concurrency} "
+          f"in {summary['elapsed_s']}s")
+    print(f"  {summary['rps']} req/s  p50 {summary['p50_ms']}ms  p95 {summary['p95_ms']}ms  "
+          f"p99 {summary['p99_ms']}ms  max {summary['max_ms']}ms")
+    print(f"  statuses: {summary['statuses']}  server: {result['server']}")
+
+    output = args.output or RESULTS_DIR / f"{args.scenario}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"Saved to {output}")
+
+    if args.baseline:
+        regressions = compare(result, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            print("Regressions vs baseline:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions vs baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Synthetic device payloads shaped like the iOS app's Life360 responses."""
+import random
+import time
+import uuid
+from typing import Any, Dict, List
+
+
+def member_item(rng: random.Random, member_id: str, now: float) -> Dict[str, Any]:
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "provider": "life360",
+        "type": "phone",
+        "name": f"Member {member_id[:4]}",
+        "owners": [{"userId": member_id, "role": "owner"}],
+        "typeData": {"os": "ios", "model": "iPhone15,2", "appVersion": "24.38.0"},
+        "location": {
+            "latitude": 37.7 + rng.random() / 10,
+            "longitude": -122.5 + rng.random() / 10,
+            "accuracy": rng.choice([5, 10, 16, 35, 65]),
+            "heading": rng.random() * 360,
+            "speed": rng.random() * 20,
+            "battery": rng.randint(5, 100),
+            "charging": rng.random() < 0.2,
+            "wifiState": rng.random() < 0.5,
+            "timestamp": str(int((now - rng.randint(0, 600)) * 1000)),
+            "address1": f"{rng.randint(1, 9999)} Market St",
+            "address2": "San Francisco, CA",
+            "placeType": None,
+            "driveSDKStatus": "ON",
+        },
+    }
+
+
+def circle_locations(rng: random.Random, members: int, now: float) -> Dict[str, Any]:
+    items = [member_item(rng, str(uuid.UUID(int=rng.getrandbits(128))), now) for _ in range(members)]
+    return {"data": {"items": items, "providers": ["life360", "tile", "jiobit"]}}
+
+
+def device_locations(circles: int = 5, members_per_circle: int = 12, seed: int = 0) -> Dict[str, Any]:
+    """GET_DEVICE_LOCATIONS response data: circle_id -> that circle's locations payload."""
+    rng = random.Random(seed)
+    now = time.time()
+    return {
+        str(uuid.UUID(int=rng.getrandbits(128))): circle_locations(rng, members_per_circle, now)
+        for _ in range(circles)
+    }
+
+
+def response_frame(data: Any, command_id: str = "bench") -> Dict[str, Any]:
+    return {"command_id": command_id, "status": "success", "data": data}
+
+
+# (label, circles, members per circle) used across the benchmarks
+SIZES: List[tuple] = [("small", 1, 5), ("medium", 5, 12), ("large", 20, 40)]
@@ -0,0 +1,253 @@
+"""A stand-in for the iOS app that answers server commands with synthetic Life360 data.
+
+Speaks the same protocol as WebSocketManager.swift, so the server can be exercised
+without a phone. Run with: python -m benchmarks.simulated_device --latency-ms 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import websockets
+
+from benchmarks.payloads import circle_locations
+
+try:
+    import msgpack
+except ImportError:  # optional: pip install life360-remote[msgpack]
+    msgpack = None
+
+
+def lean_frame(response: Dict[str, Any]) -> bytes:
+    """A response in the life360.lean format: envelope JSON, newline, data JSON."""
+    envelope = {key: value for key, value in response.items() if key != "data"}
+    frame = json.dumps(envelope, separators=(",", ":")).encode()
+    if response.get("data") is not None:
+        frame += b"\n" + json.dumps(response["data"], separators=(",", ":")).encode()
+    return frame
+
+
+class SimulatedDevice:
+    """Answers every CommandType after a simulated Life360 API delay.
+
+    latency is the mean response delay in seconds, with +/- jitter as a fraction of it.
+    error_rate and timeout_rate are the fractions of commands answered with an error
+    or never answered at all. With upstream_rate, the simulated Life360 account allows
+    that many API calls per second (10 seconds' worth as burst) and answers the rest
+    with a 429, reported like the app does.
+    """
+
+    def __init__(self, url: str, latency: float = 0.05, jitter: float = 0.2,
+                 circles: int = 3, members_per_circle: int = 8, error_rate: float = 0.0,
+                 timeout_rate: float = 0.0, codec: str = "json", authenticated: bool = True,
+                 seed: int = 0, upstream_rate: float = 0.0, retry_after: float = 5.0):
+        self.url = url
+        self.latency = latency
+        self.jitter = jitter
+        self.members_per_circle = members_per_circle
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.codec = codec
+        self.rng = random.Random(seed)
+        self.circle_ids = [str(uuid.UUID(int=self.rng.getrandbits(128))) for _ in range(circles)]
+        self.tx_id: Optional[str] = None
+        self.bearer: Optional[str] = "simulated-bearer" if authenticated else None
+        self.stats: Dict[str, int] = {
+            "received": 0, "answered": 0, "errors": 0, "dropped": 0, "throttled": 0, "cancelled": 0,
+        }
+        # command_id -> task handling it, for CANCEL
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.websocket = None
+        self.upstream_rate = upstream_rate
+        self.retry_after = retry_after
+        self.upstream_tokens = upstream_rate * 10
+        self.upstream_updated = time.monotonic()
+        self.rate_limited_at = 0.0
+
+    async def run(self, ready: Optional[asyncio.Event] = None):
+        subprotocols = [f"life360.{self.codec}"] if self.codec != "json" else None
+        async with websockets.connect(self.url, subprotocols=subprotocols, max_size=None) as websocket:
+            self.websocket = websocket
+            if ready is not None:
+                ready.set()
+            try:
+                async for message in websocket:
+                    asyncio.create_task(self._handle_message(message))
+            except websockets.ConnectionClosed as e:
+                print(f"Connection closed by server: {e}")
+
+    async def _handle_message(self, message):
+        command = msgpack.unpackb(message, raw=False) if isinstance(message, bytes) else json.loads(message)
+        self.stats["received"] += 1
+        started = time.perf_counter()
+        started_at = time.monotonic()
+        self.tasks[command["command_id"]] = asyncio.current_task()
+        try:
+            response = await self.handle_command(command["command_id"], command["type"], command.get("params"))
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            return
+        finally:
+            self.tasks.pop(command["command_id"], None)
+        if response is None:
+            self.stats["dropped"] += 1
+            return
+        response["timings"] = {"handle_ms": (time.perf_counter() - started) * 1000}
+        if self.rate_limited_at >= started_at:
+            response["rate_limited"] = {"retry_after": self.retry_after}
+        try:
+            if self.codec == "lean":
+                await self.websocket.send(lean_frame(response))
+            elif isinstance(message, bytes):
+                await self.websocket.send(msgpack.packb(response, use_bin_type=True))
+            else:
+                await self.websocket.send(json.dumps(response))
+            self.stats["answered"] += 1
+        except websockets.ConnectionClosed:
+            self.stats["dropped"] += 1
+
+    async def handle_command(self, command_id: str, command_type: str,
+                             params: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Build the response to one command, or None to simulate a timeout."""
+        params = params or {}
+        if command_type == "batch":
+            responses = await asyncio.gather(*[
+                self.handle_command(sub["command_id"], sub["type"], sub.get("params"))
+                for sub in params.get("commands", [])
+            ])
+            return self._response(command_id, data={"responses": [r for r in responses if r is not None]})
+
+        if command_type == "cancel":
+            task = self.tasks.get(params.get("command_id"))
+            if task is not None:
+                task.cancel()
+            return self._response(command_id, data={"cancelled": task is not None})
+
+        if command_type not in ("ping", "get_status"):
+            roll = self.rng.random()
+            if roll < self.timeout_rate:
+                return None
+            await asyncio.sleep(self.latency * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+            if roll < self.timeout_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return self._response(command_id, error="Simulated Life360 API failure")
+            calls = len(params.get("circle_ids") or []) if command_type == "get_device_locations" else 1
+            if not self._spend_upstream(calls):
+                self.stats["throttled"] += 1
+                return self._response(command_id, error="Life360 API returned 429")
+
+        if command_type == "ping":
+            return self._response(command_id, data={"pong": True})
+        if command_type == "get_status":
+            return self._response(command_id, data={
+                "has_transaction": self.tx_id is not None,
+                "has_bearer": self.bearer is not None,
+                "is_authenticated": self.bearer is not None,
+            })
+        if command_type == "send_otp":
+            if "phone" not in params or "country" not in params:
+                return self._response(command_id, error="Missing phone or country")
+            self.tx_id = str(uuid.uuid4())
+            return self._response(command_id, data={"transaction_id": self.tx_id})
+        if command_type == "verify_otp":
+            if "transaction_id" not in params or "code" not in params:
+                return self._response(command_id, error="Missing transaction_id or code")
+            self.bearer = f"simulated-{uuid.uuid4().hex}"
+            return self._response(command_id, data={"bearer_token": self.bearer})
+        if command_type == "get_profile":
+            if self.bearer is None:
+                return self._response(command_id, error="Not authenticated")
+            return self._response(command_id, data={
+                "id": "simulated-user", "firstName": "Sim", "lastName": "Device",
+                "loginEmail": "sim@example.com", "created": "2020-01-01T00:00:00Z",
+            })
+        if command_type == "get_circles":
+            if self.bearer is None:
+                return self._response(command_id, error="Not authenticated")
+            return self._response(command_id, data={"circles": [
+                {"id": circle_id, "name": f"Circle {i}", "memberCount": str(self.members_per_circle)}
+                for i, circle_id in enumerate(self.circle_ids)
+            ]})
+        if command_type == "get_circle_members":
+            if self.bearer is None or "circle_id" not in params:
+                return self._response(command_id, error="Not authenticated or missing circle_id")
+            return self._response(command_id, data={"members": self._members(params["circle_id"])})
+        if command_type == "get_device_locations":
+            if self.bearer is None or "circle_ids" not in params:
+                return self._response(command_id, error="Not authenticated or missing circle_ids")
+            now = time.time()
+            return self._response(command_id, data={
+                circle_id: circle_locations(self.rng, self.members_per_circle, now)
+                for circle_id in params["circle_ids"]
+            })
+        return self._response(command_id, error=f"Unknown command type: {command_type}")
+
+    def _spend_upstream(self, calls: int) -> bool:
+        if not self.upstream_rate:
+            return True
+        now = time.monotonic()
+        self.upstream_tokens = min(self.upstream_rate * 10,
+                                   self.upstream_tokens + (now - self.upstream_updated) * self.upstream_rate)
+        self.upstream_updated = now
+        if self.upstream_tokens < calls:
+            self.rate_limited_at = now
+            return False
+        self.upstream_tokens -= calls
+        return True
+
+    def _members(self, circle_id: str) -> List[Dict[str, Any]]:
+        rng = random.Random(circle_id)
+        return [
+            {"id": str(uuid.UUID(int=rng.getrandbits(128))), "firstName": f"Member {i}", "lastName": "",
+             "isAdmin": "0" if i else "1", "features": {"shareLocation": "1"}}
+            for i in range(self.members_per_circle)
+        ]
+
+    def _response(self, command_id: str, data: Any = None, error: Optional[str] = None) -> Dict[str, Any]:
+        response: Dict[str, Any] = {"command_id": command_id, "status": "error" if error else "success"}
+        if data is not None:
+            response["data"] = data
+        if error is not None:
+            response["error"] = error
+        return response
+
+
+def add_device_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="mean simulated API delay")
+    parser.add_argument("--jitter", type=float, default=0.2, help="delay jitter as a fraction of the mean")
+    parser.add_argument("--circles", type=int, default=3)
+    parser.add_argument("--members", type=int, default=8, help="members per circle")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--codec", choices=["json", "msgpack", "lean"], default="json")
+    parser.add_argument("--upstream-rate", type=float, default=0.0,
+                        help="simulated Life360 API calls per second before 429s (0 = unlimited)")
+
+
+def device_from_args(url: str, args: argparse.Namespace) -> SimulatedDevice:
+    return SimulatedDevice(
+        url, latency=args.latency_ms / 1000, jitter=args.jitter, circles=args.circles,
+        members_per_circle=args.members, error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate, codec=args.codec, upstream_rate=args.upstream_rate,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="ws://localhost:8000/ws/ios-app")
+    add_device_arguments(parser)
+    args = parser.parse_args()
+    device = device_from_args(args.url, args)
+    print(f"Simulated device connecting to {args.url} (circles: {', '.join(device.circle_ids)})")
+    try:
+        asyncio.run(device.run())
+    except KeyboardInterrupt:
+        pass
+    print(f"Stats: {device.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,36 @@
+import os
+import tempfile
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from src.api import router
+from src.api import deadline_exceeded_handler, prefetcher, queue_full_handler, router
+from src.compression import GZipMiddleware
+from src.config import settings
+from src.latency import DeadlineExceeded, DeadlineMiddleware, DisconnectMiddleware
+from src.metrics import MetricsMiddleware
+from src.ratelimit import RateLimitMiddleware
+from src.scheduler import QueueFull
+from src.tracing import TracingMiddleware
+from src.websocket_handler import manager
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await manager.start_broker()
+    prefetcher.start()
+    yield
+    await prefetcher.stop()
+    await manager.stop_broker()
+
 
 app = FastAPI(
     title="Life360 Remote Controller",
     description="Remote control interface for Life360 iOS app",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -18,7 +41,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(DisconnectMiddleware)
+if settings.gzip_level > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=settings.gzip_min_size, compresslevel=settings.gzip_level)
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 app.include_router(router)
+app.add_exception_handler(QueueFull, queue_full_handler)
+app.add_exception_handler(DeadlineExceeded, deadline_exceeded_handler)
 
 def main():
     print("Starting Life360 Remote Controller Server")
@@ -26,12 +58,20 @@ def main():
     print("Server running at: http://localhost:8000")
     print("API docs available at: http://localhost:8000/docs")
     print("\nTo use the interactive CLI, run: python -m src.cli\n")
-    
+
+    # Several workers need the broker to reach a phone connected to a sibling;
+    # workers inherit the environment, so they all share this directory
+    workers = int(os.getenv("LIFE360_WORKERS", "1"))
+    if workers > 1 and not os.getenv("LIFE360_BROKER_DIR"):
+        os.environ["LIFE360_BROKER_DIR"] = tempfile.mkdtemp(prefix="life360-broker-")
+
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=workers == 1,
+        workers=workers,
+        ws_per_message_deflate=settings.ws_deflate,
         log_level="info"
     )
 
@@ -0,0 +1,164 @@
+import asyncio
+import functools
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from .cache import cache
+from .config import settings
+from .geo import GeoIndex
+from .history import history
+from .life360_service import Life360Service
+from .log import get_logger
+from .models import CommandType, MemberLocation
+from .websocket_handler import manager
+
+logger = get_logger("accounts")
+
+
+class AccountConflict(ValueError):
+    """The requested circles belong to more than one account."""
+
+
+class UnknownCircle(AccountConflict):
+    """No account has reported the circle, and more than one account could own it."""
+
+
+class UnknownAccount(LookupError):
+    """No phone or pool has connected as the requested account."""
+
+
+class AccountRegistry:
+    """Routes API calls to the device serving each Life360 account.
+
+    An account is named by the target its phones connect as: the pool name, or
+    the client id of a phone outside any pool. Every account gets its own
+    Life360Service, and the circles each account's get_circles returns are
+    indexed, so circle-scoped calls reach the right phone without naming the
+    account. Each account also has its own geo index and history, fed only by
+    its own locations. With the broker, the circle index is shared by all
+    workers.
+
+    Calls naming neither an account nor an indexed circle go to the default
+    account, as long as no other account has reported circles; past that a
+    circle nobody reported could be anyone's, so the caller has to name the
+    account.
+
+    Services are only created for the default account and accounts a phone
+    has connected as (here or, with the broker, on another worker) or that
+    own indexed circles, so names made up by callers never pile up caches and
+    listeners.
+    """
+
+    def __init__(self, default: Optional[str] = None):
+        self.default = default or settings.default_account
+        self.services: Dict[str, Life360Service] = {}
+        self.geo_indexes: Dict[str, GeoIndex] = {}
+        # circle_id -> account whose circle list included it
+        self.circles: Dict[str, str] = {}
+        self.location_listeners: List[Callable[[List[MemberLocation]], None]] = []
+
+    def add_location_listener(self, listener: Callable[[List[MemberLocation]], None]):
+        """Attach listener to every account's service, current and future."""
+        self.location_listeners.append(listener)
+        for service in self.services.values():
+            service.add_location_listener(listener)
+
+    def service(self, account: Optional[str] = None) -> Life360Service:
+        account = account or self.default
+        service = self.services.get(account)
+        if service is None:
+            if (account != self.default and not manager.is_connected(account)
+                    and account not in self._circle_accounts()):
+                raise UnknownAccount(f"No device has connected as account {account}")
+            service = self.services[account] = Life360Service(account)
+            geo_index = self.geo_indexes[account] = GeoIndex()
+            service.add_location_listener(geo_index.update, needed=geo_index.watching)
+            if history is not None:
+                namespace = self.namespace(service)
+                service.add_location_listener(functools.partial(history.listener, account=namespace))
+            for listener in self.location_listeners:
+                service.add_location_listener(listener)
+            service.add_circles_listener(lambda circles, account=account: self.register(account, circles))
+        return service
+
+    def register(self, account: str, circles: List[Dict[str, Any]]):
+        """Index the circles an account's phone reported; circles it dropped are forgotten."""
+        circle_ids = {circle["id"] for circle in circles if "id" in circle}
+        for circle_id in [c for c, owner in self.circles.items() if owner == account and c not in circle_ids]:
+            del self.circles[circle_id]
+        for circle_id in circle_ids:
+            previous = self.circles.get(circle_id)
+            if previous is not None and previous != account:
+                logger.debug("Circle %s is shared by %s and %s; routing to %s", circle_id, previous, account, account)
+            self.circles[circle_id] = account
+        if manager.broker is not None:
+            manager.broker.set_circles(account, circle_ids)
+
+    def _owner(self, circle_id: str) -> Optional[str]:
+        account = self.circles.get(circle_id)
+        if account is None and manager.broker is not None:
+            account = manager.broker.circle_account(circle_id)
+        return account
+
+    def _circle_accounts(self) -> Set[str]:
+        accounts = set(self.circles.values())
+        if manager.broker is not None:
+            accounts |= manager.broker.circle_accounts()
+        return accounts
+
+    def account_for(self, circle_ids: Iterable[str]) -> Optional[str]:
+        """The one account owning circle_ids; None (the default account) if none is indexed.
+
+        Raises UnknownCircle for a circle nobody reported once accounts other
+        than the default have circles.
+        """
+        owners = {circle_id: self._owner(circle_id) for circle_id in circle_ids}
+        accounts = set(filter(None, owners.values()))
+        if len(accounts) > 1:
+            raise AccountConflict(f"Circles belong to different accounts: {', '.join(sorted(accounts))}")
+        unknown = [circle_id for circle_id, owner in owners.items() if owner is None]
+        if unknown and self._circle_accounts() - {self.default}:
+            raise UnknownCircle(
+                f"No account has reported circle {', '.join(unknown)}; pass ?account= to pick one"
+            )
+        return accounts.pop() if accounts else None
+
+    def resolve(self, account: Optional[str] = None, circle_ids: Iterable[str] = ()) -> Life360Service:
+        """The service for an explicit account, else for the account owning circle_ids."""
+        return self.service(account or self.account_for(circle_ids))
+
+    def for_circle(self, circle_id: str) -> Life360Service:
+        """The service of the account owning circle_id, or the default account's."""
+        return self.service(self._owner(circle_id))
+
+    def namespace(self, service: Life360Service) -> Optional[str]:
+        """Cache namespace for a service's account; the default account keeps unprefixed keys."""
+        return None if service.client_id == self.default else service.client_id
+
+    def circle_ids(self, account: Optional[str] = None) -> Set[str]:
+        account = account or self.default
+        return {circle_id for circle_id, owner in self.circles.items() if owner == account}
+
+    def discover(self, account: str):
+        """Learn a newly connected account's circles in the background."""
+        asyncio.ensure_future(self._discover(account))
+
+    async def _discover(self, account: str):
+        service = self.service(account)
+        try:
+            status = await service.get_status()
+            # An unauthenticated phone has no circles to report until it signs in
+            if status is not None and status.is_authenticated:
+                circles = await service.get_circles()
+                if circles is not None:
+                    cache.put(CommandType.GET_CIRCLES, None, {"circles": circles}, account=self.namespace(service))
+        except Exception as e:
+            logger.debug("Circle discovery for %s failed: %s", account, e)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            account: {
+                "connected": manager.is_connected(account),
+                "circles": sorted(self.circle_ids(account)),
+            }
+            for account in self.services
+        }
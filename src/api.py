@@ -1,21 +1,178 @@
-from fastapi import APIRouter, WebSocket, HTTPException
-from typing import List, Optional
-from datetime import datetime
+import asyncio
+import json
+import time
+from fastapi import APIRouter, WebSocket, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from datetime import datetime, timezone
 
+from .accounts import AccountConflict, AccountRegistry, UnknownAccount
+from .cache import CacheEntry, cache
+from .config import settings
+from .geo import GeoIndex
+from .history import history
+from .latency import DeadlineExceeded
+from .log import get_logger
+from .metrics import registry
 from .websocket_handler import manager
 from .life360_service import Life360Service
+from .scheduler import QueueFull
+from .prefetch import Prefetcher
+from .subscriptions import LocationHub
+from .tracing import tracer
 from .models import (
-    SendOTPParams, VerifyOTPParams, GetCircleMembersParams,
-    GetDeviceLocationsParams
+    CommandType, SendOTPParams, VerifyOTPParams, GetCircleMembersParams,
+    GetDeviceLocationsParams, BulkCircleMembersParams, GeofenceParams, normalize_params
 )
 
+logger = get_logger("api")
+
 router = APIRouter()
-service = Life360Service()
+accounts = AccountRegistry()
+hub = LocationHub(accounts)
+prefetcher = Prefetcher(accounts, resolve_circles=lambda: _prefetch_circle_ids())
+# Reads being refreshed in the background while their stale entry is served
+_revalidating: Set[str] = set()
+
+
+async def queue_full_handler(request: Request, exc: QueueFull) -> JSONResponse:
+    """Registered on the app: a saturated device queue becomes 429 + Retry-After."""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(exc.retry_after))},
+    )
+
+
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded) -> JSONResponse:
+    """Registered on the app: a command that used up its time budget becomes 504."""
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+def _service(account: Optional[str] = None, circle_ids: Optional[List[str]] = None) -> Life360Service:
+    """The account's service, or that of the account owning circle_ids.
+
+    404 for an account no phone has connected as, 400 if the circles span several.
+    """
+    try:
+        return accounts.resolve(account, circle_ids or ())
+    except UnknownAccount as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except AccountConflict as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _geo_index(account: Optional[str] = None) -> GeoIndex:
+    """The account's geo index, brought up to date with any location responses not yet decoded."""
+    service = _service(account)
+    service.flush_locations()
+    return accounts.geo_indexes[service.client_id]
+
+
+def _require_connected(service: Life360Service):
+    if not manager.is_connected(service.client_id):
+        raise HTTPException(status_code=503, detail="iOS app not connected")
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+async def _cached_read(
+    request: Request,
+    service: Life360Service,
+    command_type: CommandType,
+    params: Optional[dict],
+    max_age: Optional[float],
+    loader: Callable[[], Awaitable[Any]],
+) -> Optional[Response]:
+    """Serve a read from the response cache, falling back to the device.
+
+    Without an explicit max_age, a recently expired entry is served (marked
+    X-Cache-Stale) while it refreshes in the background, and the last known
+    result stands in when the phone is unreachable or failing.
+
+    Returns None when the device fetch fails so the caller can pick its error.
+    """
+    account = accounts.namespace(service)
+    await cache.load(command_type, params, account=account)
+    with tracer.span("cache.lookup", command=command_type.value) as span:
+        entry = cache.get(command_type, params, max_age, account=account)
+        if entry is None and max_age is None:
+            entry = _stale_while_revalidate(service, command_type, params, loader)
+        if span is not None:
+            span.attributes["hit"] = entry is not None
+    if entry is None:
+        connected = manager.is_connected(service.client_id)
+        timed_out: Optional[DeadlineExceeded] = None
+        try:
+            data = await loader() if connected else None
+        except DeadlineExceeded as e:
+            data, timed_out = None, e
+        if data is not None:
+            entry = cache.put(command_type, params, data, account=account)
+        elif max_age is None:
+            entry = cache.get_stale(command_type, params, settings.stale_if_error, account=account)
+        if entry is None:
+            if not connected:
+                raise HTTPException(status_code=503, detail="iOS app not connected")
+            if timed_out is not None:
+                raise timed_out
+            return None
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=entry.headers())
+    return Response(content=entry.body, media_type="application/json", headers=entry.headers())
+
+
+def _stale_while_revalidate(
+    service: Life360Service, command_type: CommandType, params: Optional[dict],
+    loader: Callable[[], Awaitable[Any]],
+) -> Optional[CacheEntry]:
+    """A recently expired entry to serve now, with a background refresh to replace it."""
+    if not manager.is_connected(service.client_id):
+        return None
+    account = accounts.namespace(service)
+    entry = cache.get_stale(command_type, params, settings.stale_while_revalidate, account=account)
+    key = f"{service.client_id}|{command_type.value}|{normalize_params(params)}"
+    if entry is not None and key not in _revalidating:
+        _revalidating.add(key)
+        asyncio.ensure_future(_revalidate(key, account, command_type, params, loader))
+    return entry
+
+
+async def _revalidate(key: str, account: Optional[str], command_type: CommandType,
+                      params: Optional[dict], loader: Callable[[], Awaitable[Any]]):
+    try:
+        data = await loader()
+        if data is not None:
+            cache.put(command_type, params, data, account=account)
+    except Exception as e:
+        logger.warning(f"✗ Background refresh of {command_type.value} failed: {e}")
+    finally:
+        _revalidating.discard(key)
+
+
+def _prefetched_response(request: Request, body: bytes, fetched_at: float, ttl: float) -> Response:
+    """Serve background-prefetched data with the same caching headers as the response cache."""
+    entry = CacheEntry(body, ttl, stored_at=fetched_at)
+    headers = {
+        **entry.headers(),
+        "X-Prefetched-At": datetime.fromtimestamp(fetched_at, timezone.utc).isoformat(),
+    }
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket, client_id)
+async def websocket_endpoint(
+    websocket: WebSocket, client_id: str, pool: Optional[str] = None, codec: Optional[str] = None
+):
+    await manager.connect(websocket, client_id, pool=pool, codec=codec)
+    accounts.discover(pool or client_id)
     await manager.listen(websocket, client_id)
 
 
@@ -34,23 +191,50 @@ async def get_connection_status():
     return {
         "connected": len(clients) > 0,
         "clients": clients,
-        "count": len(clients)
+        "count": len(clients),
+        "pools": manager.get_pools(),
+        "reconnecting": manager.get_reconnecting(),
+        "broker": manager.broker.info() if manager.broker is not None else None,
+        "schedulers": manager.get_schedulers(),
+        "latency": manager.latency.info(),
+        "rate_limits": manager.get_rate_limits(),
+        "commands": {
+            **manager.stats,
+            "in_flight": len(manager.pending_commands),
+        },
+        "cache": cache.info(),
+        "accounts": accounts.info(),
+        "subscriptions": hub.info(),
+        "prefetch": prefetcher.info(),
+        "history": history.info() if history is not None else None,
     }
 
 
+@router.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of command, device and HTTP metrics."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/debug/traces")
+async def get_traces(limit: int = Query(50, ge=1, le=1000)):
+    """Most recent sampled request traces, newest first."""
+    return {"sample_rate": tracer.sample_rate, "traces": tracer.recent(limit)}
+
+
 @router.post("/ping")
-async def ping_device():
-    if not manager.is_connected(service.client_id):
-        raise HTTPException(status_code=503, detail="iOS app not connected")
+async def ping_device(account: Optional[str] = None):
+    service = _service(account)
+    _require_connected(service)
     
     result = await service.ping()
     return {"success": result}
 
 
 @router.get("/device/status")
-async def get_device_status():
-    if not manager.is_connected(service.client_id):
-        raise HTTPException(status_code=503, detail="iOS app not connected")
+async def get_device_status(account: Optional[str] = None):
+    service = _service(account)
+    _require_connected(service)
     
     status = await service.get_status()
     if status:
@@ -59,9 +243,9 @@ async def get_device_status():
 
 
 @router.post("/auth/send-otp")
-async def send_otp(params: SendOTPParams):
-    if not manager.is_connected(service.client_id):
-        raise HTTPException(status_code=503, detail="iOS app not connected")
+async def send_otp(params: SendOTPParams, account: Optional[str] = None):
+    service = _service(account)
+    _require_connected(service)
     
     transaction_id = await service.send_otp(params.phone, params.country)
     if transaction_id:
@@ -70,56 +254,315 @@ async def send_otp(params: SendOTPParams):
 
 
 @router.post("/auth/verify-otp")
-async def verify_otp(params: VerifyOTPParams):
-    if not manager.is_connected(service.client_id):
-        raise HTTPException(status_code=503, detail="iOS app not connected")
+async def verify_otp(params: VerifyOTPParams, account: Optional[str] = None):
+    service = _service(account)
+    _require_connected(service)
     
     bearer = await service.verify_otp(params.transaction_id, params.code)
     if bearer:
+        # Signed in now, so the account has circles to index
+        accounts.discover(service.client_id)
         return {"bearer_token": bearer, "authenticated": True}
     raise HTTPException(status_code=500, detail="Failed to verify OTP")
 
 
 @router.get("/profile")
-async def get_profile():
-    if not manager.is_connected(service.client_id):
-        raise HTTPException(status_code=503, detail="iOS app not connected")
-    
-    profile = await service.get_profile()
-    if profile:
-        return profile
+async def get_profile(
+    request: Request, max_age: Optional[float] = Query(None, ge=0), account: Optional[str] = None
+):
+    service = _service(account)
+
+    async def load():
+        return await service.get_profile(raw=True) or None
+
+    response = await _cached_read(request, service, CommandType.GET_PROFILE, None, max_age, load)
+    if response is not None:
+        return response
     raise HTTPException(status_code=500, detail="Failed to get profile")
 
 
 @router.get("/circles")
-async def get_circles():
-    if not manager.is_connected(service.client_id):
-        raise HTTPException(status_code=503, detail="iOS app not connected")
-    
-    circles = await service.get_circles()
-    if circles is not None:
-        return {"circles": circles}
+async def get_circles(
+    request: Request, max_age: Optional[float] = Query(None, ge=0), account: Optional[str] = None
+):
+    service = _service(account)
+
+    async def load():
+        circles = await service.get_circles()
+        return {"circles": circles} if circles is not None else None
+
+    response = await _cached_read(request, service, CommandType.GET_CIRCLES, None, max_age, load)
+    if response is not None:
+        return response
     raise HTTPException(status_code=500, detail="Failed to get circles")
 
 
-@router.post("/circles/{circle_id}/members")
-async def get_circle_members(circle_id: str):
-    if not manager.is_connected(service.client_id):
+async def _all_circle_ids(service: Life360Service) -> Optional[List[str]]:
+    account = accounts.namespace(service)
+    await cache.load(CommandType.GET_CIRCLES, account=account)
+    entry = cache.get(CommandType.GET_CIRCLES, account=account)
+    if entry is not None:
+        circles = json.loads(entry.body).get("circles") or []
+    else:
+        circles = await service.get_circles() if manager.is_connected(service.client_id) else None
+        if circles is not None:
+            cache.put(CommandType.GET_CIRCLES, None, {"circles": circles}, account=account)
+        else:
+            entry = cache.get_stale(CommandType.GET_CIRCLES, None, settings.stale_if_error, account=account)
+            if entry is None:
+                return None
+            circles = json.loads(entry.body).get("circles") or []
+    return [circle["id"] for circle in circles if "id" in circle]
+
+
+async def _prefetch_circle_ids() -> Optional[List[str]]:
+    """Every circle of every connected account, for LIFE360_PREFETCH_CIRCLES=all."""
+    circle_ids: Dict[str, None] = {}
+    for account in list(accounts.services):
+        if manager.is_connected(account):
+            circle_ids.update(dict.fromkeys(await _all_circle_ids(accounts.service(account)) or []))
+    return list(circle_ids) if circle_ids else None
+
+
+@router.post("/circles/members")
+async def get_circle_members_bulk(
+    params: BulkCircleMembersParams,
+    max_age: Optional[float] = Query(None, ge=0),
+    concurrency: Optional[int] = Query(None, ge=1),
+    account: Optional[str] = None,
+):
+    """Members of several circles (or all of an account's) in one call, fetched concurrently.
+
+    Returns each circle's member ids, one record per member listing all of its
+    circles, and an error per circle that could not be loaded.
+    """
+    if params.circle_ids == "all":
+        service = _service(account)
+        circle_ids = await _all_circle_ids(service)
+        if circle_ids is None:
+            if not manager.is_connected(service.client_id):
+                raise HTTPException(status_code=503, detail="iOS app not connected")
+            raise HTTPException(status_code=500, detail="Failed to get circles")
+    else:
+        circle_ids = list(dict.fromkeys(params.circle_ids))
+        service = _service(account, circle_ids)
+    namespace = accounts.namespace(service)
+
+    results: Dict[str, Tuple[Any, Optional[str]]] = {}
+    missing = []
+    await asyncio.gather(*[
+        cache.load(CommandType.GET_CIRCLE_MEMBERS, GetCircleMembersParams(circle_id=circle_id).dict(),
+                   account=namespace)
+        for circle_id in circle_ids
+    ])
+    for circle_id in circle_ids:
+        member_params = GetCircleMembersParams(circle_id=circle_id).dict()
+        entry = cache.get(CommandType.GET_CIRCLE_MEMBERS, member_params, max_age, account=namespace)
+        if entry is not None:
+            results[circle_id] = (json.loads(entry.body), None)
+        else:
+            missing.append(circle_id)
+
+    if missing and manager.is_connected(service.client_id):
+        fetched = await service.fetch_circle_members(missing, concurrency)
+    else:
+        fetched = {circle_id: (None, "iOS app not connected") for circle_id in missing}
+    for circle_id, (data, error) in fetched.items():
+        member_params = GetCircleMembersParams(circle_id=circle_id).dict()
+        if error is None:
+            cache.put(CommandType.GET_CIRCLE_MEMBERS, member_params, data, account=namespace)
+        elif max_age is None:
+            # Same stale-if-error fallback as the single-circle endpoint
+            entry = cache.get_stale(
+                CommandType.GET_CIRCLE_MEMBERS, member_params, settings.stale_if_error, account=namespace
+            )
+            if entry is not None:
+                data, error = json.loads(entry.body), None
+        results[circle_id] = (data, error)
+
+    if all(error for _, error in results.values()) and not manager.is_connected(service.client_id):
         raise HTTPException(status_code=503, detail="iOS app not connected")
-    
-    members = await service.get_circle_members(circle_id)
-    if members:
-        return members
+    # Keep the caller's circle order
+    return service.merge_circle_members({circle_id: results[circle_id] for circle_id in circle_ids})
+
+
+@router.post("/circles/{circle_id}/members")
+async def get_circle_members(
+    circle_id: str, request: Request, max_age: Optional[float] = Query(None, ge=0),
+    account: Optional[str] = None,
+):
+    service = _service(account, [circle_id])
+
+    async def load():
+        return await service.get_circle_members(circle_id, raw=True) or None
+
+    params = GetCircleMembersParams(circle_id=circle_id).dict()
+    response = await _cached_read(request, service, CommandType.GET_CIRCLE_MEMBERS, params, max_age, load)
+    if response is not None:
+        return response
     raise HTTPException(status_code=500, detail="Failed to get circle members")
 
 
 @router.post("/locations")
-async def get_device_locations(params: GetDeviceLocationsParams):
-    if not manager.is_connected(service.client_id):
-        raise HTTPException(status_code=503, detail="iOS app not connected")
-    
-    locations = await service.get_device_locations(params.circle_ids)
-    if locations:
-        return locations
+async def get_device_locations(
+    params: GetDeviceLocationsParams, request: Request,
+    max_age: Optional[float] = Query(None, ge=0),
+    fanout: bool = False,
+    concurrency: Optional[int] = Query(None, ge=1),
+    account: Optional[str] = None,
+):
+    service = _service(account, params.circle_ids)
+    prefetched = prefetcher.get(params.circle_ids, max_age)
+    if prefetched is not None:
+        return _prefetched_response(request, *prefetched)
+
+    async def load():
+        if fanout:
+            return await service.get_device_locations_fanout(params.circle_ids, concurrency)
+        return await service.get_device_locations(params.circle_ids, raw=True) or None
+
+    response = await _cached_read(
+        request, service, CommandType.GET_DEVICE_LOCATIONS, params.dict(), max_age, load
+    )
+    if response is not None:
+        return response
     raise HTTPException(status_code=500, detail="Failed to get device locations")
 
+
+@router.post("/locations/stream")
+async def stream_device_locations(
+    params: GetDeviceLocationsParams,
+    concurrency: Optional[int] = Query(None, ge=1),
+    timeout: Optional[float] = Query(None, gt=0),
+    account: Optional[str] = None,
+):
+    """NDJSON stream with one line per circle, written as soon as that circle arrives."""
+    service = _service(account, params.circle_ids)
+    _require_connected(service)
+
+    async def lines():
+        started = time.monotonic()
+        async for circle_id, data, error in service.iter_device_locations(
+            params.circle_ids, concurrency, timeout
+        ):
+            line = {
+                "circle_id": circle_id,
+                "status": "error" if error else "success",
+                "elapsed_ms": round((time.monotonic() - started) * 1000),
+            }
+            if error:
+                line["error"] = error
+            else:
+                line["data"] = data
+            yield json.dumps(line, separators=(",", ":")) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.get("/snapshot")
+async def get_snapshot(circle_id: Optional[List[str]] = Query(None), account: Optional[str] = None):
+    """Profile, circles, members and locations via BATCH commands instead of one round-trip each.
+
+    Pass circle_id (repeatable) to skip fetching the circle list.
+    """
+    service = _service(account, circle_id)
+    _require_connected(service)
+    namespace = accounts.namespace(service)
+
+    snapshot = await service.get_snapshot(circle_id)
+    if snapshot is None:
+        raise HTTPException(status_code=500, detail="Failed to get snapshot")
+    # Seed the per-endpoint cache so follow-up reads don't go back to the phone
+    if snapshot["profile"]:
+        cache.put(CommandType.GET_PROFILE, None, snapshot["profile"], account=namespace)
+    if snapshot["circles"] is not None:
+        cache.put(CommandType.GET_CIRCLES, None, {"circles": snapshot["circles"]}, account=namespace)
+    for member_circle_id, members in snapshot["members"].items():
+        if members:
+            params = GetCircleMembersParams(circle_id=member_circle_id).dict()
+            cache.put(CommandType.GET_CIRCLE_MEMBERS, params, members, account=namespace)
+    if snapshot["locations"]:
+        circle_ids = circle_id or [c["id"] for c in snapshot["circles"] or [] if "id" in c]
+        params = GetDeviceLocationsParams(circle_ids=circle_ids).dict()
+        cache.put(CommandType.GET_DEVICE_LOCATIONS, params, snapshot["locations"], account=namespace)
+    return snapshot
+
+
+@router.get("/locations/nearby")
+async def get_nearby_members(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(..., gt=0, description="Radius in meters"),
+    limit: Optional[int] = Query(None, ge=1),
+    account: Optional[str] = None,
+):
+    matches = _geo_index(account).nearby(lat, lon, radius, limit)
+    return {
+        "count": len(matches),
+        "members": [
+            {**location.dict(), "distance": round(distance, 1)} for distance, location in matches
+        ],
+    }
+
+
+@router.post("/geofences")
+async def create_geofence(params: GeofenceParams, account: Optional[str] = None):
+    fence = _geo_index(account).add_fence(params.name, params.latitude, params.longitude, params.radius)
+    return fence.dict()
+
+
+@router.get("/geofences")
+async def list_geofences(account: Optional[str] = None):
+    return {"geofences": [fence.dict() for fence in _geo_index(account).fences.values()]}
+
+
+@router.delete("/geofences/{fence_id}")
+async def delete_geofence(fence_id: str, account: Optional[str] = None):
+    if not _geo_index(account).remove_fence(fence_id):
+        raise HTTPException(status_code=404, detail="Geofence not found")
+    return {"deleted": fence_id}
+
+
+@router.get("/geofences/events")
+async def get_geofence_events(since: int = Query(0, ge=0), account: Optional[str] = None):
+    return {"events": [event.dict() for event in _geo_index(account).events_since(since)]}
+
+
+@router.get("/history")
+async def get_location_history(
+    member_id: str,
+    start: Optional[float] = Query(None, alias="from"),
+    end: Optional[float] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1),
+    account: Optional[str] = None,
+):
+    if history is None:
+        raise HTTPException(status_code=404, detail="Location history is not enabled")
+    service = _service(account)
+    samples = history.query(member_id, start, end, limit, account=accounts.namespace(service))
+    return {"member_id": member_id, "count": len(samples), "samples": samples}
+
+
+@router.get("/subscribe/locations")
+async def subscribe_locations(
+    request: Request, circle_id: str, since: Optional[str] = Query(None, description="Event id to resume after")
+):
+    """Server-sent events: a snapshot, then per-member deltas as locations change.
+
+    Each event id is the hub's epoch and the circle version, so EventSource
+    reconnects resume from the last event received via Last-Event-ID, and a
+    reconnect after a restart starts over with a snapshot.
+    """
+    _require_connected(_service(None, [circle_id]))
+    since_version = hub.resume_version(since or request.headers.get("last-event-id"))
+
+    async def events():
+        async for event, version, payload in hub.subscribe(circle_id, since_version):
+            if event == "keepalive":
+                yield ": keepalive\n\n"
+                continue
+            yield f"id: {hub.event_id(version)}\nevent: {event}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
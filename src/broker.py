@@ -0,0 +1,327 @@
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import struct
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .config import settings
+from .latency import DeadlineExceeded
+from .log import get_logger
+from .scheduler import QueueFull
+
+logger = get_logger("broker")
+
+# Frames between workers: 4-byte big-endian length, then compact JSON
+_HEADER = struct.Struct("!I")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS connections (
+    client_id TEXT PRIMARY KEY,
+    pool TEXT,
+    worker TEXT NOT NULL,
+    grace_until REAL
+)
+"""
+
+# Which account each circle belongs to, as its phone last reported (see AccountRegistry)
+CIRCLES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS circles (
+    circle_id TEXT PRIMARY KEY,
+    account TEXT NOT NULL
+)
+"""
+
+
+class BrokerError(Exception):
+    """A forwarded command failed in, or couldn't reach, the worker holding the device."""
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> dict:
+    header = await reader.readexactly(_HEADER.size)
+    return json.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+
+
+def _write_frame(writer: asyncio.StreamWriter, message: dict):
+    payload = json.dumps(message, separators=(",", ":")).encode()
+    writer.write(_HEADER.pack(len(payload)) + payload)
+
+
+class ConnectionRegistry:
+    """Which worker holds each device connection, shared by all workers through SQLite.
+
+    grace_until is NULL while connected; after a disconnect it marks how long the
+    owning worker keeps the client id inside its reconnect grace window.
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=2.0)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(SCHEMA)
+        self.db.execute(CIRCLES_SCHEMA)
+
+    def register(self, client_id: str, pool: Optional[str], worker: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO connections (client_id, pool, worker, grace_until) VALUES (?, ?, ?, NULL)",
+            (client_id, pool, worker),
+        )
+
+    def release(self, client_id: str, worker: str, grace_until: float):
+        # Only if it hasn't reconnected to another worker in the meantime
+        self.db.execute(
+            "UPDATE connections SET grace_until = ? WHERE client_id = ? AND worker = ?",
+            (grace_until, client_id, worker),
+        )
+
+    def owner(self, target: str) -> Optional[str]:
+        """The worker holding target (a client id or pool name), preferring live connections."""
+        row = self.db.execute(
+            "SELECT worker FROM connections WHERE (client_id = ? OR pool = ?)"
+            " AND (grace_until IS NULL OR grace_until > ?)"
+            " ORDER BY grace_until IS NOT NULL LIMIT 1",
+            (target, target, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_circles(self, account: str, circle_ids: Iterable[str]):
+        """Replace the circles indexed for account."""
+        self.db.execute("BEGIN")
+        try:
+            self.db.execute("DELETE FROM circles WHERE account = ?", (account,))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO circles (circle_id, account) VALUES (?, ?)",
+                [(circle_id, account) for circle_id in circle_ids],
+            )
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def circle_account(self, circle_id: str) -> Optional[str]:
+        row = self.db.execute("SELECT account FROM circles WHERE circle_id = ?", (circle_id,)).fetchone()
+        return row[0] if row else None
+
+    def circle_accounts(self) -> Set[str]:
+        return {account for (account,) in self.db.execute("SELECT DISTINCT account FROM circles")}
+
+    def remove_worker(self, worker: str):
+        self.db.execute("DELETE FROM connections WHERE worker = ?", (worker,))
+
+    def entries(self) -> List[Dict[str, Any]]:
+        rows = self.db.execute("SELECT client_id, pool, worker, grace_until FROM connections").fetchall()
+        return [
+            {"client_id": client_id, "pool": pool, "worker": os.path.basename(worker),
+             "connected": grace_until is None}
+            for client_id, pool, worker, grace_until in rows
+        ]
+
+
+class _Peer:
+    """One multiplexed connection to another worker's broker socket."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._lock = asyncio.Lock()
+
+    async def request(self, message: dict, timeout: float) -> dict:
+        async with self._lock:
+            if self.writer is None or self.writer.is_closing():
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+                asyncio.ensure_future(self._read_loop(reader, self.writer))
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            _write_frame(self.writer, {**message, "id": request_id})
+            await self.writer.drain()
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.CancelledError:
+            # Our caller went away before the reply (wait_for cancelled the future);
+            # let the owning worker stop the command too
+            if future.cancelled() and not self.writer.is_closing():
+                _write_frame(self.writer, {"op": "cancel", "id": request_id})
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                reply = await _read_frame(reader)
+                future = self.pending.get(reply["id"])
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(BrokerError(f"Lost connection to {self.path}"))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class Broker:
+    """Routes device commands between uvicorn workers over Unix domain sockets.
+
+    Each worker listens on <directory>/worker-<pid>.sock and records the devices
+    it holds in a shared registry, so an HTTP request landing on any worker
+    reaches the phone through the worker that owns its WebSocket. The registry
+    also shares the circle -> account index, so circle-routed requests find
+    their account on every worker. Registry lookups are cached for owner_ttl
+    seconds so routing stays off SQLite.
+    """
+
+    def __init__(self, directory: str, owner_ttl: float = 1.0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.worker = os.path.join(directory, f"worker-{os.getpid()}.sock")
+        self.registry = ConnectionRegistry(os.path.join(directory, "registry.db"))
+        self.peers: Dict[str, _Peer] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.handler: Optional[Callable[[dict], Awaitable[Any]]] = None
+        self.stats: Dict[str, int] = {"forwarded": 0, "served": 0, "unreachable": 0, "cancelled": 0}
+        self.owner_ttl = owner_ttl
+        # target -> (worker holding it, or None; time.monotonic() the answer expires)
+        self._owners: Dict[str, Tuple[Optional[str], float]] = {}
+        # circle_id -> (account owning it, or None; expiry), and "" -> every account owning a circle
+        self._circles: Dict[str, Tuple[Optional[str], float]] = {}
+        self._circle_accounts: Dict[str, Tuple[Set[str], float]] = {}
+
+    async def start(self, handler: Callable[[dict], Awaitable[Any]]):
+        """Listen for commands forwarded by other workers; handler runs them locally."""
+        self.handler = handler
+        if os.path.exists(self.worker):
+            os.unlink(self.worker)
+        self.server = await asyncio.start_unix_server(self._serve, path=self.worker)
+        logger.info(f"Broker listening on {self.worker}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+        self.registry.remove_worker(self.worker)
+        for peer in self.peers.values():
+            peer.close()
+        if os.path.exists(self.worker):
+            os.unlink(self.worker)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Request id -> task answering it, so the requester can cancel it
+        answering: Dict[int, asyncio.Task] = {}
+        try:
+            while True:
+                request = await _read_frame(reader)
+                if request.get("op") == "cancel":
+                    task = answering.get(request["id"])
+                    if task is not None:
+                        self.stats["cancelled"] += 1
+                        task.cancel()
+                    continue
+                task = answering[request["id"]] = asyncio.ensure_future(self._answer(request, writer))
+                task.add_done_callback(lambda _, request_id=request["id"]: answering.pop(request_id, None))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _answer(self, request: dict, writer: asyncio.StreamWriter):
+        self.stats["served"] += 1
+        try:
+            reply = {"response": await self.handler(request)}
+        except QueueFull as e:
+            reply = {"error": str(e), "retry_after": e.retry_after}
+        except DeadlineExceeded as e:
+            reply = {"error": str(e), "timed_out": True}
+        except Exception as e:
+            reply = {"error": str(e)}
+        reply["id"] = request["id"]
+        try:
+            _write_frame(writer, reply)
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    def _cached(self, cache: Dict[str, Tuple[Any, float]], key: str, load: Callable[[str], Any]) -> Any:
+        """load(key), reusing an answer younger than owner_ttl."""
+        now = time.monotonic()
+        cached = cache.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        value = load(key)
+        if len(cache) >= 1024:
+            for expired in [k for k, entry in cache.items() if entry[1] <= now]:
+                del cache[expired]
+        cache[key] = (value, now + self.owner_ttl)
+        return value
+
+    def owner(self, target: str) -> Optional[str]:
+        """Socket path of the other worker holding target, if any."""
+        worker = self._cached(self._owners, target, self.registry.owner)
+        return worker if worker != self.worker else None
+
+    def circle_account(self, circle_id: str) -> Optional[str]:
+        """The account whose phone last reported circle_id, on any worker."""
+        return self._cached(self._circles, circle_id, self.registry.circle_account)
+
+    def circle_accounts(self) -> Set[str]:
+        """Every account that has reported circles, on any worker."""
+        return self._cached(self._circle_accounts, "", lambda _: self.registry.circle_accounts())
+
+    def set_circles(self, account: str, circle_ids: Iterable[str]):
+        self.registry.set_circles(account, circle_ids)
+        self._circles.clear()
+        self._circle_accounts.clear()
+
+    def forget_owner(self, target: Optional[str] = None, worker: Optional[str] = None):
+        """Drop cached owners: target's, every target held by worker, or (neither given) all."""
+        if target is not None:
+            self._owners.pop(target, None)
+        elif worker is not None:
+            self._owners = {t: entry for t, entry in self._owners.items() if entry[0] != worker}
+        else:
+            self._owners.clear()
+
+    async def forward(self, worker: str, message: dict, timeout: float) -> Any:
+        peer = self.peers.get(worker)
+        if peer is None:
+            peer = self.peers[worker] = _Peer(worker)
+        self.stats["forwarded"] += 1
+        try:
+            reply = await peer.request(message, timeout)
+        except OSError as e:
+            # The worker is gone; forget the devices it claimed
+            self.stats["unreachable"] += 1
+            self.registry.remove_worker(worker)
+            self.forget_owner(worker=worker)
+            self.peers.pop(worker, None)
+            raise BrokerError(f"Worker {os.path.basename(worker)} unreachable: {e}")
+        if "retry_after" in reply:
+            raise QueueFull(message["target"], reply["retry_after"])
+        if reply.get("timed_out"):
+            raise DeadlineExceeded(reply["error"])
+        if "error" in reply:
+            # The device may have moved since we looked it up
+            self.forget_owner(message["target"])
+            raise BrokerError(reply["error"])
+        return reply["response"]
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "worker": os.path.basename(self.worker),
+            "connections": self.registry.entries(),
+        }
+
+
+def create_broker() -> Optional[Broker]:
+    if not settings.broker_dir:
+        return None
+    return Broker(settings.broker_dir, owner_ttl=settings.broker_owner_ttl)
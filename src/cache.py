@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .config import settings
+from .models import CommandType, normalize_params
+from .store import ResponseStore, store
+
+
+class CacheEntry:
+    """A serialized read result plus the metadata needed for HTTP caching."""
+
+    __slots__ = ("body", "etag", "stored_at", "ttl")
+
+    def __init__(self, body: bytes, ttl: float, stored_at: Optional[float] = None):
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.stored_at = time.time() if stored_at is None else stored_at
+        self.ttl = ttl
+
+    @property
+    def age(self) -> float:
+        return max(0.0, time.time() - self.stored_at)
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+    @property
+    def stale(self) -> bool:
+        return self.age > self.ttl
+
+    def headers(self) -> Dict[str, str]:
+        remaining = max(0, round(self.ttl - self.age))
+        headers = {
+            "ETag": self.etag,
+            "Cache-Control": f"private, max-age={remaining}",
+            "Age": str(int(self.age)),
+        }
+        if self.stale:
+            headers["X-Cache-Stale"] = "true"
+        return headers
+
+
+class ResponseCache:
+    """LRU cache of device read results with per-command-type TTLs.
+
+    Bounded both by entry count and by total serialized size; the least
+    recently used entries are evicted first. With a store, every result is
+    also persisted, and load() looks up keys missing from memory there once,
+    on the store's reader thread; get() and get_stale() only read memory.
+    Results of accounts other than the default are keyed under their account.
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None,
+                 max_entries: int = 512, max_bytes: int = 32 * 1024 * 1024,
+                 store: Optional[ResponseStore] = None):
+        self.ttls: Dict[str, float] = dict(ttls or {})
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.total_bytes = 0
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "stale": 0}
+        # Keys already looked up in the store, least recent first; memory is
+        # authoritative for these. Bounded, since callers pick the circle ids in keys.
+        self._checked: "OrderedDict[str, None]" = OrderedDict()
+        self.max_checked = 4 * max_entries
+        # Store lookups in progress, so concurrent loads of a key share one
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    def _key(self, command_type: CommandType, params: Optional[dict], account: Optional[str] = None) -> str:
+        key = f"{command_type.value}|{normalize_params(params)}"
+        return f"{account}/{key}" if account else key
+
+    def ttl_for(self, command_type: CommandType) -> float:
+        return self.ttls.get(command_type.value, 0.0)
+
+    def get(self, command_type: CommandType, params: Optional[dict] = None,
+            max_age: Optional[float] = None, account: Optional[str] = None) -> Optional[CacheEntry]:
+        """Return a cached entry no older than max_age (defaults to the type's TTL)."""
+        key = self._key(command_type, params, account)
+        entry = self.entries.get(key)
+        limit = entry.ttl if entry is not None and max_age is None else max_age
+        if entry is None or entry.age > limit:
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry
+
+    def get_stale(self, command_type: CommandType, params: Optional[dict] = None,
+                  max_stale: float = 0.0, account: Optional[str] = None) -> Optional[CacheEntry]:
+        """Return an entry even past its TTL, as long as it expired at most max_stale seconds ago."""
+        entry = self.entries.get(self._key(command_type, params, account))
+        if entry is None or entry.age > entry.ttl + max_stale:
+            return None
+        self.stats["stale"] += 1
+        return entry
+
+    async def load(self, command_type: CommandType, params: Optional[dict] = None,
+                   account: Optional[str] = None):
+        """Bring a persisted result into memory, if it isn't there and hasn't been looked up."""
+        key = self._key(command_type, params, account)
+        if self.store is None or key in self.entries or key in self._checked:
+            return
+        loading = self._loading.get(key)
+        if loading is not None:
+            await asyncio.shield(loading)
+            return
+        loading = self._loading[key] = asyncio.ensure_future(self.store.fetch(key))
+        try:
+            stored = await asyncio.shield(loading)
+        finally:
+            self._loading.pop(key, None)
+        self._check(key)
+        # A fresher result may have been put while the store was read
+        if stored is not None and key not in self.entries:
+            body, stored_at = stored
+            self._insert(key, CacheEntry(body, self.ttl_for(command_type), stored_at=stored_at))
+
+    def _check(self, key: str):
+        self._checked[key] = None
+        self._checked.move_to_end(key)
+        while len(self._checked) > self.max_checked:
+            self._checked.popitem(last=False)
+
+    def put(self, command_type: CommandType, params: Optional[dict], data: Any,
+            account: Optional[str] = None) -> CacheEntry:
+        """Cache a read result; bytes are taken as its already-serialized JSON."""
+        body = data if isinstance(data, bytes) else json.dumps(data, separators=(",", ":")).encode()
+        entry = CacheEntry(body, self.ttl_for(command_type))
+        if entry.ttl <= 0 or entry.size > self.max_bytes:
+            return entry
+        key = self._key(command_type, params, account)
+        self._insert(key, entry)
+        if self.store is not None:
+            self._check(key)
+            self.store.save(key, entry.body, entry.stored_at)
+        return entry
+
+    def _insert(self, key: str, entry: CacheEntry):
+        self._remove(key)
+        self.entries[key] = entry
+        self.total_bytes += entry.size
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+            # Evicted from memory but still on disk
+            self._checked.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+        self._checked.clear()
+        self.total_bytes = 0
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "store": self.store.info() if self.store is not None else None,
+        }
+
+
+cache = ResponseCache(
+    ttls=settings.cache_ttls,
+    max_entries=settings.cache_max_entries,
+    max_bytes=settings.cache_max_bytes,
+    store=store,
+)
@@ -1,50 +1,155 @@
+import argparse
 import asyncio
 import json
-from typing import Optional
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 import httpx
 from rich.console import Console
+from rich.live import Live
 from rich.table import Table
 from rich.prompt import Prompt, Confirm
 from rich import print as rprint
 
+from .locations import extract_member_locations
+from .models import MemberLocation
+
 console = Console()
 
 
+def _age(timestamp: Optional[float], now: float) -> str:
+    if timestamp is None:
+        return "-"
+    seconds = max(0, int(now - timestamp))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+class LocationTable:
+    """Member rows for the watch view.
+
+    Row text is only rebuilt for members whose data changed (or whose age label
+    ticked over), and the live display is only redrawn when some row differs.
+    Rows updated in the last few seconds are highlighted.
+    """
+
+    HIGHLIGHT_SECONDS = 3.0
+
+    def __init__(self, circle_names: Dict[str, str]):
+        self.circle_names = circle_names
+        self.members: Dict[str, MemberLocation] = {}
+        self.updated_at: Dict[str, float] = {}
+        self.rows: Dict[str, Tuple[str, ...]] = {}
+        self.status = ""
+        self.changed = asyncio.Event()
+
+    def update(self, locations: Iterable[MemberLocation]):
+        for location in locations:
+            previous = self.members.get(location.member_id)
+            if previous != location:
+                self.members[location.member_id] = location
+                self.updated_at[location.member_id] = time.time()
+                self.changed.set()
+
+    def replace_circle(self, circle_id: str, locations: List[MemberLocation]):
+        """Set a circle's members from a full listing, dropping any no longer in it."""
+        current = {location.member_id for location in locations}
+        self.remove([
+            member_id for member_id, location in self.members.items()
+            if location.circle_id == circle_id and member_id not in current
+        ])
+        self.update(locations)
+
+    def remove(self, member_ids: Iterable[str]):
+        for member_id in member_ids:
+            if self.members.pop(member_id, None) is not None:
+                self.updated_at.pop(member_id, None)
+                self.changed.set()
+
+    def set_status(self, status: str):
+        if status != self.status:
+            self.status = status
+            self.changed.set()
+
+    def refresh(self, now: float) -> bool:
+        """Recompute row text; True if anything visible changed since the last call."""
+        rows = {}
+        for member_id, location in self.members.items():
+            highlighted = now - self.updated_at.get(member_id, 0.0) < self.HIGHLIGHT_SECONDS
+            rows[member_id] = self._cells(location, now) + (str(highlighted),)
+        dirty = rows != self.rows or self.changed.is_set()
+        self.rows = rows
+        self.changed.clear()
+        return dirty
+
+    def _cells(self, location: MemberLocation, now: float) -> Tuple[str, ...]:
+        return (
+            self.circle_names.get(location.circle_id, location.circle_id[:8]),
+            location.name or location.member_id[:8],
+            f"{location.latitude:.5f}, {location.longitude:.5f}",
+            f"±{location.accuracy:.0f}m" if location.accuracy is not None else "-",
+            f"{location.battery:.0f}%" if location.battery is not None else "-",
+            _age(location.timestamp, now),
+        )
+
+    def render(self) -> Table:
+        table = Table(title="Member Locations", caption=self.status or None)
+        table.add_column("Circle", style="dim")
+        table.add_column("Name", style="green")
+        table.add_column("Position", style="cyan")
+        table.add_column("Accuracy", justify="right")
+        table.add_column("Battery", justify="right")
+        table.add_column("Age", justify="right")
+        for member_id in sorted(self.rows, key=lambda m: (self.rows[m][0], self.rows[m][1])):
+            *cells, highlighted = self.rows[member_id]
+            table.add_row(*cells, style="bold" if highlighted == "True" else None)
+        return table
+
+
 class Life360CLI:
     def __init__(self, base_url: str = "http://localhost:8000"):
         self.base_url = base_url
         self.transaction_id: Optional[str] = None
         self.bearer_token: Optional[str] = None
         self.circles: list = []
+        # One pooled client for the whole session so requests reuse connections
+        self.client = httpx.AsyncClient(
+            base_url=base_url, timeout=60.0,
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=8),
+        )
+
+    async def close(self):
+        await self.client.aclose()
         
     async def check_connection(self) -> bool:
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.base_url}/status")
-                data = response.json()
-                return data.get("connected", False)
+            response = await self.client.get("/status")
+            data = response.json()
+            return data.get("connected", False)
         except Exception as e:
             console.print(f"[red]Error checking connection: {e}[/red]")
             return False
             
     async def get_device_status(self):
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.base_url}/device/status")
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    table = Table(title="Device Status")
-                    table.add_column("Property", style="cyan")
-                    table.add_column("Value", style="green")
-                    
-                    table.add_row("Has Transaction", "✓" if data.get("has_transaction") else "✗")
-                    table.add_row("Has Bearer", "✓" if data.get("has_bearer") else "✗")
-                    table.add_row("Authenticated", "✓" if data.get("is_authenticated") else "✗")
-                    
-                    console.print(table)
-                else:
-                    console.print(f"[red]Failed to get status: {response.text}[/red]")
+            response = await self.client.get("/device/status")
+            if response.status_code == 200:
+                data = response.json()
+                
+                table = Table(title="Device Status")
+                table.add_column("Property", style="cyan")
+                table.add_column("Value", style="green")
+                
+                table.add_row("Has Transaction", "✓" if data.get("has_transaction") else "✗")
+                table.add_row("Has Bearer", "✓" if data.get("has_bearer") else "✗")
+                table.add_row("Authenticated", "✓" if data.get("is_authenticated") else "✗")
+                
+                console.print(table)
+            else:
+                console.print(f"[red]Failed to get status: {response.text}[/red]")
         except Exception as e:
             console.print(f"[red]Error: {e}[/red]")
             
@@ -53,18 +158,17 @@ class Life360CLI:
         country = Prompt.ask("Enter country code", default="1")
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/auth/send-otp",
-                    json={"phone": phone, "country": country}
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    self.transaction_id = data.get("transaction_id")
-                    console.print(f"[green]✓ OTP sent! Transaction ID: {self.transaction_id}[/green]")
-                else:
-                    console.print(f"[red]Failed to send OTP: {response.text}[/red]")
+            response = await self.client.post(
+                "/auth/send-otp",
+                json={"phone": phone, "country": country}
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                self.transaction_id = data.get("transaction_id")
+                console.print(f"[green]✓ OTP sent! Transaction ID: {self.transaction_id}[/green]")
+            else:
+                console.print(f"[red]Failed to send OTP: {response.text}[/red]")
         except Exception as e:
             console.print(f"[red]Error: {e}[/red]")
             
@@ -76,64 +180,61 @@ class Life360CLI:
         code = Prompt.ask("Enter OTP code")
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/auth/verify-otp",
-                    json={"transaction_id": self.transaction_id, "code": code}
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    self.bearer_token = data.get("bearer_token")
-                    console.print(f"[green]✓ Authenticated successfully![/green]")
-                    console.print(f"[dim]Bearer: {self.bearer_token[:20]}...[/dim]")
-                else:
-                    console.print(f"[red]Failed to verify OTP: {response.text}[/red]")
+            response = await self.client.post(
+                "/auth/verify-otp",
+                json={"transaction_id": self.transaction_id, "code": code}
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                self.bearer_token = data.get("bearer_token")
+                console.print(f"[green]✓ Authenticated successfully![/green]")
+                console.print(f"[dim]Bearer: {self.bearer_token[:20]}...[/dim]")
+            else:
+                console.print(f"[red]Failed to verify OTP: {response.text}[/red]")
         except Exception as e:
             console.print(f"[red]Error: {e}[/red]")
             
     async def get_profile(self):
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.base_url}/profile")
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    console.print("[green]User Profile:[/green]")
-                    console.print(json.dumps(data, indent=2))
-                else:
-                    console.print(f"[red]Failed to get profile: {response.text}[/red]")
+            response = await self.client.get("/profile")
+            
+            if response.status_code == 200:
+                data = response.json()
+                console.print("[green]User Profile:[/green]")
+                console.print(json.dumps(data, indent=2))
+            else:
+                console.print(f"[red]Failed to get profile: {response.text}[/red]")
         except Exception as e:
             console.print(f"[red]Error: {e}[/red]")
             
     async def get_circles(self):
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.base_url}/circles")
+            response = await self.client.get("/circles")
+            
+            if response.status_code == 200:
+                data = response.json()
+                self.circles = data.get("circles", [])
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    self.circles = data.get("circles", [])
-                    
-                    if not self.circles:
-                        console.print("[yellow]No circles found[/yellow]")
-                        return
-                    
-                    table = Table(title="Circles")
-                    table.add_column("#", style="cyan")
-                    table.add_column("Name", style="green")
-                    table.add_column("ID", style="dim")
-                    
-                    for idx, circle in enumerate(self.circles, 1):
-                        table.add_row(
-                            str(idx),
-                            circle.get("name", "Unknown"),
-                            circle.get("id", "")
-                        )
-                    
-                    console.print(table)
-                else:
-                    console.print(f"[red]Failed to get circles: {response.text}[/red]")
+                if not self.circles:
+                    console.print("[yellow]No circles found[/yellow]")
+                    return
+                
+                table = Table(title="Circles")
+                table.add_column("#", style="cyan")
+                table.add_column("Name", style="green")
+                table.add_column("ID", style="dim")
+                
+                for idx, circle in enumerate(self.circles, 1):
+                    table.add_row(
+                        str(idx),
+                        circle.get("name", "Unknown"),
+                        circle.get("id", "")
+                    )
+                
+                console.print(table)
+            else:
+                console.print(f"[red]Failed to get circles: {response.text}[/red]")
         except Exception as e:
             console.print(f"[red]Error: {e}[/red]")
             
@@ -163,18 +264,20 @@ class Life360CLI:
             return
         
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/locations",
-                    json={"circle_ids": circle_ids}
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    console.print("[green]Device Locations:[/green]")
-                    console.print(json.dumps(data, indent=2))
-                else:
-                    console.print(f"[red]Failed to get locations: {response.text}[/red]")
+            response = await self.client.post(
+                "/locations",
+                json={"circle_ids": circle_ids}
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                table = LocationTable({c.get("id", ""): c.get("name", "") for c in self.circles})
+                for circle_id in circle_ids:
+                    table.update(extract_member_locations(circle_id, data.get(circle_id)))
+                table.refresh(time.time())
+                console.print(table.render())
+            else:
+                console.print(f"[red]Failed to get locations: {response.text}[/red]")
         except Exception as e:
             console.print(f"[red]Error: {e}[/red]")
             
@@ -223,11 +326,153 @@ class Life360CLI:
             input()
 
 
-async def main():
-    cli = Life360CLI()
-    await cli.show_menu()
+    async def _circle_names(self) -> Dict[str, str]:
+        response = await self.client.get("/circles")
+        response.raise_for_status()
+        return {c.get("id", ""): c.get("name", "") for c in response.json().get("circles", [])}
+
+    async def watch(self, circle_ids: Optional[List[str]], interval: float, stream: bool):
+        """Live table of member locations, polled every interval or pushed over SSE."""
+        names = await self._circle_names()
+        circle_ids = circle_ids or list(names)
+        if not circle_ids:
+            console.print("[yellow]No circles found[/yellow]")
+            return
+        table = LocationTable(names)
+        if stream:
+            sources = [self._stream_circle(circle_id, table, interval) for circle_id in circle_ids]
+        else:
+            sources = [self._poll_locations(circle_ids, table, interval)]
+        tasks = [asyncio.ensure_future(source) for source in sources]
+        try:
+            with Live(table.render(), console=console, auto_refresh=False) as live:
+                while True:
+                    if table.refresh(time.time()):
+                        live.update(table.render(), refresh=True)
+                    # Wake on new data, or once a second so age labels tick over
+                    try:
+                        await asyncio.wait_for(table.changed.wait(), timeout=1.0)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _poll_locations(self, circle_ids: List[str], table: LocationTable, interval: float):
+        while True:
+            try:
+                response = await self.client.post(
+                    "/locations", params={"max_age": interval}, json={"circle_ids": circle_ids}
+                )
+                if response.status_code == 200:
+                    data = response.json()
+                    for circle_id in circle_ids:
+                        table.replace_circle(circle_id, extract_member_locations(circle_id, data.get(circle_id)))
+                    table.set_status(f"polled every {interval:g}s · last at {time.strftime('%H:%M:%S')}")
+                else:
+                    table.set_status(f"HTTP {response.status_code}: {response.text[:80]}")
+            except httpx.HTTPError as e:
+                table.set_status(f"Error: {e}")
+            await asyncio.sleep(interval)
+
+    async def _stream_circle(self, circle_id: str, table: LocationTable, retry: float):
+        """Follow /subscribe/locations for one circle, resuming from the last event id."""
+        last_event_id: Optional[str] = None
+        while True:
+            headers = {"Last-Event-ID": last_event_id} if last_event_id else {}
+            try:
+                async with self.client.stream(
+                    "GET", "/subscribe/locations", params={"circle_id": circle_id},
+                    headers=headers, timeout=httpx.Timeout(10.0, read=None),
+                ) as response:
+                    if response.status_code != 200:
+                        table.set_status(f"HTTP {response.status_code} subscribing to {circle_id[:8]}")
+                    else:
+                        table.set_status("streaming")
+                        event: Optional[str] = None
+                        async for line in response.aiter_lines():
+                            if line.startswith("id:"):
+                                last_event_id = line[3:].strip()
+                            elif line.startswith("event:"):
+                                event = line[6:].strip()
+                            elif line.startswith("data:") and event:
+                                payload = json.loads(line[5:])
+                                members = [MemberLocation(**m) for m in payload.get("members", [])]
+                                if event == "snapshot":
+                                    table.replace_circle(circle_id, members)
+                                else:
+                                    table.update(members)
+                                    table.remove(payload.get("removed", []))
+                                event = None
+            except httpx.HTTPError as e:
+                table.set_status(f"Stream error: {e}")
+            await asyncio.sleep(retry)
+
+    async def fetch(self, what: str, circle_ids: Optional[List[str]] = None, raw: bool = False) -> Any:
+        """One request's JSON for scripted use; locations are normalized unless raw."""
+        if what == "locations":
+            circle_ids = circle_ids or list(await self._circle_names())
+            response = await self.client.post("/locations", json={"circle_ids": circle_ids})
+        else:
+            path = {"status": "/status", "device": "/device/status", "profile": "/profile",
+                    "circles": "/circles"}[what]
+            response = await self.client.get(path)
+        response.raise_for_status()
+        data = response.json()
+        if what != "locations" or raw:
+            return data
+        return [
+            location.dict()
+            for circle_id in circle_ids
+            for location in extract_member_locations(circle_id, data.get(circle_id))
+        ]
+
+
+async def _run(args: argparse.Namespace) -> int:
+    cli = Life360CLI(args.url)
+    try:
+        if args.command == "watch":
+            await cli.watch(args.circle_ids, args.interval, args.stream)
+        elif args.command == "get":
+            try:
+                data = await cli.fetch(args.what, args.circle_ids, args.raw)
+            except httpx.HTTPStatusError as e:
+                print(json.dumps({"error": e.response.status_code, "detail": e.response.text}), file=sys.stderr)
+                return 1
+            except httpx.HTTPError as e:
+                print(json.dumps({"error": str(e)}), file=sys.stderr)
+                return 1
+            print(json.dumps(data, indent=None if args.compact else 2))
+        else:
+            await cli.show_menu()
+    finally:
+        await cli.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Life360 Remote Controller CLI")
+    parser.add_argument("--url", default="http://localhost:8000", help="server base URL")
+    commands = parser.add_subparsers(dest="command")
+
+    watch = commands.add_parser("watch", help="live table of member locations")
+    watch.add_argument("--circle", dest="circle_ids", action="append", help="circle id (repeatable; default all)")
+    watch.add_argument("--interval", type=float, default=5.0, help="seconds between polls / stream retries")
+    watch.add_argument("--stream", action="store_true", help="follow /subscribe/locations instead of polling")
+
+    get = commands.add_parser("get", help="fetch once and print JSON")
+    get.add_argument("what", choices=["status", "device", "profile", "circles", "locations"])
+    get.add_argument("--circle", dest="circle_ids", action="append", help="circle id (repeatable; default all)")
+    get.add_argument("--raw", action="store_true", help="print the device's location payload as-is")
+    get.add_argument("--compact", action="store_true", help="single-line JSON")
+
+    args = parser.parse_args()
+    try:
+        sys.exit(asyncio.run(_run(args)))
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
 
@@ -0,0 +1,104 @@
+import json
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union
+
+from pydantic import TypeAdapter
+from typing_extensions import TypedDict
+
+try:
+    import msgpack
+except ImportError:  # optional: pip install life360-remote[msgpack]
+    msgpack = None
+
+# Devices offer codecs as WebSocket subprotocols, e.g. "life360.msgpack"
+SUBPROTOCOL_PREFIX = "life360."
+
+
+class JsonCodec:
+    """Text frames carrying JSON; what the iOS app speaks by default."""
+    name = "json"
+    binary = False
+
+    def encode(self, message: Dict[str, Any]) -> str:
+        return json.dumps(message, separators=(",", ":"))
+
+    def decode(self, payload: Union[str, bytes]) -> Any:
+        return json.loads(payload)
+
+    def split(self, payload: Union[str, bytes]) -> Tuple[Any, Optional[bytes]]:
+        return self.decode(payload), None
+
+
+class MsgpackCodec:
+    """Binary frames carrying MessagePack."""
+    name = "msgpack"
+    binary = True
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, payload: Union[str, bytes]) -> Any:
+        return msgpack.unpackb(payload, raw=False)
+
+    def split(self, payload: Union[str, bytes]) -> Tuple[Any, Optional[bytes]]:
+        return self.decode(payload), None
+
+
+class Envelope(TypedDict, total=False):
+    command_id: str
+    status: Literal["success", "error", "pending"]
+    error: Optional[str]
+    timings: Optional[Dict[str, float]]
+    rate_limited: Optional[Dict[str, float]]
+
+
+# Built once; validates the envelope straight from JSON bytes
+ENVELOPE = TypeAdapter(Envelope)
+
+
+class LeanCodec:
+    """JSON commands out; responses back as the envelope, a newline, then the data.
+
+    Only the small envelope is parsed. The data stays as the JSON bytes the
+    device sent, so reads the server doesn't transform go out as the HTTP body
+    without being decoded and re-encoded.
+    """
+    name = "lean"
+    binary = False
+
+    def encode(self, message: Dict[str, Any]) -> str:
+        return json.dumps(message, separators=(",", ":"))
+
+    def decode(self, payload: Union[str, bytes]) -> Any:
+        envelope, raw = self.split(payload)
+        if raw is not None:
+            envelope["data"] = json.loads(raw)
+        return envelope
+
+    def split(self, payload: Union[str, bytes]) -> Tuple[Any, Optional[bytes]]:
+        """The validated envelope and the raw data bytes (None without data)."""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        # Compact JSON never contains a bare newline, so the first one ends the envelope
+        head, _, raw = payload.partition(b"\n")
+        return ENVELOPE.validate_json(head), raw or None
+
+
+JSON = JsonCodec()
+LEAN = LeanCodec()
+CODECS: Dict[str, Any] = {JSON.name: JSON, LEAN.name: LEAN}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def negotiate(offered: List[str], requested: Optional[str] = None) -> Tuple[Any, Optional[str]]:
+    """Pick a codec from the client's subprotocols (in its preference order) or ?codec=.
+
+    Returns the codec and the subprotocol to echo back in the handshake, if any.
+    Falls back to JSON when nothing offered is supported.
+    """
+    for subprotocol in offered:
+        if subprotocol.startswith(SUBPROTOCOL_PREFIX):
+            codec = CODECS.get(subprotocol[len(SUBPROTOCOL_PREFIX):])
+            if codec is not None:
+                return codec, subprotocol
+    return CODECS.get(requested or "", JSON), None
@@ -0,0 +1,187 @@
+import os
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from .models import CommandType
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    return value.strip().lower() in ("1", "true", "yes", "on") if value else default
+
+
+DEFAULT_CACHE_TTLS: Dict[str, float] = {
+    CommandType.GET_PROFILE.value: 300.0,
+    CommandType.GET_CIRCLES.value: 60.0,
+    CommandType.GET_CIRCLE_MEMBERS.value: 30.0,
+    CommandType.GET_DEVICE_LOCATIONS.value: 5.0,
+}
+
+# Life360 API calls per second allowed per account, keyed by endpoint class (see ratelimit.py)
+DEFAULT_RATE_LIMITS: Dict[str, float] = {
+    "locations": 0.5,
+    "members": 0.2,
+    "account": 0.2,
+    "auth": 0.05,
+}
+
+
+class Settings(BaseModel):
+    """Server tuning knobs, read from LIFE360_* environment variables."""
+    # Seconds a cached read stays fresh, keyed by CommandType value
+    cache_ttls: Dict[str, float] = dict(DEFAULT_CACHE_TTLS)
+    cache_max_entries: int = 512
+    cache_max_bytes: int = 32 * 1024 * 1024
+    # SQLite file keeping the last result of each read across restarts; disabled unless set
+    store_path: Optional[str] = None
+    # Seconds past its TTL a cached read may still be served while it is refreshed in
+    # the background, and while the phone is unreachable or failing
+    stale_while_revalidate: float = 60.0
+    stale_if_error: float = 86400.0
+    # Per-circle location fan-out: concurrent device commands and per-circle timeout
+    fanout_concurrency: int = 4
+    fanout_circle_timeout: float = 20.0
+    # Circles per BATCH command when POST /circles/members fetches many at once
+    members_batch_size: int = 8
+    # Seconds between shared background refreshes for subscribed circles
+    subscription_refresh_interval: float = 10.0
+    # Background prefetch of locations for "all" circles or a comma-separated list
+    # (disabled unless set). A circle refreshes every prefetch_min_interval seconds
+    # while a member moves more than prefetch_moving_meters, slowing to
+    # prefetch_max_interval when idle; all circles share prefetch_budget commands a minute
+    prefetch_circles: Optional[str] = None
+    prefetch_min_interval: float = 5.0
+    prefetch_max_interval: float = 120.0
+    prefetch_moving_meters: float = 25.0
+    prefetch_budget: float = 12.0
+    prefetch_members: bool = False
+    # Account (client id or pool) serving API calls that name no account and no known circle
+    default_account: str = "ios-app"
+    # Per-device admission control: concurrent commands and queued commands
+    scheduler_window: int = 4
+    scheduler_max_queue: int = 32
+    # Location history recording; disabled unless a directory is configured
+    history_dir: Optional[str] = None
+    history_segment_size: int = 65536
+    history_retention_days: float = 90.0
+    # Fraction of HTTP requests traced (X-Trace: 1 forces it) and how many traces to keep
+    trace_sample_rate: float = 0.01
+    trace_buffer_size: int = 256
+    # Command deadlines: timeout_default until enough round-trips are seen, then
+    # timeout_multiplier x the command type's p99, clamped to [timeout_min, timeout_max]
+    timeout_default: float = 30.0
+    timeout_min: float = 2.0
+    timeout_max: float = 60.0
+    timeout_multiplier: float = 3.0
+    # Re-send reads that pass their p95 to a second device in the pool; first answer wins
+    hedge_reads: bool = False
+    # Ping idle devices every heartbeat_interval seconds (0 disables) and drop those
+    # that don't answer within heartbeat_timeout
+    heartbeat_interval: float = 10.0
+    heartbeat_timeout: float = 5.0
+    # Seconds a dropped device's commands wait for it to reconnect, and how many may wait
+    reconnect_grace: float = 10.0
+    reconnect_queue_size: int = 32
+    # Directory for the worker broker's sockets and shared connection registry; set it to
+    # run uvicorn with several workers (LIFE360_WORKERS in main.py does this for you)
+    broker_dir: Optional[str] = None
+    # Seconds a worker trusts its cached answer to "which worker holds this device?"
+    broker_owner_ttl: float = 1.0
+    # Gzip HTTP responses of at least gzip_min_size bytes at gzip_level (0 disables), and
+    # offer permessage-deflate on device WebSockets
+    gzip_min_size: int = 1024
+    gzip_level: int = 6
+    ws_deflate: bool = True
+    # Token buckets in front of the phone's Life360 API calls: calls per second per
+    # endpoint class (0 = unlimited) and per circle, with burst_seconds of rate as burst.
+    # Commands wait up to max_wait for budget, then get a 429; an upstream 429 pauses
+    # for its Retry-After (or rate_limit_backoff seconds) and halves every rate. Off by
+    # default: the rates are conservative guesses, since Life360 doesn't publish its limits
+    rate_limit_enabled: bool = False
+    rate_limits: Dict[str, float] = dict(DEFAULT_RATE_LIMITS)
+    rate_limit_per_circle: float = 0.2
+    rate_limit_burst_seconds: float = 20.0
+    rate_limit_max_wait: float = 5.0
+    rate_limit_backoff: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        defaults = cls()
+        return cls(
+            cache_ttls={
+                command_type: _env_float(f"LIFE360_CACHE_TTL_{command_type.upper()}", ttl)
+                for command_type, ttl in DEFAULT_CACHE_TTLS.items()
+            },
+            cache_max_entries=_env_int("LIFE360_CACHE_MAX_ENTRIES", defaults.cache_max_entries),
+            cache_max_bytes=_env_int("LIFE360_CACHE_MAX_BYTES", defaults.cache_max_bytes),
+            store_path=os.getenv("LIFE360_STORE_PATH") or None,
+            stale_while_revalidate=_env_float(
+                "LIFE360_STALE_WHILE_REVALIDATE", defaults.stale_while_revalidate
+            ),
+            stale_if_error=_env_float("LIFE360_STALE_IF_ERROR", defaults.stale_if_error),
+            fanout_concurrency=_env_int("LIFE360_FANOUT_CONCURRENCY", defaults.fanout_concurrency),
+            fanout_circle_timeout=_env_float("LIFE360_FANOUT_CIRCLE_TIMEOUT", defaults.fanout_circle_timeout),
+            members_batch_size=_env_int("LIFE360_MEMBERS_BATCH_SIZE", defaults.members_batch_size),
+            subscription_refresh_interval=_env_float(
+                "LIFE360_SUBSCRIPTION_REFRESH_INTERVAL", defaults.subscription_refresh_interval
+            ),
+            prefetch_circles=os.getenv("LIFE360_PREFETCH_CIRCLES") or None,
+            prefetch_min_interval=_env_float("LIFE360_PREFETCH_MIN_INTERVAL", defaults.prefetch_min_interval),
+            prefetch_max_interval=_env_float("LIFE360_PREFETCH_MAX_INTERVAL", defaults.prefetch_max_interval),
+            prefetch_moving_meters=_env_float(
+                "LIFE360_PREFETCH_MOVING_METERS", defaults.prefetch_moving_meters
+            ),
+            prefetch_budget=_env_float("LIFE360_PREFETCH_BUDGET", defaults.prefetch_budget),
+            prefetch_members=_env_bool("LIFE360_PREFETCH_MEMBERS", defaults.prefetch_members),
+            default_account=os.getenv("LIFE360_DEFAULT_ACCOUNT") or defaults.default_account,
+            scheduler_window=_env_int("LIFE360_SCHEDULER_WINDOW", defaults.scheduler_window),
+            scheduler_max_queue=_env_int("LIFE360_SCHEDULER_MAX_QUEUE", defaults.scheduler_max_queue),
+            history_dir=os.getenv("LIFE360_HISTORY_DIR") or None,
+            history_segment_size=_env_int("LIFE360_HISTORY_SEGMENT_SIZE", defaults.history_segment_size),
+            history_retention_days=_env_float(
+                "LIFE360_HISTORY_RETENTION_DAYS", defaults.history_retention_days
+            ),
+            trace_sample_rate=_env_float("LIFE360_TRACE_SAMPLE_RATE", defaults.trace_sample_rate),
+            trace_buffer_size=_env_int("LIFE360_TRACE_BUFFER_SIZE", defaults.trace_buffer_size),
+            timeout_default=_env_float("LIFE360_TIMEOUT_DEFAULT", defaults.timeout_default),
+            timeout_min=_env_float("LIFE360_TIMEOUT_MIN", defaults.timeout_min),
+            timeout_max=_env_float("LIFE360_TIMEOUT_MAX", defaults.timeout_max),
+            timeout_multiplier=_env_float("LIFE360_TIMEOUT_MULTIPLIER", defaults.timeout_multiplier),
+            hedge_reads=_env_bool("LIFE360_HEDGE_READS", defaults.hedge_reads),
+            heartbeat_interval=_env_float("LIFE360_HEARTBEAT_INTERVAL", defaults.heartbeat_interval),
+            heartbeat_timeout=_env_float("LIFE360_HEARTBEAT_TIMEOUT", defaults.heartbeat_timeout),
+            reconnect_grace=_env_float("LIFE360_RECONNECT_GRACE", defaults.reconnect_grace),
+            reconnect_queue_size=_env_int("LIFE360_RECONNECT_QUEUE_SIZE", defaults.reconnect_queue_size),
+            broker_dir=os.getenv("LIFE360_BROKER_DIR") or None,
+            broker_owner_ttl=_env_float("LIFE360_BROKER_OWNER_TTL", defaults.broker_owner_ttl),
+            gzip_min_size=_env_int("LIFE360_GZIP_MIN_SIZE", defaults.gzip_min_size),
+            gzip_level=_env_int("LIFE360_GZIP_LEVEL", defaults.gzip_level),
+            ws_deflate=_env_bool("LIFE360_WS_DEFLATE", defaults.ws_deflate),
+            rate_limit_enabled=_env_bool("LIFE360_RATE_LIMIT_ENABLED", defaults.rate_limit_enabled),
+            rate_limits={
+                endpoint_class: _env_float(f"LIFE360_RATE_LIMIT_{endpoint_class.upper()}", rate)
+                for endpoint_class, rate in DEFAULT_RATE_LIMITS.items()
+            },
+            rate_limit_per_circle=_env_float("LIFE360_RATE_LIMIT_PER_CIRCLE", defaults.rate_limit_per_circle),
+            rate_limit_burst_seconds=_env_float(
+                "LIFE360_RATE_LIMIT_BURST_SECONDS", defaults.rate_limit_burst_seconds
+            ),
+            rate_limit_max_wait=_env_float("LIFE360_RATE_LIMIT_MAX_WAIT", defaults.rate_limit_max_wait),
+            rate_limit_backoff=_env_float("LIFE360_RATE_LIMIT_BACKOFF", defaults.rate_limit_backoff),
+        )
+
+
+load_dotenv()
+settings = Settings.from_env()
@@ -0,0 +1,187 @@
+import itertools
+import math
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from .models import Geofence, GeofenceEvent, MemberLocation
+
+EARTH_RADIUS_M = 6_371_000.0
+METERS_PER_DEGREE = 111_320.0
+
+Cell = Tuple[int, int]
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GeoIndex:
+    """Latest member positions bucketed into a fixed lat/lon grid, plus geofences.
+
+    Positions and fences are both indexed by grid cell, so a position update
+    only tests the fences overlapping its cell, and a radius query only visits
+    the cells its bounding box covers. Longitude cells wrap at ±180, so a box
+    across the antimeridian covers cells on both sides (cell_degrees should
+    divide 360). A fence covering more than max_fence_cells cells (very large,
+    or near a pole) is kept unindexed and tested on every update instead.
+    """
+
+    def __init__(self, cell_degrees: float = 0.01, max_events: int = 1000, max_fence_cells: int = 4096):
+        self.cell_degrees = cell_degrees
+        # Longitude cells around the globe; cell longitudes are taken modulo this
+        self.lon_cells = max(1, round(360 / cell_degrees))
+        self.max_fence_cells = max_fence_cells
+        self.positions: Dict[str, MemberLocation] = {}
+        self.member_cells: Dict[str, Cell] = {}
+        self.cells: Dict[Cell, Set[str]] = {}
+        self.fences: Dict[str, Geofence] = {}
+        self.fence_cells: Dict[Cell, Set[str]] = {}
+        # Fences too large to index by cell
+        self.large_fences: Set[str] = set()
+        # member_id -> ids of fences the member is currently inside
+        self.inside: Dict[str, Set[str]] = {}
+        self.events: Deque[GeofenceEvent] = deque(maxlen=max_events)
+        self._event_ids = itertools.count(1)
+
+    def _grid(self, latitude: float, longitude: float) -> Cell:
+        """Grid coordinates before wrapping: longitudes past ±180 keep counting."""
+        return (math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees))
+
+    def _cell(self, latitude: float, longitude: float) -> Cell:
+        row, column = self._grid(latitude, longitude)
+        return row, column % self.lon_cells
+
+    def _cells_within(self, latitude: float, longitude: float, radius_m: float) -> Iterable[Cell]:
+        dlat = radius_m / METERS_PER_DEGREE
+        dlon = radius_m / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6))
+        lat_lo, lon_lo = self._grid(latitude - dlat, longitude - dlon)
+        lat_hi, lon_hi = self._grid(latitude + dlat, longitude + dlon)
+        if lon_hi - lon_lo + 1 >= self.lon_cells:
+            lon_cells: Iterable[int] = range(self.lon_cells)
+        else:
+            lon_cells = [lon % self.lon_cells for lon in range(lon_lo, lon_hi + 1)]
+        return itertools.product(range(lat_lo, lat_hi + 1), lon_cells)
+
+    def _cell_count(self, latitude: float, longitude: float, radius_m: float) -> int:
+        dlat = radius_m / METERS_PER_DEGREE
+        dlon = radius_m / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6))
+        lon_count = min(math.ceil(2 * dlon / self.cell_degrees + 1), self.lon_cells)
+        return math.ceil(2 * dlat / self.cell_degrees + 1) * lon_count
+
+    def watching(self) -> bool:
+        """Whether updates must be applied as they arrive: only fences emit events.
+
+        Without fences, positions can wait until the next query.
+        """
+        return bool(self.fences)
+
+    def update(self, locations: Iterable[MemberLocation]):
+        for location in locations:
+            member_id = location.member_id
+            cell = self._cell(location.latitude, location.longitude)
+            previous = self.member_cells.get(member_id)
+            if previous != cell:
+                if previous is not None:
+                    self.cells[previous].discard(member_id)
+                    if not self.cells[previous]:
+                        del self.cells[previous]
+                self.cells.setdefault(cell, set()).add(member_id)
+                self.member_cells[member_id] = cell
+            self.positions[member_id] = location
+            self._check_fences(location, itertools.chain(self.fence_cells.get(cell, ()), self.large_fences))
+
+    def _check_fences(self, location: MemberLocation, candidates: Iterable[str]):
+        now_inside = {
+            fence_id for fence_id in candidates
+            if self._contains(self.fences[fence_id], location)
+        }
+        was_inside = self.inside.get(location.member_id, set())
+        for fence_id in now_inside - was_inside:
+            self._emit("enter", fence_id, location)
+        for fence_id in was_inside - now_inside:
+            self._emit("exit", fence_id, location)
+        if now_inside:
+            self.inside[location.member_id] = now_inside
+        else:
+            self.inside.pop(location.member_id, None)
+
+    def _contains(self, fence: Geofence, location: MemberLocation) -> bool:
+        distance = haversine_m(fence.latitude, fence.longitude, location.latitude, location.longitude)
+        return distance <= fence.radius
+
+    def _emit(self, kind: str, fence_id: str, location: MemberLocation):
+        self.events.append(GeofenceEvent(
+            id=next(self._event_ids),
+            type=kind,
+            fence_id=fence_id,
+            member_id=location.member_id,
+            circle_id=location.circle_id,
+            latitude=location.latitude,
+            longitude=location.longitude,
+            timestamp=location.timestamp or time.time(),
+        ))
+
+    def nearby(self, latitude: float, longitude: float, radius_m: float,
+               limit: Optional[int] = None) -> List[Tuple[float, MemberLocation]]:
+        """Members within radius_m of a point as (distance_m, location), nearest first."""
+        if self._cell_count(latitude, longitude, radius_m) > len(self.cells):
+            candidates: Iterable[str] = self.positions
+        else:
+            candidates = itertools.chain.from_iterable(
+                self.cells.get(cell, ()) for cell in self._cells_within(latitude, longitude, radius_m)
+            )
+        matches = []
+        for member_id in candidates:
+            location = self.positions[member_id]
+            distance = haversine_m(latitude, longitude, location.latitude, location.longitude)
+            if distance <= radius_m:
+                matches.append((distance, location))
+        matches.sort(key=lambda match: match[0])
+        return matches[:limit] if limit else matches
+
+    def add_fence(self, name: str, latitude: float, longitude: float, radius: float,
+                  fence_id: Optional[str] = None) -> Geofence:
+        """Register a circular fence; members already inside are not reported as entering."""
+        fence = Geofence(
+            id=fence_id or str(uuid.uuid4()), name=name,
+            latitude=latitude, longitude=longitude, radius=radius,
+        )
+        self.remove_fence(fence.id)
+        self.fences[fence.id] = fence
+        if self._cell_count(latitude, longitude, radius) > self.max_fence_cells:
+            self.large_fences.add(fence.id)
+        else:
+            for cell in self._cells_within(latitude, longitude, radius):
+                self.fence_cells.setdefault(cell, set()).add(fence.id)
+        for _, location in self.nearby(latitude, longitude, radius):
+            self.inside.setdefault(location.member_id, set()).add(fence.id)
+        return fence
+
+    def remove_fence(self, fence_id: str) -> bool:
+        fence = self.fences.pop(fence_id, None)
+        if fence is None:
+            return False
+        if fence_id in self.large_fences:
+            self.large_fences.discard(fence_id)
+        else:
+            for cell in self._cells_within(fence.latitude, fence.longitude, fence.radius):
+                fence_ids = self.fence_cells.get(cell)
+                if fence_ids is not None:
+                    fence_ids.discard(fence_id)
+                    if not fence_ids:
+                        del self.fence_cells[cell]
+        for member_id in list(self.inside):
+            self.inside[member_id].discard(fence_id)
+            if not self.inside[member_id]:
+                del self.inside[member_id]
+        return True
+
+    def events_since(self, since: int = 0) -> List[GeofenceEvent]:
+        return [event for event in self.events if event.id > since]
+
@@ -0,0 +1,313 @@
+import atexit
+import bisect
+import hashlib
+import mmap
+import os
+import queue
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from .config import settings
+from .log import get_logger
+from .models import MemberLocation
+
+logger = get_logger("history")
+
+# Column name -> array typecode. Coordinates are stored as int32 microdegrees
+# (~11cm resolution) so a sample costs 20 bytes on disk.
+COLUMNS: Dict[str, str] = {"ts": "d", "lat": "i", "lon": "i", "acc": "f"}
+MICRODEGREES = 1_000_000
+_UNSAFE = re.compile(r"[^A-Za-z0-9_-]")
+
+
+class _MemberLog:
+    """Write-side state for one member: its segments and the last stored sample."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # Segment files are named after the millisecond timestamp of their first sample
+        self.segments: List[int] = sorted(
+            int(name[:-3]) for name in os.listdir(directory) if name.endswith(".ts")
+        )
+        self.count = 0
+        self.last_ts = float("-inf")
+        if self.segments:
+            self.count = _row_count(self.path(self.segments[-1]))
+            if self.count:
+                with _ColumnView(self.path(self.segments[-1]), "ts") as ts:
+                    self.last_ts = ts.values[self.count - 1]
+
+    def path(self, segment: int) -> str:
+        return os.path.join(self.directory, str(segment))
+
+
+def _row_count(base: str) -> int:
+    # A crash between column writes leaves ragged files; the shortest column wins
+    return min(
+        os.path.getsize(f"{base}.{column}") // array(code).itemsize
+        if os.path.exists(f"{base}.{column}") else 0
+        for column, code in COLUMNS.items()
+    )
+
+
+def _slice(values: memoryview, lo: int, hi: int) -> list:
+    with values[lo:hi] as window:
+        return window.tolist()
+
+
+class _ColumnView:
+    """Read-only memory map of one column file, viewed as a typed array."""
+
+    def __init__(self, base: str, column: str):
+        self.file = open(f"{base}.{column}", "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.values = memoryview(self.map).cast(COLUMNS[column]) if self.map else memoryview(b"").cast("B")
+
+    def close(self):
+        self.values.release()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self) -> "_ColumnView":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HistoryStore:
+    """Append-only per-member location history in columnar, memory-mapped segments.
+
+    Each member gets a directory of segments (under accounts/<account>/ for
+    accounts other than the default); a segment is one file per column
+    holding up to segment_size samples in time order. Range queries bisect the
+    segment start times, then the timestamp column of each overlapping segment,
+    so they never scan outside the requested window. Segments older than the
+    retention window are deleted as new ones are started.
+
+    Samples are queued to a background thread that appends them in batches
+    through column files it keeps open (for up to max_open members), so the
+    event loop never waits on disk. Queries see a sample once it is written.
+    """
+
+    def __init__(self, root: str, segment_size: int = 65536, retention_days: float = 90.0,
+                 max_open: int = 128):
+        self.root = root
+        self.segment_size = segment_size
+        self.retention_seconds = retention_days * 86400
+        self.max_open = max_open
+        # Member directory -> its log
+        self.members: Dict[str, _MemberLog] = {}
+        self.stats: Dict[str, int] = {"recorded": 0, "skipped": 0, "written": 0}
+        # "written" is counted on the writer thread
+        self._stats_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        # (segment base path, row) to append, or (base path, None) to delete the segment
+        self._queue: "queue.SimpleQueue[Optional[Tuple[str, Optional[dict]]]]" = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_loop, name="life360-history", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _directory(self, member_id: str, account: Optional[str] = None) -> str:
+        root = self.root if account is None else os.path.join(self.root, "accounts", _dirname(account))
+        return os.path.join(root, _dirname(member_id))
+
+    def _log(self, directory: str) -> _MemberLog:
+        log = self.members.get(directory)
+        if log is None:
+            log = self.members[directory] = _MemberLog(directory)
+        return log
+
+    def record(self, locations: Iterable[MemberLocation], account: Optional[str] = None):
+        """Append samples, dropping any not newer than the member's last stored one."""
+        for location in locations:
+            timestamp = location.timestamp or time.time()
+            log = self._log(self._directory(location.member_id, account))
+            if timestamp <= log.last_ts:
+                self.stats["skipped"] += 1
+                continue
+            if not log.segments or log.count >= self.segment_size:
+                log.segments.append(int(timestamp * 1000))
+                log.count = 0
+                self._prune(log, timestamp)
+            row = {
+                "ts": timestamp,
+                "lat": round(location.latitude * MICRODEGREES),
+                "lon": round(location.longitude * MICRODEGREES),
+                "acc": location.accuracy if location.accuracy is not None else -1.0,
+            }
+            self._queue.put((log.path(log.segments[-1]), row))
+            log.count += 1
+            log.last_ts = timestamp
+            self.stats["recorded"] += 1
+
+    def _prune(self, log: _MemberLog, now: float):
+        cutoff_ms = (now - self.retention_seconds) * 1000
+        # A segment can go once the next one starts before the cutoff
+        while len(log.segments) > 1 and log.segments[1] < cutoff_ms:
+            self._queue.put((log.path(log.segments.pop(0)), None))
+
+    def _write_loop(self):
+        # Member directory -> (segment base path, its open column files), least recent first
+        files: "OrderedDict[str, Tuple[str, Dict[str, BinaryIO]]]" = OrderedDict()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            # Gather whatever else is queued so each segment gets one write per column
+            batch = [item]
+            stop = False
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            rows: Dict[str, List[dict]] = {}
+            for base, row in batch:
+                if row is not None:
+                    rows.setdefault(base, []).append(row)
+                else:
+                    rows.pop(base, None)
+                    self._remove_segment(files, base)
+            for base, samples in rows.items():
+                try:
+                    columns = self._open(files, base)
+                    for column, code in COLUMNS.items():
+                        array(code, [sample[column] for sample in samples]).tofile(columns[column])
+                    for f in columns.values():
+                        f.flush()
+                    with self._stats_lock:
+                        self.stats["written"] += len(samples)
+                except OSError as e:
+                    logger.warning(f"✗ Failed to record location history: {e}")
+            if stop:
+                break
+        for _, columns in files.values():
+            _close_all(columns)
+
+    def _open(self, files: "OrderedDict[str, Tuple[str, Dict[str, BinaryIO]]]", base: str) -> Dict[str, BinaryIO]:
+        directory = os.path.dirname(base)
+        current = files.pop(directory, None)
+        if current is not None and current[0] != base:
+            # The member moved on to a new segment
+            _close_all(current[1])
+            current = None
+        if current is None:
+            while len(files) >= self.max_open:
+                _close_all(files.popitem(last=False)[1][1])
+            current = (base, {column: open(f"{base}.{column}", "ab") for column in COLUMNS})
+        files[directory] = current
+        return current[1]
+
+    def _remove_segment(self, files: "OrderedDict[str, Tuple[str, Dict[str, BinaryIO]]]", base: str):
+        directory = os.path.dirname(base)
+        if directory in files and files[directory][0] == base:
+            _close_all(files.pop(directory)[1])
+        for column in COLUMNS:
+            try:
+                os.remove(f"{base}.{column}")
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Write out queued samples and close the column files."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+
+    def query(self, member_id: str, start: Optional[float] = None, end: Optional[float] = None,
+              limit: Optional[int] = None, account: Optional[str] = None) -> List[dict]:
+        """Samples for member_id with start <= timestamp <= end, oldest first."""
+        directory = self._directory(member_id, account)
+        log = self.members.get(directory)
+        if log is None:
+            if not os.path.isdir(directory):
+                return []
+            log = self._log(directory)
+        start = float("-inf") if start is None else start
+        end = float("inf") if end is None else end
+        segments = log.segments
+        # Last segment starting at or before `start` may still hold samples in range
+        first = max(0, bisect.bisect_right(segments, start * 1000) - 1)
+        samples: List[dict] = []
+        for segment in segments[first:]:
+            if segment > end * 1000:
+                break
+            samples.extend(self._read_segment(log.path(segment), start, end))
+            if limit is not None and len(samples) >= limit:
+                return samples[:limit]
+        return samples
+
+    def _read_segment(self, base: str, start: float, end: float) -> List[dict]:
+        rows = _row_count(base)
+        if not rows:
+            return []
+        views: Dict[str, _ColumnView] = {}
+        try:
+            for column in COLUMNS:
+                views[column] = _ColumnView(base, column)
+            with views["ts"].values[:rows] as ts:
+                lo = bisect.bisect_left(ts, start)
+                hi = bisect.bisect_right(ts, end)
+            timestamps, lat, lon, acc = (
+                _slice(views[column].values, lo, hi)
+                for column in ("ts", "lat", "lon", "acc")
+            )
+        finally:
+            for view in views.values():
+                view.close()
+        return [
+            {
+                "timestamp": timestamps[i],
+                "latitude": lat[i] / MICRODEGREES,
+                "longitude": lon[i] / MICRODEGREES,
+                "accuracy": acc[i] if acc[i] >= 0 else None,
+            }
+            for i in range(len(timestamps))
+        ]
+
+    def listener(self, locations: List[MemberLocation], account: Optional[str] = None):
+        try:
+            self.record(locations, account)
+        except OSError as e:
+            logger.warning(f"✗ Failed to record location history: {e}")
+
+    def info(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {**self.stats, "members": len(self.members)}
+
+
+def _dirname(name: str) -> str:
+    # A readable prefix for whoever browses the directory, and a digest of the
+    # exact name so names differing only in unsafe characters never share one
+    digest = hashlib.sha256(name.encode()).hexdigest()[:16]
+    return f"{_UNSAFE.sub('_', name)[:48]}-{digest}"
+
+
+def _close_all(columns: Dict[str, BinaryIO]):
+    for f in columns.values():
+        f.close()
+
+
+def create_history_store() -> Optional[HistoryStore]:
+    if not settings.history_dir:
+        return None
+    return HistoryStore(
+        settings.history_dir,
+        segment_size=settings.history_segment_size,
+        retention_days=settings.history_retention_days,
+    )
+
+
+history = create_history_store()
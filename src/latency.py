@@ -0,0 +1,161 @@
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional
+
+from .models import CommandType
+
+# Header carrying the caller's time budget for a request, in seconds
+DEADLINE_HEADER = "x-request-timeout"
+
+# time.monotonic() by which the current HTTP request must be answered, if the caller set one
+_deadline: ContextVar[Optional[float]] = ContextVar("life360_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """A command ran out of its time budget before the device answered."""
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class LatencyTracker:
+    """Rolling device round-trip times per command type.
+
+    Deadlines are `multiplier` times the observed p99, clamped to [floor, ceiling];
+    until `min_samples` round-trips have been seen a type gets the default instead.
+    """
+
+    def __init__(self, default: float = 30.0, floor: float = 2.0, ceiling: float = 60.0,
+                 multiplier: float = 3.0, window: int = 200, min_samples: int = 20):
+        self.default = default
+        self.floor = floor
+        self.ceiling = ceiling
+        self.multiplier = multiplier
+        self.window = window
+        self.min_samples = min_samples
+        self.samples: Dict[CommandType, Deque[float]] = {}
+
+    def observe(self, command_type: CommandType, seconds: float):
+        samples = self.samples.get(command_type)
+        if samples is None:
+            samples = self.samples[command_type] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def percentile(self, command_type: CommandType, fraction: float) -> Optional[float]:
+        samples = self.samples.get(command_type)
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def deadline(self, command_type: CommandType) -> float:
+        p99 = self.percentile(command_type, 0.99)
+        if p99 is None:
+            return self.default
+        return min(self.ceiling, max(self.floor, p99 * self.multiplier))
+
+    def hedge_delay(self, command_type: CommandType) -> Optional[float]:
+        """How long to wait before re-sending a read elsewhere: its p95, once known."""
+        return self.percentile(command_type, 0.95)
+
+    def info(self) -> Dict[str, Any]:
+        info = {}
+        for command_type in self.samples:
+            p50, p95, p99 = (self.percentile(command_type, f) for f in (0.5, 0.95, 0.99))
+            info[command_type.value] = {
+                "samples": len(self.samples[command_type]),
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+                "deadline_s": round(self.deadline(command_type), 2),
+            }
+        return info
+
+
+class DeadlineMiddleware:
+    """ASGI middleware reading `X-Request-Timeout: <seconds>` into the request's deadline.
+
+    Device commands made while handling the request never wait past it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope.get("headers", []):
+                if name == DEADLINE_HEADER.encode():
+                    try:
+                        _deadline.set(time.monotonic() + float(value))
+                    except ValueError:
+                        pass
+                    break
+        await self.app(scope, receive, send)
+
+
+class DisconnectMiddleware:
+    """ASGI middleware cancelling a request's handler as soon as its client disconnects.
+
+    The cancellation reaches the device commands the handler is waiting on, which
+    free their slots and tell the phone to drop the work. The abandoned request is
+    recorded with status 499. The middleware reads the request itself and hands
+    the body to the app, so a hang-up is noticed even by handlers that never call
+    receive (GET endpoints, for one).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # Request messages read ahead of the app, in order
+        messages: asyncio.Queue = asyncio.Queue()
+        state = {"started": False, "finished": False, "gone": False, "disconnect": None}
+
+        async def receive_wrapper():
+            if messages.empty() and state["disconnect"] is not None:
+                return state["disconnect"]
+            return await messages.get()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["finished"] = True
+            await send(message)
+
+        handler = asyncio.ensure_future(self.app(scope, receive_wrapper, send_wrapper))
+
+        async def watch():
+            # Drain the body (empty for a GET), then wait for the disconnect that follows it
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    state["disconnect"] = message
+                    break
+            if not state["finished"]:
+                state["gone"] = True
+                handler.cancel()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not state["gone"]:
+                # The server itself is cancelling us
+                handler.cancel()
+                raise
+            if not state["started"]:
+                # Never reaches the client, but metrics and traces see the request end
+                await send({"type": "http.response.start", "status": 499, "headers": []})
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            watcher.cancel()
@@ -1,33 +1,140 @@
+import asyncio
 import uuid
-from typing import Optional, List, Dict, Any
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, Tuple, Union
 
 from .models import (
-    Command, CommandType, Response, ResponseStatus,
+    Command, CommandType, Response, ResponseStatus, READ_COMMANDS,
     SendOTPParams, VerifyOTPParams, GetCircleMembersParams,
-    GetDeviceLocationsParams, StatusData, CirclesData
+    GetDeviceLocationsParams, StatusData, CirclesData, MemberLocation, normalize_params
 )
+from .config import settings
+from .latency import DeadlineExceeded
+from .locations import extract_member_locations
+from .scheduler import QueueFull
+from .tracing import tracer
 from .websocket_handler import manager
 
 class Life360Service:
-    
+
+    # Location responses kept undecoded while no listener needs them right away
+    MAX_DEFERRED = 64
+
     def __init__(self, client_id: str = "ios-app"):
         self.client_id = client_id
+        self.location_listeners: List[Callable[[List[MemberLocation]], None]] = []
+        self.circles_listeners: List[Callable[[List[Dict[str, Any]]], None]] = []
+        # Callables saying whether some listener needs each location response as it arrives
+        self.location_demand: List[Callable[[], bool]] = []
+        # Latest undecoded location response per circle list, oldest first
+        self.deferred: "OrderedDict[str, Response]" = OrderedDict()
+
+    def add_location_listener(self, listener: Callable[[List[MemberLocation]], None],
+                              needed: Optional[Callable[[], bool]] = None):
+        """Call listener with the normalized members of every location response seen.
+
+        If needed is given and returns False, responses are kept undecoded
+        until flush_locations(), so lean reads don't pay for a decode nobody
+        looks at. The listener then sees only the latest response per circle list.
+        """
+        self.location_listeners.append(listener)
+        self.location_demand.append(needed or (lambda: True))
+
+    def add_circles_listener(self, listener: Callable[[List[Dict[str, Any]]], None]):
+        """Call listener with the circle list of every get_circles response seen."""
+        self.circles_listeners.append(listener)
+
+    def _publish_circles(self, data: Any):
+        circles = data.get("circles") if isinstance(data, dict) else None
+        if not isinstance(circles, list):
+            return
+        for listener in self.circles_listeners:
+            try:
+                listener(circles)
+            except Exception as e:
+                print(f"Circles listener failed: {e}")
+
+    def _publish_locations(self, data: Any):
+        if not self.location_listeners or not isinstance(data, dict):
+            return
+        for circle_id, payload in data.items():
+            if not isinstance(payload, dict) or set(payload) == {"error"}:
+                continue
+            locations = extract_member_locations(circle_id, payload)
+            for listener in self.location_listeners:
+                try:
+                    listener(locations)
+                except Exception as e:
+                    print(f"Location listener failed: {e}")
         
+    def _publish_response_locations(self, response: Response):
+        try:
+            self._publish_locations(response.load_data())
+        except Exception as e:
+            print(f"Location listener failed: {e}")
+
+    def flush_locations(self):
+        """Hand deferred location responses to the listeners, oldest first."""
+        while self.deferred:
+            self._publish_response_locations(self.deferred.popitem(last=False)[1])
+
+    def _listen_to_locations(self, params: Optional[dict], response: Response):
+        if any(needed() for needed in self.location_demand):
+            self.flush_locations()
+            # After the caller has its response, so raw passthrough never waits on a decode
+            asyncio.get_running_loop().call_soon(self._publish_response_locations, response)
+            return
+        key = normalize_params(params)
+        self.deferred.pop(key, None)
+        self.deferred[key] = response
+        if len(self.deferred) > self.MAX_DEFERRED:
+            self.deferred.popitem(last=False)
+
     def _generate_command_id(self) -> str:
         return str(uuid.uuid4())
         
-    async def _send_command(self, command_type: CommandType, params: Optional[dict] = None) -> Response:
+    async def _send_command(self, command_type: CommandType, params: Optional[dict] = None,
+                            timeout: Optional[float] = None, raw: bool = False) -> Response:
         command = Command(
             command_id=self._generate_command_id(),
             type=command_type,
             params=params
         )
-        return await manager.send_command(self.client_id, command)
+        with tracer.span("service.send_command", command=command_type.value):
+            response = await manager.send_command(
+                self.client_id, command, timeout=timeout,
+                coalesce=command_type in READ_COMMANDS, hedge=command_type in READ_COMMANDS,
+                raw=raw,
+            )
+        if (command_type == CommandType.GET_DEVICE_LOCATIONS and response.status == ResponseStatus.SUCCESS
+                and self.location_listeners):
+            self._listen_to_locations(params, response)
+        elif command_type == CommandType.GET_CIRCLES and response.status == ResponseStatus.SUCCESS:
+            self._publish_circles(response.load_data())
+        return response
         
+    async def _send_batch(self, requests: List[Tuple[CommandType, Optional[dict]]],
+                          timeout: Optional[float] = None) -> List[Response]:
+        commands = [
+            Command(command_id=self._generate_command_id(), type=command_type, params=params)
+            for command_type, params in requests
+        ]
+        responses = await manager.send_batch(self.client_id, commands, timeout=timeout)
+        for command, response in zip(commands, responses):
+            if command.type == CommandType.GET_DEVICE_LOCATIONS and response.status == ResponseStatus.SUCCESS:
+                # Anything deferred is older than this
+                self.flush_locations()
+                self._publish_locations(response.data)
+            elif command.type == CommandType.GET_CIRCLES and response.status == ResponseStatus.SUCCESS:
+                self._publish_circles(response.data)
+        return responses
+
     async def ping(self) -> bool:
         try:
             response = await self._send_command(CommandType.PING)
             return response.status == ResponseStatus.SUCCESS
+        except (QueueFull, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"Ping failed: {e}")
             return False
@@ -38,6 +145,8 @@ class Life360Service:
             if response.status == ResponseStatus.SUCCESS and response.data:
                 return StatusData(**response.data)
             return None
+        except (QueueFull, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"Get status failed: {e}")
             return None
@@ -51,6 +160,8 @@ class Life360Service:
             else:
                 print(f"Send OTP failed: {response.error}")
                 return None
+        except (QueueFull, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"Send OTP error: {e}")
             return None
@@ -64,18 +175,22 @@ class Life360Service:
             else:
                 print(f"Verify OTP failed: {response.error}")
                 return None
+        except (QueueFull, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"Verify OTP error: {e}")
             return None
             
-    async def get_profile(self) -> Optional[Dict[str, Any]]:
+    async def get_profile(self, raw: bool = False) -> Optional[Union[Dict[str, Any], bytes]]:
         try:
-            response = await self._send_command(CommandType.GET_PROFILE)
+            response = await self._send_command(CommandType.GET_PROFILE, raw=raw)
             if response.status == ResponseStatus.SUCCESS:
-                return response.data
+                return response.raw_data if raw else response.data
             else:
                 print(f"Get profile failed: {response.error}")
                 return None
+        except (QueueFull, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"Get profile error: {e}")
             return None
@@ -88,33 +203,221 @@ class Life360Service:
             else:
                 print(f"Get circles failed: {response.error}")
                 return None
+        except (QueueFull, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"Get circles error: {e}")
             return None
             
-    async def get_circle_members(self, circle_id: str) -> Optional[Dict[str, Any]]:
+    async def get_circle_members(
+        self, circle_id: str, raw: bool = False
+    ) -> Optional[Union[Dict[str, Any], bytes]]:
         try:
             params = GetCircleMembersParams(circle_id=circle_id)
-            response = await self._send_command(CommandType.GET_CIRCLE_MEMBERS, params.dict())
+            response = await self._send_command(CommandType.GET_CIRCLE_MEMBERS, params.dict(), raw=raw)
             if response.status == ResponseStatus.SUCCESS:
-                return response.data
+                return response.raw_data if raw else response.data
             else:
                 print(f"Get circle members failed: {response.error}")
                 return None
+        except (QueueFull, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"Get circle members error: {e}")
             return None
             
-    async def get_device_locations(self, circle_ids: List[str]) -> Optional[Dict[str, Any]]:
+    async def get_device_locations(
+        self, circle_ids: List[str], raw: bool = False
+    ) -> Optional[Union[Dict[str, Any], bytes]]:
         try:
             params = GetDeviceLocationsParams(circle_ids=circle_ids)
-            response = await self._send_command(CommandType.GET_DEVICE_LOCATIONS, params.dict())
+            response = await self._send_command(CommandType.GET_DEVICE_LOCATIONS, params.dict(), raw=raw)
             if response.status == ResponseStatus.SUCCESS:
-                return response.data
+                return response.raw_data if raw else response.data
             else:
                 print(f"Get device locations failed: {response.error}")
                 return None
+        except (QueueFull, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"Get device locations error: {e}")
             return None
 
+
+    async def _get_circle_locations(self, circle_id: str, timeout: float) -> Tuple[str, Any, Optional[str]]:
+        try:
+            params = GetDeviceLocationsParams(circle_ids=[circle_id])
+            response = await self._send_command(
+                CommandType.GET_DEVICE_LOCATIONS, params.dict(), timeout=timeout
+            )
+        except Exception as e:
+            return circle_id, None, str(e)
+        if response.status != ResponseStatus.SUCCESS:
+            return circle_id, None, response.error or "Unknown error"
+        data = (response.data or {}).get(circle_id)
+        # The device reports per-circle failures inline as {"error": ...}
+        if isinstance(data, dict) and set(data) == {"error"}:
+            return circle_id, None, str(data["error"])
+        return circle_id, data, None
+
+    async def iter_device_locations(
+        self,
+        circle_ids: List[str],
+        concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[Tuple[str, Any, Optional[str]]]:
+        """Fetch each circle as its own command, yielding (circle_id, data, error) as they finish."""
+        semaphore = asyncio.Semaphore(concurrency or settings.fanout_concurrency)
+        timeout = timeout or settings.fanout_circle_timeout
+
+        async def fetch(circle_id: str):
+            async with semaphore:
+                return await self._get_circle_locations(circle_id, timeout)
+
+        tasks = [asyncio.ensure_future(fetch(circle_id)) for circle_id in dict.fromkeys(circle_ids)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get_device_locations_fanout(
+        self, circle_ids: List[str], concurrency: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Concurrent per-circle variant of get_device_locations; failed circles carry {"error": ...}."""
+        locations: Dict[str, Any] = {}
+        failures = 0
+        async for circle_id, data, error in self.iter_device_locations(circle_ids, concurrency):
+            locations[circle_id] = {"error": error} if error else data
+            failures += error is not None
+        if failures == len(locations):
+            print("Get device locations failed for every circle")
+            return None
+        return locations
+
+    async def _get_members_batch(
+        self, circle_ids: List[str], timeout: float
+    ) -> List[Tuple[str, Any, Optional[str]]]:
+        requests = [
+            (CommandType.GET_CIRCLE_MEMBERS, GetCircleMembersParams(circle_id=circle_id).dict())
+            for circle_id in circle_ids
+        ]
+        try:
+            responses = await self._send_batch(requests, timeout=timeout)
+        except Exception as e:
+            return [(circle_id, None, str(e)) for circle_id in circle_ids]
+        return [
+            (circle_id, response.data, None) if response.status == ResponseStatus.SUCCESS
+            else (circle_id, None, response.error or "Unknown error")
+            for circle_id, response in zip(circle_ids, responses)
+        ]
+
+    async def fetch_circle_members(
+        self,
+        circle_ids: List[str],
+        concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Tuple[Any, Optional[str]]]:
+        """Members of many circles as (data, error) per circle id.
+
+        Circles go to the phone in BATCH commands of members_batch_size, which it
+        runs concurrently; at most `concurrency` batches are in flight at once.
+        """
+        semaphore = asyncio.Semaphore(concurrency or settings.fanout_concurrency)
+        timeout = timeout or settings.fanout_circle_timeout
+        circle_ids = list(dict.fromkeys(circle_ids))
+        size = max(1, settings.members_batch_size)
+
+        async def fetch(chunk: List[str]):
+            async with semaphore:
+                return await self._get_members_batch(chunk, timeout)
+
+        chunks = await asyncio.gather(*[
+            fetch(circle_ids[start:start + size]) for start in range(0, len(circle_ids), size)
+        ])
+        return {circle_id: (data, error) for chunk in chunks for circle_id, data, error in chunk}
+
+    @staticmethod
+    def merge_circle_members(results: Dict[str, Tuple[Any, Optional[str]]]) -> Dict[str, Any]:
+        """Fold per-circle member lists into one record per member.
+
+        Each circle maps to its member ids; a member in several circles appears
+        once under "members", as first listed, with every circle_id it belongs to.
+        """
+        merged: Dict[str, Any] = {"circles": {}, "members": {}, "errors": {}}
+        for circle_id, (data, error) in results.items():
+            if error is not None:
+                merged["errors"][circle_id] = error
+                continue
+            member_ids = []
+            for member in (data or {}).get("members") or []:
+                member_id = member.get("id") if isinstance(member, dict) else None
+                if member_id is None:
+                    continue
+                record = merged["members"].get(member_id)
+                if record is None:
+                    record = merged["members"][member_id] = {**member, "circle_ids": []}
+                record["circle_ids"].append(circle_id)
+                member_ids.append(member_id)
+            merged["circles"][circle_id] = member_ids
+        return merged
+
+    async def get_snapshot(self, circle_ids: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Profile, circles, every circle's members and all locations in at most two batches.
+
+        Without circle_ids the first batch also fetches the circle list, and a
+        second batch fetches members and locations for those circles.
+        """
+        try:
+            snapshot: Dict[str, Any] = {"profile": None, "circles": None, "members": {},
+                                        "locations": None, "errors": {}}
+            first: List[Tuple[CommandType, Optional[dict]]] = [(CommandType.GET_PROFILE, None)]
+            if circle_ids is None:
+                first.append((CommandType.GET_CIRCLES, None))
+            else:
+                first += self._snapshot_circle_requests(circle_ids)
+            responses = await self._send_batch(first)
+            profile = responses[0]
+            if profile.status == ResponseStatus.SUCCESS:
+                snapshot["profile"] = profile.data
+            else:
+                snapshot["errors"]["profile"] = profile.error
+            if circle_ids is None:
+                circles = responses[1]
+                if circles.status != ResponseStatus.SUCCESS or not circles.data:
+                    snapshot["errors"]["circles"] = circles.error or "No circle data"
+                    return snapshot
+                snapshot["circles"] = circles.data.get("circles", [])
+                circle_ids = [circle["id"] for circle in snapshot["circles"] if "id" in circle]
+                responses = await self._send_batch(self._snapshot_circle_requests(circle_ids))
+            else:
+                responses = responses[1:]
+            for circle_id, response in zip(circle_ids, responses):
+                if response.status == ResponseStatus.SUCCESS:
+                    snapshot["members"][circle_id] = response.data
+                else:
+                    snapshot["errors"][f"members:{circle_id}"] = response.error
+            locations = responses[-1] if circle_ids else None
+            if locations is not None and locations.status == ResponseStatus.SUCCESS:
+                snapshot["locations"] = locations.data
+            elif locations is not None:
+                snapshot["errors"]["locations"] = locations.error
+            return snapshot
+        except (QueueFull, DeadlineExceeded):
+            raise
+        except Exception as e:
+            print(f"Get snapshot error: {e}")
+            return None
+
+    def _snapshot_circle_requests(self, circle_ids: List[str]) -> List[Tuple[CommandType, Optional[dict]]]:
+        if not circle_ids:
+            return []
+        requests: List[Tuple[CommandType, Optional[dict]]] = [
+            (CommandType.GET_CIRCLE_MEMBERS, GetCircleMembersParams(circle_id=circle_id).dict())
+            for circle_id in circle_ids
+        ]
+        requests.append(
+            (CommandType.GET_DEVICE_LOCATIONS, GetDeviceLocationsParams(circle_ids=circle_ids).dict())
+        )
+        return requests
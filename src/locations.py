@@ -0,0 +1,98 @@
+from datetime import datetime
+from typing import Any, Iterator, List, Optional, Tuple
+
+from .models import MemberLocation
+
+_LAT_KEYS = ("latitude", "lat")
+_LON_KEYS = ("longitude", "lng", "lon")
+_ID_KEYS = ("memberId", "userId", "id")
+_NAME_KEYS = ("firstName", "name")
+_BATTERY_KEYS = ("battery", "batteryLevel")
+_TIMESTAMP_KEYS = ("timestamp", "endTimestamp", "since", "lastUpdated")
+
+
+def _first(node: dict, keys: Tuple[str, ...]) -> Any:
+    for key in keys:
+        value = node.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """Epoch seconds from epoch seconds/milliseconds (number or string) or ISO-8601."""
+    number = _to_float(value)
+    if number is not None:
+        return number / 1000 if number > 1e11 else number
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def _owner(node: dict) -> Optional[Tuple[str, Optional[str], dict]]:
+    owners = node.get("owners")
+    if isinstance(owners, list) and owners and isinstance(owners[0], dict):
+        owner_id = _first(owners[0], ("userId", "id"))
+        if owner_id:
+            return str(owner_id), _first(node, _NAME_KEYS), node
+    member_id = _first(node, _ID_KEYS)
+    if member_id:
+        return str(member_id), _first(node, _NAME_KEYS), node
+    return None
+
+
+def _walk(node: Any, owner: Optional[Tuple[str, Optional[str], dict]]) -> Iterator[Tuple[tuple, dict]]:
+    if isinstance(node, list):
+        for item in node:
+            yield from _walk(item, owner)
+        return
+    if not isinstance(node, dict):
+        return
+    if _first(node, _LAT_KEYS) is not None and _first(node, _LON_KEYS) is not None:
+        owner = owner or _owner(node)
+        if owner:
+            yield owner, node
+        return
+    owner = _owner(node) or owner
+    for value in node.values():
+        if isinstance(value, (dict, list)):
+            yield from _walk(value, owner)
+
+
+def extract_member_locations(circle_id: str, payload: Any) -> List[MemberLocation]:
+    """Pull one MemberLocation per member out of a circle's location or members payload.
+
+    Life360 nests positions differently across API versions (v5 device items
+    with owners, v4 members with a location object), so this walks the tree and
+    pairs every lat/lon object with its nearest identifying ancestor.
+    """
+    found = {}
+    for (member_id, name, owner_node), location in _walk(payload, None):
+        latitude = _to_float(_first(location, _LAT_KEYS))
+        longitude = _to_float(_first(location, _LON_KEYS))
+        if latitude is None or longitude is None:
+            continue
+        battery = _first(location, _BATTERY_KEYS)
+        if battery is None:
+            battery = _first(owner_node, _BATTERY_KEYS)
+        found[member_id] = MemberLocation(
+            member_id=member_id,
+            circle_id=circle_id,
+            name=name,
+            latitude=latitude,
+            longitude=longitude,
+            accuracy=_to_float(location.get("accuracy")),
+            battery=_to_float(battery),
+            timestamp=parse_timestamp(_first(location, _TIMESTAMP_KEYS)),
+        )
+    return list(found.values())
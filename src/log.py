@@ -0,0 +1,28 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_root = logging.getLogger("life360")
+
+
+def _setup() -> logging.handlers.QueueListener:
+    # Callers only enqueue records; a background thread does the formatting and I/O
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%H:%M:%S"))
+    listener = logging.handlers.QueueListener(_queue, handler, respect_handler_level=True)
+    _root.addHandler(logging.handlers.QueueHandler(_queue))
+    _root.setLevel(os.getenv("LIFE360_LOG_LEVEL", "INFO").upper())
+    _root.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+_listener = _setup()
+
+
+def get_logger(name: str) -> logging.Logger:
+    return _root.getChild(name)
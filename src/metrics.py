@@ -0,0 +1,201 @@
+import bisect
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Device round-trips range from a local ping to multi-circle fetches over the Life360 API
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self.values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """A gauge whose value(s) are read from a callback at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.function: Optional[Callable[[], object]] = None
+
+    def set_function(self, function: Callable[[], object]):
+        """function returns a number, or a {label values tuple: number} dict for labelled gauges."""
+        self.function = function
+
+    def samples(self) -> List[str]:
+        if self.function is None:
+            return []
+        value = self.function()
+        if not isinstance(value, dict):
+            return [f"{self.name} {_format_value(float(value))}"]
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(float(v))}"
+            for key, v in value.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts incl. +Inf, sum, count)
+        self.values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self.metrics)
+
+
+registry = Registry()
+
+COMMAND_RTT = registry.register(Histogram(
+    "life360_command_rtt_seconds", "Time from sending a command to the device until its response",
+    ["command"],
+))
+COMMAND_TIMEOUTS = registry.register(Counter(
+    "life360_command_timeouts_total", "Commands that got no response before their timeout", ["command"],
+))
+COMMAND_ERRORS = registry.register(Counter(
+    "life360_command_errors_total", "Commands that failed to send or came back with an error status",
+    ["command"],
+))
+COMMANDS_COALESCED = registry.register(Counter(
+    "life360_commands_coalesced_total", "Calls served by an identical command already in flight", ["command"],
+))
+COMMANDS_HEDGED = registry.register(Counter(
+    "life360_commands_hedged_total", "Reads re-sent to a second device after passing their p95", ["command"],
+))
+COMMANDS_CANCELLED = registry.register(Counter(
+    "life360_commands_cancelled_total", "Commands the device was told to drop after every caller gave up",
+    ["command"],
+))
+PENDING_COMMANDS = registry.register(Gauge(
+    "life360_pending_commands", "Commands awaiting a response from a device",
+))
+CONNECTED_CLIENTS = registry.register(Gauge(
+    "life360_connected_clients", "Devices connected over WebSocket",
+))
+FRAME_BYTES = registry.register(Histogram(
+    "life360_frame_bytes", "Size of device WebSocket frames", ["direction"], buckets=SIZE_BUCKETS,
+))
+HTTP_LATENCY = registry.register(Histogram(
+    "life360_http_request_duration_seconds", "HTTP request handling time by route",
+    ["method", "route", "status"],
+))
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing HTTP requests by their route template, e.g. /circles/{circle_id}/members."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_LATENCY.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status["code"]),
+            )
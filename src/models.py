@@ -1,5 +1,7 @@
-from typing import Optional, Any, List
-from pydantic import BaseModel
+import json
+import time
+from typing import Optional, Any, Dict, List, Literal, Union
+from pydantic import BaseModel, Field, PrivateAttr
 from enum import Enum
 
 
@@ -12,6 +14,45 @@ class CommandType(str, Enum):
     GET_DEVICE_LOCATIONS = "get_device_locations"
     PING = "ping"
     GET_STATUS = "get_status"
+    BATCH = "batch"
+    CANCEL = "cancel"
+
+
+# Commands with no side effects on the device; identical in-flight requests
+# for these can share a single round-trip.
+READ_COMMANDS = frozenset({
+    CommandType.GET_PROFILE,
+    CommandType.GET_CIRCLES,
+    CommandType.GET_CIRCLE_MEMBERS,
+    CommandType.GET_DEVICE_LOCATIONS,
+    CommandType.PING,
+    CommandType.GET_STATUS,
+})
+
+
+# Scheduling priority when a device is busy; lower runs first
+COMMAND_PRIORITY = {
+    CommandType.SEND_OTP: 0,
+    CommandType.VERIFY_OTP: 0,
+    CommandType.PING: 1,
+    CommandType.GET_STATUS: 1,
+    CommandType.GET_DEVICE_LOCATIONS: 2,
+    CommandType.GET_PROFILE: 3,
+    CommandType.GET_CIRCLES: 3,
+    CommandType.GET_CIRCLE_MEMBERS: 3,
+}
+LOWEST_PRIORITY = max(COMMAND_PRIORITY.values())
+
+
+def normalize_params(params: Optional[dict]) -> str:
+    """Canonical string form of command params (sorted keys and id lists)."""
+    if not params:
+        return ""
+    normalized = {
+        key: sorted(value) if isinstance(value, list) and all(isinstance(v, str) for v in value) else value
+        for key, value in params.items()
+    }
+    return json.dumps(normalized, sort_keys=True, separators=(",", ":"))
 
 
 class Command(BaseModel):
@@ -34,6 +75,29 @@ class Response(BaseModel):
     status: ResponseStatus
     data: Optional[Any] = None
     error: Optional[str] = None
+    # Optional device-side stage durations in milliseconds, e.g. {"api_ms": 412.0}
+    timings: Optional[Dict[str, float]] = None
+    # Set by the device when Life360 answered 429 while running the command, e.g. {"retry_after": 30}
+    rate_limited: Optional[Dict[str, float]] = None
+    # Seconds the server spent decoding and validating this response
+    _parse_seconds: float = PrivateAttr(default=0.0)
+    # data as the JSON bytes a lean-codec device sent; data stays None until load_data()
+    _raw_data: Optional[bytes] = PrivateAttr(default=None)
+
+    def load_data(self) -> Any:
+        """Decode data kept raw by the lean codec, once, and return it."""
+        if self.data is None and self._raw_data is not None:
+            started = time.perf_counter()
+            self.data = json.loads(self._raw_data)
+            self._parse_seconds += time.perf_counter() - started
+        return self.data
+
+    @property
+    def raw_data(self) -> Optional[bytes]:
+        """data as JSON bytes: as received when possible, otherwise serialized now."""
+        if self._raw_data is None and self.data is not None:
+            return json.dumps(self.data, separators=(",", ":")).encode()
+        return self._raw_data
 
 
 # Specific command parameter models
@@ -55,6 +119,21 @@ class GetDeviceLocationsParams(BaseModel):
     circle_ids: List[str]
 
 
+class BulkCircleMembersParams(BaseModel):
+    """Circle ids to load members for, or "all" for every circle in the cached circle list."""
+    circle_ids: Union[List[str], Literal["all"]] = "all"
+
+
+class BatchParams(BaseModel):
+    """Sub-commands the device runs together; it answers with {"responses": [...]}."""
+    commands: List[Command]
+
+
+class CancelParams(BaseModel):
+    """Command the device should stop working on; nobody is waiting for its response."""
+    command_id: str
+
+
 # Response data models
 class StatusData(BaseModel):
     has_transaction: bool
@@ -79,3 +158,37 @@ class CircleInfo(BaseModel):
 class CirclesData(BaseModel):
     circles: List[CircleInfo]
 
+
+
+class MemberLocation(BaseModel):
+    """Latest known position of one circle member, normalized from device payloads."""
+    member_id: str
+    circle_id: str
+    name: Optional[str] = None
+    latitude: float
+    longitude: float
+    accuracy: Optional[float] = None
+    battery: Optional[float] = None
+    timestamp: Optional[float] = None
+
+
+class GeofenceParams(BaseModel):
+    name: str
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+    radius: float = Field(gt=0, le=100_000, description="Radius in meters")
+
+
+class Geofence(GeofenceParams):
+    id: str
+
+
+class GeofenceEvent(BaseModel):
+    id: int
+    type: str  # "enter" or "exit"
+    fence_id: str
+    member_id: str
+    circle_id: str
+    latitude: float
+    longitude: float
+    timestamp: float
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .cache import cache
+from .config import settings
+from .geo import haversine_m
+from .locations import extract_member_locations
+from .log import get_logger
+from .models import CommandType, GetCircleMembersParams
+from .ratelimit import TokenBucket
+from .websocket_handler import manager
+
+logger = get_logger("prefetch")
+
+
+class CircleState:
+    """The prefetched locations of one circle and how often to refresh them."""
+
+    def __init__(self, circle_id: str, interval: float):
+        self.circle_id = circle_id
+        # Serialized locations and the wall-clock time they were fetched
+        self.body: Optional[bytes] = None
+        self.fetched_at: Optional[float] = None
+        self.next_at: Optional[float] = None
+        self.interval = interval
+        self.failures = 0
+        self.moving = False
+        # member_id -> (latitude, longitude) at the last fetch
+        self.positions: Dict[str, Tuple[float, float]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"fetches": 0, "errors": 0}
+
+
+class Prefetcher:
+    """Keeps a hot copy of selected circles' locations for POST /locations.
+
+    Each circle refreshes on its own schedule: back to min_interval as soon as a
+    member moves more than moving_meters between fetches, and slowing by
+    slowdown per idle fetch up to max_interval. Failures back off exponentially.
+    All circles draw from one bucket of budget commands per minute, so many busy
+    circles queue up instead of crowding out callers. Each circle is fetched
+    through the account that owns it (see AccountRegistry).
+    """
+
+    def __init__(self, accounts, circles: Optional[str] = None,
+                 resolve_circles: Optional[Callable[[], Awaitable[Optional[List[str]]]]] = None,
+                 min_interval: Optional[float] = None, max_interval: Optional[float] = None,
+                 moving_meters: Optional[float] = None, budget: Optional[float] = None,
+                 members: Optional[bool] = None, slowdown: float = 1.5):
+        self.accounts = accounts
+        self.circles = settings.prefetch_circles if circles is None else circles
+        self.resolve_circles = resolve_circles
+        self.min_interval = min_interval or settings.prefetch_min_interval
+        self.max_interval = max(self.min_interval, max_interval or settings.prefetch_max_interval)
+        self.moving_meters = settings.prefetch_moving_meters if moving_meters is None else moving_meters
+        budget = budget or settings.prefetch_budget
+        # A few commands of burst, so a restart doesn't fire every circle at once
+        self.bucket = TokenBucket(budget / 60, max(1.0, budget / 6))
+        self.members = settings.prefetch_members if members is None else members
+        self.slowdown = slowdown
+        self.states: Dict[str, CircleState] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.circles)
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.ensure_future(self._supervise())
+
+    async def stop(self):
+        tasks = [state.task for state in self.states.values() if state.task is not None]
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for state in self.states.values():
+            state.task = None
+
+    async def _circle_ids(self) -> Optional[List[str]]:
+        if self.circles.strip().lower() != "all":
+            return [circle_id.strip() for circle_id in self.circles.split(",") if circle_id.strip()]
+        if self.resolve_circles is None:
+            return None
+        return await self.resolve_circles()
+
+    async def _supervise(self):
+        """Follow the configured circle list, re-reading "all" every max_interval."""
+        while True:
+            try:
+                circle_ids = await self._circle_ids()
+            except Exception as e:
+                logger.warning(f"✗ Could not list circles to prefetch: {e}")
+                circle_ids = None
+            if circle_ids is not None:
+                for circle_id in circle_ids:
+                    state = self.states.get(circle_id)
+                    if state is None:
+                        state = self.states[circle_id] = CircleState(circle_id, self.min_interval)
+                    if state.task is None:
+                        state.task = asyncio.ensure_future(self._run(state))
+                for circle_id in [c for c in self.states if c not in circle_ids]:
+                    state = self.states.pop(circle_id)
+                    if state.task is not None:
+                        state.task.cancel()
+            await asyncio.sleep(self.min_interval if circle_ids is None else self.max_interval)
+
+    async def _spend(self):
+        """Reserve one command of the shared budget, waiting for it if needed."""
+        now = time.monotonic()
+        self.bucket.refill(now, 1.0)
+        wait = self.bucket.wait(1, 1.0)
+        self.bucket.tokens -= 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _run(self, state: CircleState):
+        while True:
+            service = self.accounts.for_circle(state.circle_id)
+            if not manager.is_connected(service.client_id):
+                await asyncio.sleep(self.min_interval)
+                continue
+            await self._spend()
+            await self._refresh(service, state)
+            namespace = self.accounts.namespace(service)
+            if self.members:
+                await cache.load(CommandType.GET_CIRCLE_MEMBERS, self._members_params(state), account=namespace)
+            if self.members and cache.get(CommandType.GET_CIRCLE_MEMBERS, self._members_params(state),
+                                          account=namespace) is None:
+                await self._spend()
+                await self._refresh_members(service, state)
+            delay = self._delay(state)
+            state.next_at = time.time() + delay
+            # Jitter keeps circles that started together from refreshing together
+            await asyncio.sleep(delay * random.uniform(0.9, 1.1))
+
+    def _delay(self, state: CircleState) -> float:
+        if state.failures:
+            return min(self.max_interval, self.min_interval * 2 ** state.failures)
+        return state.interval
+
+    async def _refresh(self, service, state: CircleState):
+        async for circle_id, data, error in service.iter_device_locations([state.circle_id]):
+            state.stats["fetches"] += 1
+            if error:
+                state.failures += 1
+                state.stats["errors"] += 1
+                logger.warning(f"✗ Prefetch of {circle_id} failed ({state.failures} in a row): {error}")
+                continue
+            state.failures = 0
+            state.moving = self._moved(state, data)
+            if state.moving:
+                state.interval = self.min_interval
+            else:
+                state.interval = min(self.max_interval, state.interval * self.slowdown)
+            state.body = json.dumps(data, separators=(",", ":")).encode()
+            state.fetched_at = time.time()
+            logger.debug("Prefetched %s (%s, next in %.0fs)", circle_id,
+                         "moving" if state.moving else "idle", state.interval)
+
+    @staticmethod
+    def _members_params(state: CircleState) -> dict:
+        return GetCircleMembersParams(circle_id=state.circle_id).dict()
+
+    async def _refresh_members(self, service, state: CircleState):
+        """Refill the circle's members in the response cache once they expire there."""
+        results = await service.fetch_circle_members([state.circle_id])
+        data, error = results.get(state.circle_id, (None, "no result"))
+        if error is not None:
+            logger.warning(f"✗ Prefetch of {state.circle_id} members failed: {error}")
+            return
+        cache.put(CommandType.GET_CIRCLE_MEMBERS, self._members_params(state), data,
+                  account=self.accounts.namespace(service))
+
+    def _moved(self, state: CircleState, data: Any) -> bool:
+        """Whether any member moved more than moving_meters since the last fetch."""
+        positions = {
+            location.member_id: (location.latitude, location.longitude)
+            for location in extract_member_locations(state.circle_id, data)
+        }
+        moved = any(
+            member_id not in state.positions
+            or haversine_m(*state.positions[member_id], *position) > self.moving_meters
+            for member_id, position in positions.items()
+        )
+        # The first fetch has nothing to compare against
+        moved = moved and bool(state.positions)
+        state.positions = positions
+        return moved
+
+    def get(self, circle_ids: List[str], max_age: Optional[float] = None) -> Optional[Tuple[bytes, float, float]]:
+        """(body, fetched_at, ttl) for circle_ids from prefetched data, or None if any is missing.
+
+        fetched_at is the oldest circle's; ttl is the time from it until the next
+        scheduled refresh. Without max_age, data is used for as long as the response
+        cache would serve cached locations: their TTL plus stale_while_revalidate.
+        """
+        if max_age is None:
+            max_age = cache.ttl_for(CommandType.GET_DEVICE_LOCATIONS) + settings.stale_while_revalidate
+        now = time.time()
+        states = []
+        for circle_id in dict.fromkeys(circle_ids):
+            state = self.states.get(circle_id)
+            if state is None or state.body is None or now - state.fetched_at > max_age:
+                return None
+            states.append(state)
+        if not states:
+            return None
+        body = b"{" + b",".join(json.dumps(state.circle_id).encode() + b":" + state.body for state in states) + b"}"
+        oldest = min(states, key=lambda state: state.fetched_at)
+        next_at = min(state.next_at or state.fetched_at for state in states)
+        return body, oldest.fetched_at, max(0.0, next_at - oldest.fetched_at)
+
+    def info(self) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        self.bucket.refill(time.monotonic(), 1.0)
+        now = time.time()
+        return {
+            "budget_remaining": max(0, int(self.bucket.tokens)),
+            "circles": {
+                circle_id: {
+                    **state.stats,
+                    "moving": state.moving,
+                    "interval": round(self._delay(state), 1),
+                    "age": round(now - state.fetched_at, 1) if state.fetched_at is not None else None,
+                    "failures": state.failures,
+                }
+                for circle_id, state in self.states.items()
+            },
+        }
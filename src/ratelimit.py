@@ -0,0 +1,239 @@
+import asyncio
+import math
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+from .log import get_logger
+from .models import Command, CommandType, Response, ResponseStatus
+from .scheduler import QueueFull
+
+logger = get_logger("ratelimit")
+
+# Life360 API endpoint class each command's upstream calls fall under; commands
+# missing here (ping, get_status) never leave the phone
+ENDPOINT_CLASSES: Dict[CommandType, str] = {
+    CommandType.GET_DEVICE_LOCATIONS: "locations",
+    CommandType.GET_CIRCLE_MEMBERS: "members",
+    CommandType.GET_CIRCLES: "account",
+    CommandType.GET_PROFILE: "account",
+    CommandType.SEND_OTP: "auth",
+    CommandType.VERIFY_OTP: "auth",
+}
+
+# Budget left after the current HTTP request's device commands, filled in by acquire()
+_budget: ContextVar[Optional[Dict[str, Any]]] = ContextVar("life360_rate_budget", default=None)
+
+
+class RateLimited(QueueFull):
+    """Waiting for Life360 API budget would take longer than the caller allows."""
+
+    def __init__(self, target: str, retry_after: float, scope: str):
+        super().__init__(target, retry_after)
+        self.args = (f"Life360 API budget exhausted ({scope}); retry after {retry_after:.0f}s",)
+        self.scope = scope
+
+
+def upstream_calls(command: Command) -> List[Tuple[str, Optional[str]]]:
+    """(endpoint class, circle id) for each Life360 API call the phone makes for command."""
+    params = command.params or {}
+    if command.type == CommandType.BATCH:
+        return [call for sub in params.get("commands", []) for call in upstream_calls(Command(**sub))]
+    endpoint_class = ENDPOINT_CLASSES.get(command.type)
+    if endpoint_class is None:
+        return []
+    if command.type == CommandType.GET_DEVICE_LOCATIONS:
+        # The app fetches one circle per API call
+        return [(endpoint_class, circle_id) for circle_id in params.get("circle_ids") or []]
+    return [(endpoint_class, params.get("circle_id"))]
+
+
+class TokenBucket:
+    """Refills at rate tokens per second up to burst.
+
+    Callers reserve tokens up front, so a negative balance is capacity already
+    promised to commands still waiting their turn.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float, factor: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate * factor)
+        self.updated = now
+
+    def wait(self, cost: float, factor: float) -> float:
+        """Seconds until cost tokens are available at the current rate."""
+        deficit = cost - self.tokens
+        return 0.0 if deficit <= 0 else deficit / (self.rate * factor)
+
+
+class RateLimiter:
+    """Keeps one device's Life360 API traffic under the account's upstream limits.
+
+    Each endpoint class and each circle has its own token bucket, and a command
+    takes a token from every bucket its upstream calls touch. A command waits
+    (at most max_wait) for its tokens instead of reaching the phone early. When
+    the phone reports a 429, every rate is halved, saved-up burst is dropped and
+    nothing is sent until the upstream Retry-After passes. Rates then recover a
+    step per successful command.
+    """
+
+    def __init__(self, target: str, rates: Dict[str, float], per_circle: float,
+                 burst_seconds: float = 20.0, max_wait: float = 5.0, backoff: float = 30.0,
+                 recovery: float = 0.05, min_factor: float = 1 / 16):
+        self.target = target
+        self.rates = rates
+        self.per_circle = per_circle
+        self.burst_seconds = burst_seconds
+        self.max_wait = max_wait
+        self.backoff = backoff
+        self.recovery = recovery
+        self.min_factor = min_factor
+        self.buckets: Dict[str, TokenBucket] = {}
+        # Multiplier on every rate; below 1 while recovering from an upstream 429
+        self.factor = 1.0
+        self.paused_until = 0.0
+        self.stats: Dict[str, int] = {"admitted": 0, "delayed": 0, "rejected": 0, "throttled": 0}
+
+    def _bucket(self, scope: str, rate: float) -> TokenBucket:
+        bucket = self.buckets.get(scope)
+        if bucket is None:
+            bucket = self.buckets[scope] = TokenBucket(rate, max(1.0, rate * self.burst_seconds))
+        return bucket
+
+    def _costs(self, command: Command) -> Dict[str, Tuple[TokenBucket, int]]:
+        costs: Dict[str, Tuple[TokenBucket, int]] = {}
+        for endpoint_class, circle_id in upstream_calls(command):
+            scopes = [(endpoint_class, self.rates.get(endpoint_class, 0.0))]
+            if circle_id:
+                scopes.append((f"circle:{circle_id}", self.per_circle))
+            for scope, rate in scopes:
+                if rate <= 0:
+                    continue
+                bucket, cost = costs.get(scope) or (self._bucket(scope, rate), 0)
+                costs[scope] = (bucket, cost + 1)
+        return costs
+
+    async def acquire(self, command: Command, max_wait: Optional[float] = None):
+        """Reserve the command's tokens, waiting for them if needed.
+
+        Raises RateLimited when the wait would exceed max_wait (capped at the
+        limiter's own max_wait).
+        """
+        costs = self._costs(command)
+        if not costs:
+            return
+        now = time.monotonic()
+        for bucket, _ in costs.values():
+            bucket.refill(now, self.factor)
+        waits = {scope: bucket.wait(cost, self.factor) for scope, (bucket, cost) in costs.items()}
+        scope = max(waits, key=waits.get)
+        wait = waits[scope]
+        if self.paused_until - now > wait:
+            scope, wait = "upstream 429", self.paused_until - now
+        limit = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        if wait > limit:
+            self.stats["rejected"] += 1
+            raise RateLimited(self.target, retry_after=max(1.0, math.ceil(wait)), scope=scope)
+        for bucket, cost in costs.values():
+            bucket.tokens -= cost
+        self.stats["admitted"] += 1
+        budget = _budget.get()
+        if budget is not None:
+            tightest = min(costs, key=lambda s: costs[s][0].tokens)
+            remaining = math.floor(max(0.0, costs[tightest][0].tokens))
+            if remaining < budget.get("remaining", math.inf):
+                budget.update(remaining=remaining, scope=tightest)
+        if wait > 0:
+            self.stats["delayed"] += 1
+            logger.debug("Holding %s for %.2fs of Life360 API budget (%s)", command.type.value, wait, scope)
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                # Cancelled or out of time before it could use them
+                self._refund(costs)
+                raise
+
+    def refund(self, command: Command):
+        """Return the tokens of a command that was admitted but never reached the phone."""
+        self._refund(self._costs(command))
+
+    def _refund(self, costs: Dict[str, Tuple[TokenBucket, int]]):
+        for bucket, cost in costs.values():
+            bucket.tokens = min(bucket.burst, bucket.tokens + cost)
+
+    def record(self, response: Response):
+        """Adapt to how the upstream API treated a command: back off on 429, else recover."""
+        now = time.monotonic()
+        if response.rate_limited is not None:
+            # Spend the saved-up burst too, so sending resumes at the reduced rate
+            for bucket in self.buckets.values():
+                bucket.tokens = min(0.0, bucket.tokens)
+                bucket.updated = now
+            retry_after = response.rate_limited.get("retry_after") or self.backoff
+            # Concurrent commands hitting the same 429 halve the rate once
+            if now >= self.paused_until:
+                self.factor = max(self.min_factor, self.factor / 2)
+            self.paused_until = max(self.paused_until, now + retry_after)
+            self.stats["throttled"] += 1
+            logger.warning(
+                f"⚠ Life360 API rate limited {self.target}; pausing {retry_after:g}s at {self.factor:.0%} rate"
+            )
+        elif response.status == ResponseStatus.SUCCESS and self.factor < 1.0 and now >= self.paused_until:
+            for bucket in self.buckets.values():
+                bucket.refill(now, self.factor)
+            self.factor = min(1.0, self.factor + self.recovery)
+
+    def info(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        for bucket in self.buckets.values():
+            bucket.refill(now, self.factor)
+        return {
+            **self.stats,
+            "rate_factor": round(self.factor, 3),
+            "paused_for": round(max(0.0, self.paused_until - now), 1),
+            "remaining": {scope: math.floor(max(0.0, bucket.tokens)) for scope, bucket in self.buckets.items()},
+        }
+
+
+def create_rate_limiter(target: str) -> Optional[RateLimiter]:
+    if not settings.rate_limit_enabled:
+        return None
+    return RateLimiter(
+        target, rates=settings.rate_limits, per_circle=settings.rate_limit_per_circle,
+        burst_seconds=settings.rate_limit_burst_seconds, max_wait=settings.rate_limit_max_wait,
+        backoff=settings.rate_limit_backoff,
+    )
+
+
+class RateLimitMiddleware:
+    """ASGI middleware reporting the Life360 API budget left after a request's device commands.
+
+    Adds X-RateLimit-Remaining (tokens left in the tightest bucket touched) and
+    X-RateLimit-Scope (that bucket) to responses that reached the phone.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        budget: Dict[str, Any] = {}
+        _budget.set(budget)
+
+        async def send_with_budget(message):
+            if message["type"] == "http.response.start" and "remaining" in budget:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-ratelimit-remaining", str(budget["remaining"]).encode()),
+                    (b"x-ratelimit-scope", budget["scope"].encode()),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_budget)
@@ -0,0 +1,101 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .latency import DeadlineExceeded
+
+
+class QueueFull(Exception):
+    """The device's wait queue is full; retry after the suggested delay."""
+
+    def __init__(self, client_id: str, retry_after: float):
+        super().__init__(f"Command queue full for client: {client_id}")
+        self.client_id = client_id
+        self.retry_after = retry_after
+
+
+class DeviceScheduler:
+    """Admission control for one device: a bounded in-flight window and priority queue.
+
+    Up to `window` commands run on the device at once. Further commands wait
+    in a queue ordered by priority (lower runs first, FIFO within a priority);
+    once `max_queue` are waiting, new ones are rejected with QueueFull.
+    """
+
+    def __init__(self, client_id: str, window: int = 4, max_queue: int = 32):
+        self.client_id = client_id
+        self.window = window
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.waits: Deque[float] = deque(maxlen=256)
+        self.stats: Dict[str, int] = {"admitted": 0, "queued": 0, "rejected": 0, "max_depth": 0}
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for _, _, future in self.queue if not future.done())
+
+    async def acquire(self, priority: int, timeout: Optional[float] = None):
+        if self.in_flight < self.window and not self.depth:
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            self.waits.append(0.0)
+            return
+        if self.depth >= self.max_queue and not self._evict_below(priority):
+            self.stats["rejected"] += 1
+            raise QueueFull(self.client_id, self.retry_after())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (priority, next(self._seq), future))
+        self.stats["queued"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self.depth)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Timed out after {timeout:.3g}s waiting for a slot on {self.client_id}")
+        except asyncio.CancelledError:
+            # The slot may have been handed over just as we were cancelled
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            raise
+        self.stats["admitted"] += 1
+        self.waits.append(time.monotonic() - started)
+
+    def _evict_below(self, priority: int) -> bool:
+        """Reject the newest lowest-priority waiter to make room for a more important command."""
+        waiting = [entry for entry in self.queue if not entry[2].done()]
+        worst = max(waiting, key=lambda entry: (entry[0], entry[1]), default=None)
+        if worst is None or worst[0] <= priority:
+            return False
+        self.stats["rejected"] += 1
+        worst[2].set_exception(QueueFull(self.client_id, self.retry_after()))
+        return True
+
+    def release(self):
+        """Free a slot, handing it straight to the best queued command if any."""
+        while self.queue:
+            _, _, future = heapq.heappop(self.queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def retry_after(self) -> float:
+        average_wait = sum(self.waits) / len(self.waits) if self.waits else 0.0
+        return max(1.0, math.ceil(average_wait))
+
+    def info(self) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+        return {
+            **self.stats,
+            "in_flight": self.in_flight,
+            "depth": self.depth,
+            "window": self.window,
+            "wait_ms_avg": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+            "wait_ms_p95": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+        }
@@ -0,0 +1,134 @@
+import asyncio
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+from .log import get_logger
+
+logger = get_logger("store")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    stored_at REAL NOT NULL
+)
+"""
+
+
+class ResponseStore:
+    """Last known device read results, persisted in SQLite so restarts start warm.
+
+    Reads are point lookups run on a reader thread (fetch) and writes are
+    queued to a writer thread that commits them in batches, so the event loop
+    never waits on disk. Rows older than max_age seconds are dropped at
+    startup; after that the row count is kept up to date by the writer.
+    """
+
+    def __init__(self, path: str, max_age: float = 86400.0):
+        self.path = path
+        self.max_age = max_age
+        self.stats: Dict[str, int] = {"loaded": 0, "saved": 0}
+        # Counters are bumped on the reader and writer threads
+        self._stats_lock = threading.Lock()
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._reader.execute("PRAGMA journal_mode=WAL")
+        self._reader.execute(SCHEMA)
+        self._reader.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - max_age,))
+        self._reader.commit()
+        (self.rows,) = self._reader.execute("SELECT COUNT(*) FROM responses").fetchone()
+        self._reads = ThreadPoolExecutor(max_workers=1, thread_name_prefix="life360-store-read")
+        self._queue: "queue.SimpleQueue[Optional[Tuple[str, bytes, float]]]" = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_loop, name="life360-store", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def load(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """The stored (body, stored_at) for key, if any."""
+        row = self._reader.execute(
+            "SELECT body, stored_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with self._stats_lock:
+            self.stats["loaded"] += 1
+        return bytes(row[0]), row[1]
+
+    async def fetch(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """load(key) on the reader thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._reads, self.load, key)
+
+    def save(self, key: str, body: bytes, stored_at: float):
+        self._queue.put((key, body, stored_at))
+
+    def _write_loop(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            # Coalesce whatever else is queued into one transaction, last write per key wins
+            batch = {item[0]: item}
+            stop = False
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch[item[0]] = item
+            try:
+                with connection:
+                    existing = self._existing(connection, list(batch))
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO responses (key, body, stored_at) VALUES (?, ?, ?)",
+                        batch.values(),
+                    )
+                with self._stats_lock:
+                    self.stats["saved"] += len(batch)
+                    self.rows += len(batch) - existing
+            except sqlite3.Error as e:
+                logger.warning(f"✗ Failed to persist {len(batch)} responses: {e}")
+            if stop:
+                break
+        connection.close()
+
+    @staticmethod
+    def _existing(connection: sqlite3.Connection, keys: List[str]) -> int:
+        """How many of keys already have a row, for keeping the row count."""
+        count = 0
+        # In chunks that stay under SQLite's limit on bound parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            (found,) = connection.execute(
+                f"SELECT COUNT(*) FROM responses WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchone()
+            count += found
+        return count
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+        self._reads.shutdown(wait=False)
+
+    def info(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {**self.stats, "rows": self.rows, "path": self.path}
+
+
+def create_response_store() -> Optional[ResponseStore]:
+    if not settings.store_path:
+        return None
+    return ResponseStore(settings.store_path, max_age=settings.stale_if_error)
+
+
+store = create_response_store()
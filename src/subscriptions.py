@@ -0,0 +1,172 @@
+import asyncio
+import itertools
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from .config import settings
+from .locations import extract_member_locations
+from .log import get_logger
+from .models import MemberLocation
+
+logger = get_logger("subscriptions")
+
+
+def _signature(location: MemberLocation) -> tuple:
+    return (
+        location.latitude, location.longitude, location.accuracy,
+        location.battery, location.timestamp,
+    )
+
+
+class CircleTopic:
+    """Versioned member state for one circle, shared by all its subscribers.
+
+    Versions come from the hub's counter, so a topic recreated for the same
+    circle never reuses a version an earlier one handed out; versions up to
+    base predate this topic and can't be diffed against.
+    """
+
+    def __init__(self, circle_id: str, versions: Iterator[int]):
+        self.circle_id = circle_id
+        self.versions = versions
+        self.base = next(versions)
+        self.version = 0
+        # member_id -> (version it last changed at, location)
+        self.members: Dict[str, Tuple[int, MemberLocation]] = {}
+        # member_id -> version it disappeared at
+        self.removed: Dict[str, int] = {}
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.updated = asyncio.Event()
+
+    def apply(self, locations) -> bool:
+        """Merge a fresh fetch; moves to a new version only if something changed."""
+        version = next(self.versions)
+        seen = set()
+        # The first fetch always publishes so subscribers get a snapshot
+        changed = self.version == 0
+        for location in locations:
+            seen.add(location.member_id)
+            current = self.members.get(location.member_id)
+            if current is None or _signature(current[1]) != _signature(location):
+                self.members[location.member_id] = (version, location)
+                self.removed.pop(location.member_id, None)
+                changed = True
+        for member_id in [m for m in self.members if m not in seen]:
+            del self.members[member_id]
+            self.removed[member_id] = version
+            changed = True
+        if changed:
+            self.version = version
+            # Wake current waiters; later ones wait on the fresh event
+            self.updated.set()
+            self.updated = asyncio.Event()
+        return changed
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "circle_id": self.circle_id,
+            "version": self.version,
+            "members": [location.dict() for _, location in self.members.values()],
+        }
+
+    def delta(self, since: int) -> Dict[str, Any]:
+        return {
+            "circle_id": self.circle_id,
+            "version": self.version,
+            "since": since,
+            "members": [location.dict() for version, location in self.members.values() if version > since],
+            "removed": [member_id for member_id, version in self.removed.items() if version > since],
+        }
+
+
+class LocationHub:
+    """Fan one background location refresh per circle out to many subscribers.
+
+    Subscribers receive a full snapshot first (or after reconnecting with a
+    version the hub no longer knows), then only members whose position,
+    battery or timestamps changed since the last version they saw. Each circle
+    is refreshed through the account that owns it (see AccountRegistry).
+
+    Versions restart at zero with the process, so event ids carry an epoch
+    picked at startup; an id from another epoch always gets a snapshot.
+    """
+
+    def __init__(self, accounts, refresh_interval: Optional[float] = None,
+                 keepalive_interval: float = 15.0):
+        self.accounts = accounts
+        self.refresh_interval = refresh_interval or settings.subscription_refresh_interval
+        self.keepalive_interval = keepalive_interval
+        self.topics: Dict[str, CircleTopic] = {}
+        self.versions = itertools.count(1)
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def event_id(self, version: int) -> str:
+        return f"{self.epoch}-{version}"
+
+    def resume_version(self, event_id: Optional[str]) -> Optional[int]:
+        """The version an event id from this epoch names; None (snapshot) for anything else."""
+        epoch, _, version = (event_id or "").rpartition("-")
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    async def _refresh_loop(self, topic: CircleTopic):
+        while True:
+            service = self.accounts.for_circle(topic.circle_id)
+            async for _, data, error in service.iter_device_locations([topic.circle_id]):
+                if error:
+                    logger.warning(f"✗ Subscription refresh failed for {topic.circle_id}: {error}")
+                else:
+                    topic.apply(extract_member_locations(topic.circle_id, data))
+            await asyncio.sleep(self.refresh_interval)
+
+    def _acquire(self, circle_id: str) -> CircleTopic:
+        topic = self.topics.get(circle_id)
+        if topic is None:
+            topic = self.topics[circle_id] = CircleTopic(circle_id, self.versions)
+        topic.subscribers += 1
+        if topic.task is None:
+            topic.task = asyncio.ensure_future(self._refresh_loop(topic))
+        return topic
+
+    def _release(self, topic: CircleTopic):
+        """Drop a topic, its refresh and its member state with its last subscriber."""
+        topic.subscribers -= 1
+        if topic.subscribers > 0:
+            return
+        if topic.task is not None:
+            topic.task.cancel()
+            topic.task = None
+        if self.topics.get(topic.circle_id) is topic:
+            del self.topics[topic.circle_id]
+
+    async def subscribe(self, circle_id: str, since: Optional[int] = None) -> AsyncIterator[Tuple[str, int, Any]]:
+        """Yield (event, version, payload); event is "snapshot", "delta" or "keepalive"."""
+        topic = self._acquire(circle_id)
+        try:
+            # A version the topic no longer has (or never had) can't be diffed against
+            last = since if since is not None and topic.base < since <= topic.version else None
+            while True:
+                waiter = topic.updated
+                if topic.version > 0 and last is None:
+                    yield "snapshot", topic.version, topic.snapshot()
+                    last = topic.version
+                elif last is not None and topic.version > last:
+                    yield "delta", topic.version, topic.delta(last)
+                    last = topic.version
+                try:
+                    await asyncio.wait_for(waiter.wait(), timeout=self.keepalive_interval)
+                except asyncio.TimeoutError:
+                    yield "keepalive", topic.version, None
+        finally:
+            self._release(topic)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "epoch": self.epoch,
+            "circles": {
+                circle_id: {"version": topic.version, "subscribers": topic.subscribers}
+                for circle_id, topic in self.topics.items()
+            },
+        }
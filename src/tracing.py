@@ -0,0 +1,161 @@
+import random
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+from .config import settings
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "attributes")
+
+    def __init__(self, name: str, start: float, attributes: Dict[str, Any]):
+        self.name = name
+        self.start = start
+        self.end: Optional[float] = None
+        self.attributes = attributes
+
+
+class Trace:
+    """Spans recorded for one sampled request, timed with perf_counter()."""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.spans: List[Span] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.end or time.perf_counter()
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "spans": [
+                {
+                    "name": span.name,
+                    "start_ms": round((span.start - self.start) * 1000, 3),
+                    "duration_ms": round(((span.end or end) - span.start) * 1000, 3),
+                    "attributes": span.attributes,
+                }
+                for span in sorted(self.spans, key=lambda span: span.start)
+            ],
+        }
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("life360_trace", default=None)
+
+
+class _SpanContext:
+
+    def __init__(self, trace: Trace, name: str, attributes: Dict[str, Any]):
+        self.span = Span(name, 0.0, attributes)
+        self.trace = trace
+
+    def __enter__(self) -> Span:
+        self.span.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end = time.perf_counter()
+        if exc_type is not None:
+            self.span.attributes["error"] = exc_type.__name__
+        self.trace.spans.append(self.span)
+
+
+class _NoopSpan:
+    """Returned when the current request isn't sampled; costs one ContextVar lookup."""
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+class Tracer:
+    """Sampled request tracing into a bounded ring buffer of finished traces."""
+
+    def __init__(self, sample_rate: float = 0.01, capacity: int = 256):
+        self.sample_rate = sample_rate
+        self.traces: Deque[Trace] = deque(maxlen=capacity)
+
+    def start(self, name: str, force: bool = False, **attributes: Any) -> Optional[Trace]:
+        """Begin a trace in the current context if sampled (or forced)."""
+        if not force and random.random() >= self.sample_rate:
+            return None
+        trace = Trace(name, attributes)
+        _current.set(trace)
+        return trace
+
+    def finish(self, trace: Trace):
+        trace.end = time.perf_counter()
+        _current.set(None)
+        self.traces.append(trace)
+
+    def span(self, name: str, **attributes: Any):
+        trace = _current.get()
+        if trace is None:
+            return _NOOP
+        return _SpanContext(trace, name, attributes)
+
+    def add_span(self, name: str, duration: float, **attributes: Any):
+        """Record an already-measured span that ended just now."""
+        trace = _current.get()
+        if trace is None:
+            return
+        span = Span(name, time.perf_counter() - duration, attributes)
+        span.end = span.start + duration
+        trace.spans.append(span)
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        return [trace.to_dict() for trace in list(self.traces)[::-1][:limit]]
+
+
+tracer = Tracer(sample_rate=settings.trace_sample_rate, capacity=settings.trace_buffer_size)
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a trace per sampled HTTP request.
+
+    Send `X-Trace: 1` to force sampling; sampled responses carry `X-Trace-Id`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        force = (b"x-trace", b"1") in scope.get("headers", [])
+        trace = tracer.start(f"{scope['method']} {scope['path']}", force=force)
+        if trace is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                trace.attributes["status"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", trace.trace_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                trace.name = f"{scope['method']} {route.path}"
+            tracer.finish(trace)
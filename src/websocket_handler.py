@@ -1,79 +1,821 @@
 import asyncio
 import json
-from typing import Optional, Dict
+import time
+from typing import Optional, Dict, List, Set, Tuple
 from fastapi import WebSocket, WebSocketDisconnect
-from datetime import datetime
 import uuid
 
-from .models import Command, Response, ResponseStatus
+from .broker import Broker, create_broker
+from .codec import JSON, negotiate
+from .config import settings
+from .latency import DeadlineExceeded, LatencyTracker, remaining_budget
+from .log import get_logger
+from .models import (
+    BatchParams, CancelParams, Command, CommandType, Response, ResponseStatus, COMMAND_PRIORITY,
+    LOWEST_PRIORITY, normalize_params
+)
+from .metrics import (
+    COMMAND_ERRORS, COMMAND_RTT, COMMAND_TIMEOUTS, COMMANDS_CANCELLED, COMMANDS_COALESCED, COMMANDS_HEDGED,
+    CONNECTED_CLIENTS,
+    FRAME_BYTES, PENDING_COMMANDS
+)
+from .ratelimit import RateLimiter, create_rate_limiter
+from .scheduler import DeviceScheduler, QueueFull
+from .tracing import tracer
 
+logger = get_logger("websocket_handler")
+
+# Command ids of server heartbeats; their responses only prove the device is alive
+HEARTBEAT_PREFIX = "heartbeat-"
+# Command ids of CANCEL commands; nothing waits for their responses
+CANCEL_PREFIX = "cancel-"
+
+
+class DeviceDisconnected(Exception):
+    """Raised when no device is left to run a command."""
+
+
+class DeviceHealth:
+    """Consecutive-failure tracking used to eject misbehaving pool members."""
 
-class ConnectionManager:
-    
     def __init__(self):
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until > time.monotonic()
+
+
+class ConnectionManager:
+
+    def __init__(self, eject_after: int = 3, eject_seconds: float = 30.0):
         self.active_connections: Dict[str, WebSocket] = {}
         self.pending_commands: Dict[str, asyncio.Future] = {}
-        
-    async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
+        # Coalescing key -> command_id of the in-flight command serving it
+        self.inflight: Dict[str, str] = {}
+        # command_id -> number of callers awaiting its future
+        self.waiters: Dict[str, int] = {}
+        self.stats: Dict[str, int] = {"sent": 0, "coalesced": 0, "retried": 0, "hedged": 0, "cancelled": 0}
+        # command_id -> task admitting and sending it, until every waiter has left
+        self.sending: Dict[str, asyncio.Task] = {}
+        # Pool name -> member client_ids; several phones on one account share a pool
+        self.pools: Dict[str, List[str]] = {}
+        self.client_pools: Dict[str, str] = {}
+        # command_id -> (client_id running it, target it was addressed to, command)
+        self.assignments: Dict[str, Tuple[str, str, Command]] = {}
+        self.outstanding: Dict[str, int] = {}
+        # command_id -> perf_counter() when it was written to the device
+        self.dispatched_at: Dict[str, float] = {}
+        self.health: Dict[str, DeviceHealth] = {}
+        # Batch command_id -> command_ids of its sub-commands
+        self.batches: Dict[str, List[str]] = {}
+        self.schedulers: Dict[str, DeviceScheduler] = {}
+        # client_id -> frame codec negotiated at handshake
+        self.codecs: Dict[str, object] = {}
+        self.latency = LatencyTracker(
+            default=settings.timeout_default, floor=settings.timeout_min,
+            ceiling=settings.timeout_max, multiplier=settings.timeout_multiplier,
+        )
+        self.hedge_reads = settings.hedge_reads
+        # Primary command_id -> command_id of its hedged copy on another device
+        self.hedges: Dict[str, str] = {}
+        # Losing hedge copies whose late responses are expected, oldest first
+        self.abandoned: Dict[str, None] = {}
+        # client_id -> time.monotonic() of its last frame, and its heartbeat task
+        self.last_seen: Dict[str, float] = {}
+        self.heartbeats: Dict[str, asyncio.Task] = {}
+        # Dropped client/pool -> time.monotonic() until which commands wait for it to return
+        self.grace_until: Dict[str, float] = {}
+        self.reconnected: Dict[str, asyncio.Future] = {}
+        self.reconnect_queued: Dict[str, int] = {}
+        # Reaches devices connected to other uvicorn workers, when running several
+        self.broker: Optional[Broker] = None
+        # Target (client or pool) -> Life360 API budget of the account behind it
+        self.limiters: Dict[str, RateLimiter] = {}
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+
+    async def connect(self, websocket: WebSocket, client_id: str, pool: Optional[str] = None,
+                      codec: Optional[str] = None):
+        offered = websocket.scope.get("subprotocols") or []
+        frame_codec, subprotocol = negotiate(offered, codec)
+        await websocket.accept(subprotocol=subprotocol)
+        previous = self.active_connections.get(client_id)
+        if previous is not None:
+            self._replace(client_id, previous)
         self.active_connections[client_id] = websocket
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] ✓ iOS app connected: {client_id}")
-        
-    def disconnect(self, client_id: str):
+        self.last_seen[client_id] = time.monotonic()
+        self.codecs[client_id] = frame_codec
+        self.outstanding.setdefault(client_id, 0)
+        self.health[client_id] = DeviceHealth()
+        self.schedulers[client_id] = DeviceScheduler(
+            client_id, window=settings.scheduler_window, max_queue=settings.scheduler_max_queue
+        )
+        if pool:
+            self.pools.setdefault(pool, []).append(client_id)
+            self.client_pools[client_id] = pool
+            logger.info(f"✓ iOS app connected: {client_id} (pool: {pool}, codec: {frame_codec.name})")
+        else:
+            logger.info(f"✓ iOS app connected: {client_id} (codec: {frame_codec.name})")
+        if settings.heartbeat_interval > 0:
+            self.heartbeats[client_id] = asyncio.ensure_future(self._heartbeat(client_id, websocket))
+        if self.broker is not None:
+            self.broker.registry.register(client_id, pool, self.broker.worker)
+        # Release commands that were waiting out the grace window
+        for name in filter(None, (client_id, pool)):
+            self.grace_until.pop(name, None)
+            waiting = self.reconnected.pop(name, None)
+            if waiting is not None and not waiting.done():
+                waiting.set_result(None)
+
+    def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None):
+        """Forget client_id's connection (only if it is still websocket, when given).
+
+        Its in-flight commands move to other pool members; new commands wait up to
+        the reconnect grace window for it to come back.
+        """
+        if websocket is not None and self.active_connections.get(client_id) is not websocket:
+            return  # Already replaced or dropped
         if client_id in self.active_connections:
-            del self.active_connections[client_id]
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] ✗ iOS app disconnected: {client_id}")
-            
-    async def send_command(self, client_id: str, command: Command, timeout: int = 30) -> Response:
-        if client_id not in self.active_connections:
-            raise Exception(f"No active connection for client: {client_id}")
-        websocket = self.active_connections[client_id]
-        future = asyncio.Future()
-        self.pending_commands[command.command_id] = future
+            logger.warning(f"✗ iOS app disconnected: {client_id}")
+        orphaned = self._orphaned(client_id)
+        pool = self._forget(client_id)
+        if self.broker is not None:
+            self.broker.registry.release(client_id, self.broker.worker, time.time() + settings.reconnect_grace)
+        if settings.reconnect_grace > 0:
+            grace_until = time.monotonic() + settings.reconnect_grace
+            self.grace_until[client_id] = grace_until
+            if pool and pool not in self.pools:
+                self.grace_until[pool] = grace_until
+        for command_id in orphaned:
+            _, target, command = self.assignments.pop(command_id)
+            asyncio.ensure_future(self._redispatch(target, command, client_id))
+
+    def _replace(self, client_id: str, previous: WebSocket):
+        """A new connection took over client_id: fail what the old socket had in flight."""
+        logger.warning(f"⇄ {client_id} connected again; closing its previous connection")
+        orphaned = self._orphaned(client_id)
+        self._forget(client_id)
+        for command_id in orphaned:
+            self.assignments.pop(command_id, None)
+            self.dispatched_at.pop(command_id, None)
+            for future in self._awaiting(command_id):
+                future.set_exception(DeviceDisconnected(f"{client_id} was replaced by a new connection"))
+        asyncio.ensure_future(self._close(previous, code=4000))
+
+    def _orphaned(self, client_id: str) -> List[str]:
+        return [cid for cid, (owner, _, _) in self.assignments.items() if owner == client_id]
+
+    def _forget(self, client_id: str) -> Optional[str]:
+        """Drop all per-connection state for client_id; returns the pool it was in."""
+        self.active_connections.pop(client_id, None)
+        pool = self.client_pools.pop(client_id, None)
+        if pool:
+            self.pools[pool].remove(client_id)
+            if not self.pools[pool]:
+                del self.pools[pool]
+        self.outstanding.pop(client_id, None)
+        self.health.pop(client_id, None)
+        self.codecs.pop(client_id, None)
+        self.schedulers.pop(client_id, None)
+        self.last_seen.pop(client_id, None)
+        heartbeat = self.heartbeats.pop(client_id, None)
+        if heartbeat is not None and heartbeat is not asyncio.current_task():
+            heartbeat.cancel()
+        return pool
+
+    async def _close(self, websocket: WebSocket, code: int = 1000):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _heartbeat(self, client_id: str, websocket: WebSocket):
+        """Ping the device when it has been quiet; drop it if the ping goes unanswered."""
+        interval, timeout = settings.heartbeat_interval, settings.heartbeat_timeout
+        while True:
+            await asyncio.sleep(interval)
+            if self.active_connections.get(client_id) is not websocket:
+                return
+            sent_at = time.monotonic()
+            if sent_at - self.last_seen.get(client_id, 0.0) < interval:
+                continue
+            try:
+                await self._send_frame(client_id, websocket, Command(
+                    command_id=f"{HEARTBEAT_PREFIX}{uuid.uuid4()}", type=CommandType.PING
+                ).dict())
+                await asyncio.sleep(timeout)
+            except Exception as e:
+                logger.debug("Heartbeat to %s failed: %s", client_id, e)
+            if self.active_connections.get(client_id) is not websocket:
+                return
+            if self.last_seen.get(client_id, 0.0) < sent_at:
+                logger.warning(f"✗ No heartbeat from {client_id} within {timeout:g}s; dropping it")
+                self.disconnect(client_id, websocket)
+                await self._close(websocket, code=1011)
+                return
+
+    async def _await_reconnect(self, target: str, timeout: Optional[float]) -> bool:
+        """Wait for a dropped target to come back within its grace window."""
+        remaining = self.grace_until.get(target, 0.0) - time.monotonic()
+        if remaining <= 0:
+            self.grace_until.pop(target, None)
+            return False
+        if self.reconnect_queued.get(target, 0) >= settings.reconnect_queue_size:
+            raise QueueFull(target, retry_after=max(1.0, round(remaining)))
+        future = self.reconnected.get(target)
+        if future is None or future.done():
+            future = self.reconnected[target] = asyncio.get_running_loop().create_future()
+        self.reconnect_queued[target] = self.reconnect_queued.get(target, 0) + 1
         try:
-            await websocket.send_json(command.dict())
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] → Sent command: {command.type} (ID: {command.command_id})")
-            response = await asyncio.wait_for(future, timeout=timeout)
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] ← Received response: {response.status}")
+            wait = remaining if timeout is None else min(remaining, timeout)
+            await asyncio.wait_for(asyncio.shield(future), timeout=wait)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.reconnect_queued[target] -= 1
+            if not self.reconnect_queued[target]:
+                del self.reconnect_queued[target]
+
+    def _timeout(self, command_type: CommandType, timeout: Optional[float]) -> float:
+        """The explicit timeout or the type's adaptive deadline, capped by the request's budget."""
+        if timeout is None:
+            timeout = self.latency.deadline(command_type)
+        budget = remaining_budget()
+        if budget is not None:
+            timeout = min(timeout, budget)
+            if timeout <= 0:
+                COMMAND_TIMEOUTS.inc(command=command_type.value)
+                raise DeadlineExceeded("Request deadline exceeded")
+        return timeout
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        """Seconds left until deadline (a loop.time()), raising DeadlineExceeded once none are."""
+        if deadline is None:
+            return None
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        return remaining
+
+    async def send_command(self, client_id: str, command: Command, timeout: Optional[float] = None,
+                           coalesce: bool = False, hedge: bool = False, forward: bool = True,
+                           raw: bool = False) -> Response:
+        """Send a command to a client, or to the least busy member of a pool.
+
+        Without a timeout the command gets its type's adaptive deadline. The timeout
+        covers every stage together: waiting for API budget, for a device slot or a
+        reconnect, and for the response. With hedge
+        (and hedging enabled), a command still unanswered at its p95 is also sent
+        to another pool member and the first response wins. A device held by
+        another worker is reached through the broker unless forward is False.
+        With raw, data a lean-codec device sent is left undecoded (see raw_data).
+        """
+        worker = self._remote_owner(client_id) if forward else None
+        if worker is not None:
+            result = await self._forward(worker, client_id, timeout, {
+                "op": "command", "command": command.dict(), "coalesce": coalesce, "hedge": hedge,
+            })
+            return Response(**result)
+        if not self._is_local(client_id):
+            raise DeviceDisconnected(f"No active connection for client: {client_id}")
+        timeout = self._timeout(command.type, timeout)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        key = self._coalesce_key(client_id, command) if coalesce else None
+        command_id = self.inflight.get(key) if key else None
+        future = self.pending_commands.get(command_id) if command_id else None
+        leader = future is None or future.done()
+        if leader:
+            command_id = command.command_id
+            future = loop.create_future()
+            self.pending_commands[command_id] = future
+            if key:
+                self.inflight[key] = command_id
+        else:
+            self.stats["coalesced"] += 1
+            COMMANDS_COALESCED.inc(command=command.type.value)
+            logger.debug("⇉ Coalesced command: %s (ID: %s)", command.type.value, command_id)
+        self.waiters[command_id] = self.waiters.get(command_id, 0) + 1
+        cancelled = False
+        try:
+            if leader:
+                # A task of its own, so callers that join keep it going if the leader leaves
+                self.sending[command_id] = asyncio.ensure_future(self._send(client_id, command, future, deadline))
+                await asyncio.shield(self.sending[command_id])
+            remaining = self._remaining(deadline)
+            with tracer.span("device.wait", command_id=command_id, coalesced=not leader) as span:
+                response = await asyncio.wait_for(
+                    self._await_response(
+                        client_id, command, future, leader and hedge and self.hedge_reads, deadline
+                    ),
+                    timeout=remaining,
+                )
+                if span is not None and response.timings:
+                    span.attributes["device_timings"] = response.timings
+            if not raw:
+                response.load_data()
+            tracer.add_span("response.parse", response._parse_seconds)
+            logger.debug("← Received response: %s", response.status.value)
             return response
         except asyncio.TimeoutError:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] ✗ Command timeout: {command.command_id}")
-            raise Exception(f"Command timeout after {timeout}s")
+            COMMAND_TIMEOUTS.inc(command=command.type.value)
+            logger.warning(f"✗ Command timeout: {command_id}")
+            raise DeadlineExceeded(f"Command timeout after {timeout:.3g}s")
+        except DeadlineExceeded:
+            # Ran out of time before the command reached the device
+            COMMAND_TIMEOUTS.inc(command=command.type.value)
+            raise
+        except asyncio.CancelledError:
+            cancelled = True
+            logger.debug("Caller gave up on %s (ID: %s)", command.type.value, command_id)
+            raise
         finally:
-            if command.command_id in self.pending_commands:
-                del self.pending_commands[command.command_id]
-                
-    async def handle_response(self, response_data: dict):
+            self._release(command_id, key, cancelled)
+
+    async def _send(self, target: str, command: Command, future: asyncio.Future, deadline: float):
         try:
-            response = Response(**response_data)
-            command_id = response.command_id
-            if command_id in self.pending_commands:
-                future = self.pending_commands[command_id]
-                if not future.done():
-                    future.set_result(response)
+            await self._admit(target, command, deadline)
+            await self._admitted_dispatch(target, command, deadline=deadline)
+        except Exception as e:
+            # Fan the failure out to anyone who joined while we were sending
+            if not future.done():
+                future.set_exception(e)
+
+    async def _await_response(self, target: str, command: Command, future: asyncio.Future,
+                              hedge: bool, deadline: float) -> Response:
+        # Shielded so one waiter timing out doesn't cancel the shared future
+        hedge_after = self.latency.hedge_delay(command.type) if hedge else None
+        if hedge_after is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout=hedge_after)
+            except asyncio.TimeoutError:
+                asyncio.ensure_future(self._hedge(target, command, future, deadline))
+        return await asyncio.shield(future)
+
+    async def _hedge(self, target: str, command: Command, future: asyncio.Future, deadline: float):
+        assignment = self.assignments.get(command.command_id)
+        if assignment is None or future.done():
+            return
+        primary = assignment[0]
+        if not self._candidates(target, {primary}):
+            return
+        copy = Command(command_id=str(uuid.uuid4()), type=command.type, params=command.params)
+        self.pending_commands[copy.command_id] = future
+        self.hedges[command.command_id] = copy.command_id
+        self.stats["hedged"] += 1
+        COMMANDS_HEDGED.inc(command=command.type.value)
+        logger.debug("⇶ Hedging %s (ID: %s) away from %s", command.type.value, command.command_id, primary)
+        try:
+            # A hedge is optional: send it only if the budget has room right now
+            await self._admit(target, copy, deadline, wait=False)
+            await self._admitted_dispatch(target, copy, exclude={primary}, deadline=deadline)
+        except Exception as e:
+            logger.debug("Hedge of %s not sent: %s", command.command_id, e)
+            return
+        if command.command_id not in self.hedges:
+            # Every waiter left while the copy was queued
+            self.pending_commands.pop(copy.command_id, None)
+            self._finish_assignment(copy.command_id, success=None)
+
+    async def send_batch(self, client_id: str, commands: List[Command],
+                         timeout: Optional[float] = None, forward: bool = True) -> List[Response]:
+        """Send several commands in one BATCH frame; each still resolves its own future."""
+        worker = self._remote_owner(client_id) if forward else None
+        if worker is not None:
+            results = await self._forward(worker, client_id, timeout, {
+                "op": "batch", "commands": [command.dict() for command in commands],
+            })
+            return [Response(**result) for result in results]
+        if not self._is_local(client_id):
+            raise DeviceDisconnected(f"No active connection for client: {client_id}")
+        timeout = self._timeout(CommandType.BATCH, timeout)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        batch = Command(
+            command_id=str(uuid.uuid4()),
+            type=CommandType.BATCH,
+            params=BatchParams(commands=commands).dict(),
+        )
+        futures = []
+        for command in commands:
+            future = loop.create_future()
+            self.pending_commands[command.command_id] = future
+            self.waiters[command.command_id] = 1
+            futures.append(future)
+        self.batches[batch.command_id] = [command.command_id for command in commands]
+        cancelled = False
+        try:
+            await self._admit(client_id, batch, deadline)
+            await self._admitted_dispatch(client_id, batch, deadline=deadline)
+            remaining = self._remaining(deadline)
+            responses = await asyncio.wait_for(asyncio.gather(*futures), timeout=remaining)
+            logger.debug("← Received batch response: %d commands", len(responses))
+            return list(responses)
+        except asyncio.TimeoutError:
+            COMMAND_TIMEOUTS.inc(command=CommandType.BATCH.value)
+            logger.warning(f"✗ Batch timeout: {batch.command_id}")
+            raise DeadlineExceeded(f"Batch timeout after {timeout:.3g}s")
+        except DeadlineExceeded:
+            COMMAND_TIMEOUTS.inc(command=CommandType.BATCH.value)
+            raise
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self.batches.pop(batch.command_id, None)
+            self._abandon(batch.command_id, cancelled)
+            for command in commands:
+                self._release(command.command_id, None, cancelled)
+
+    async def _admit(self, target: str, command: Command, deadline: float, wait: bool = True):
+        """Wait for the Life360 API budget the command's upstream calls need, until deadline
+        (or not at all, without wait)."""
+        limiter = self.limiters.get(target)
+        if limiter is None:
+            limiter = create_rate_limiter(target)
+            if limiter is None:
+                return
+            self.limiters[target] = limiter
+        with tracer.span("ratelimit.acquire"):
+            await limiter.acquire(command, max_wait=self._remaining(deadline) if wait else 0.0)
+
+    async def _admitted_dispatch(self, target: str, command: Command, **kwargs):
+        """_dispatch an admitted command, returning its budget if it never reaches a device."""
+        try:
+            await self._dispatch(target, command, **kwargs)
+        except BaseException:
+            limiter = self.limiters.get(target)
+            if limiter is not None:
+                limiter.refund(command)
+            raise
+
+    def get_rate_limits(self) -> Dict[str, dict]:
+        return {target: limiter.info() for target, limiter in self.limiters.items()}
+
+    def _remote_owner(self, target: str) -> Optional[str]:
+        if self.broker is None or self._is_local(target):
+            return None
+        return self.broker.owner(target)
+
+    async def _forward(self, worker: str, target: str, timeout: Optional[float], message: dict):
+        budget = remaining_budget()
+        if budget is not None:
+            timeout = budget if timeout is None else min(timeout, budget)
+        # The owning worker applies the deadline; this only guards against it going quiet
+        wait = (timeout if timeout is not None else settings.timeout_max) + 1.0
+        try:
+            return await self.broker.forward(worker, {**message, "target": target, "timeout": timeout}, wait)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Command timeout after {wait:.3g}s waiting on another worker")
+
+    async def handle_forwarded(self, request: dict):
+        """Run a command another worker forwarded for a device connected here."""
+        if request["op"] == "batch":
+            commands = [Command(**command) for command in request["commands"]]
+            responses = await self.send_batch(
+                request["target"], commands, timeout=request["timeout"], forward=False
+            )
+            return [response.dict() for response in responses]
+        response = await self.send_command(
+            request["target"], Command(**request["command"]), timeout=request["timeout"],
+            coalesce=request["coalesce"], hedge=request["hedge"], forward=False,
+        )
+        return response.dict()
+
+    async def start_broker(self):
+        if self.broker is not None:
+            await self.broker.start(self.handle_forwarded)
+
+    async def stop_broker(self):
+        if self.broker is not None:
+            await self.broker.stop()
+
+    def _resolve_batch(self, batch_response: Response):
+        sub_ids = self.batches[batch_response.command_id]
+        data = batch_response.load_data()
+        data = data if isinstance(data, dict) else {}
+        for item in data.get("responses") or []:
+            try:
+                response = Response(**item)
+                # A device only answers for the sub-commands it was given
+                if response.command_id in sub_ids:
+                    self._resolve(response)
+            except Exception as e:
+                logger.warning(f"✗ Bad batch sub-response: {e}")
+        # Anything the device left out fails with the batch's own error
+        for sub_id in sub_ids:
+            future = self.pending_commands.get(sub_id)
+            if future is not None and not future.done():
+                future.set_result(Response(
+                    command_id=sub_id,
+                    status=ResponseStatus.ERROR,
+                    error=batch_response.error or "Missing from batch response",
+                ))
+
+    def _priority(self, command: Command) -> int:
+        if command.type == CommandType.BATCH:
+            sub_types = [c["type"] for c in (command.params or {}).get("commands", [])]
+            return min((COMMAND_PRIORITY.get(t, LOWEST_PRIORITY) for t in sub_types), default=LOWEST_PRIORITY)
+        return COMMAND_PRIORITY.get(command.type, LOWEST_PRIORITY)
+
+    async def _dispatch(self, target: str, command: Command, exclude: Optional[Set[str]] = None,
+                        deadline: Optional[float] = None):
+        """Write a command to a device for target, trying other pool members on send errors.
+
+        Waiting for a reconnect or a device slot stops at deadline (a loop.time()).
+        """
+        exclude = set(exclude or ())
+        while True:
+            if target not in exclude and not self._candidates(target, exclude):
+                reconnected = await self._await_reconnect(target, self._remaining(deadline))
+                # Out of time rather than out of grace: that's a timeout, not a disconnect
+                self._remaining(deadline)
+                if reconnected:
+                    continue
+            client_id = self._pick(target, exclude)
+            scheduler = self.schedulers[client_id]
+            self.outstanding[client_id] += 1
+            try:
+                with tracer.span("scheduler.acquire", client_id=client_id):
+                    await scheduler.acquire(self._priority(command), timeout=self._remaining(deadline))
+            except BaseException:
+                if client_id in self.outstanding:
+                    self.outstanding[client_id] -= 1
+                raise
+            if client_id not in self.active_connections:
+                # Dropped while we were queued; its scheduler is gone with it
+                exclude.add(client_id)
+                continue
+            websocket = self.active_connections[client_id]
+            self.assignments[command.command_id] = (client_id, target, command)
+            try:
+                with tracer.span("socket.write", client_id=client_id):
+                    await self._send_frame(client_id, websocket, command.dict())
+                self.dispatched_at[command.command_id] = time.perf_counter()
+                self.stats["sent"] += 1
+                logger.debug("→ Sent command: %s (ID: %s) to %s", command.type.value, command.command_id, client_id)
+                return
+            except Exception as e:
+                logger.warning(f"✗ Send to {client_id} failed: {e}")
+                COMMAND_ERRORS.inc(command=command.type.value)
+                self._finish_assignment(command.command_id, success=False)
+                exclude.add(client_id)
+                if not self._candidates(target, exclude):
+                    raise
+
+    async def _send_frame(self, client_id: str, websocket: WebSocket, message: dict):
+        codec = self.codecs.get(client_id, JSON)
+        payload = codec.encode(message)
+        FRAME_BYTES.observe(len(payload) if codec.binary else len(payload.encode()), direction="out")
+        if codec.binary:
+            await websocket.send_bytes(payload)
+        else:
+            await websocket.send_text(payload)
+
+    async def _receive_frame(self, client_id: str, websocket: WebSocket) -> Tuple[dict, Optional[bytes], float]:
+        """Next frame from the device: the decoded message, its data still as JSON
+        bytes if the codec leaves it raw, and the seconds spent decoding."""
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        started = time.perf_counter()
+        codec = self.codecs.get(client_id, JSON)
+        if message.get("bytes") is not None:
+            FRAME_BYTES.observe(len(message["bytes"]), direction="in")
+            # Binary frames use the negotiated codec; JSON clients may still send bytes
+            data, raw = codec.split(message["bytes"])
+        else:
+            FRAME_BYTES.observe(len(message["text"].encode()), direction="in")
+            data, raw = (JSON if codec.binary else codec).split(message["text"])
+        return data, raw, time.perf_counter() - started
+
+    def _awaiting(self, command_id: str) -> List[asyncio.Future]:
+        """Unresolved futures waiting on command_id (the sub-commands, for a batch)."""
+        futures = [self.pending_commands.get(i) for i in self.batches.get(command_id, [command_id])]
+        return [future for future in futures if future is not None and not future.done()]
+
+    async def _redispatch(self, target: str, command: Command, lost_client: str):
+        if not self._awaiting(command.command_id):
+            return
+        try:
+            self.stats["retried"] += 1
+            logger.info(f"↻ Retrying {command.type} (ID: {command.command_id}) after {lost_client} dropped")
+            await self._dispatch(target, command, exclude={lost_client})
+        except Exception as e:
+            for future in self._awaiting(command.command_id):
+                future.set_exception(DeviceDisconnected(f"{lost_client} disconnected: {e}"))
+
+    def _candidates(self, target: str, exclude: Set[str]) -> List[str]:
+        if target in self.pools:
+            members = self.pools[target]
+        elif target in self.active_connections:
+            members = [target]
+        else:
+            members = []
+        return [c for c in members if c not in exclude and c in self.active_connections]
+
+    def _pick(self, target: str, exclude: Set[str]) -> str:
+        """Least-outstanding-requests choice among healthy members of target."""
+        candidates = self._candidates(target, exclude)
+        if not candidates:
+            raise DeviceDisconnected(f"No active connection for client: {target}")
+        # If every member is ejected, still try rather than fail outright
+        healthy = [c for c in candidates if not self.health[c].ejected] or candidates
+        return min(healthy, key=lambda c: self.outstanding.get(c, 0))
+
+    def _finish_assignment(self, command_id: str, success: Optional[bool]):
+        """Free the device slot held by command_id.
+
+        success=None abandons it (a hedge copy that lost) without touching device health.
+        """
+        assignment = self.assignments.pop(command_id, None)
+        dispatched_at = self.dispatched_at.pop(command_id, None)
+        if assignment is None:
+            return
+        client_id, _, command = assignment
+        if success and dispatched_at is not None:
+            rtt = time.perf_counter() - dispatched_at
+            COMMAND_RTT.observe(rtt, command=command.type.value)
+            self.latency.observe(command.type, rtt)
+        if client_id in self.outstanding:
+            self.outstanding[client_id] -= 1
+        if client_id in self.schedulers:
+            self.schedulers[client_id].release()
+        if success is None:
+            self.abandoned[command_id] = None
+            if len(self.abandoned) > 1024:
+                del self.abandoned[next(iter(self.abandoned))]
+            return
+        health = self.health.get(client_id)
+        if health is None:
+            return
+        if success:
+            health.consecutive_failures = 0
+            return
+        health.consecutive_failures += 1
+        if health.consecutive_failures >= self.eject_after:
+            health.ejected_until = time.monotonic() + self.eject_seconds
+            logger.warning(f"⚠ Ejecting {client_id} for {self.eject_seconds:.0f}s after {health.consecutive_failures} failures")
+
+    def _coalesce_key(self, client_id: str, command: Command) -> str:
+        return f"{client_id}|{command.type.value}|{normalize_params(command.params)}"
+
+    def _release(self, command_id: str, key: Optional[str], cancelled: bool = False):
+        """Drop one waiter; the last one out cleans up whatever is still in flight.
+
+        cancelled means that waiter's caller went away rather than timing out.
+        """
+        self.waiters[command_id] -= 1
+        if self.waiters[command_id] > 0:
+            return
+        del self.waiters[command_id]
+        sending = self.sending.pop(command_id, None)
+        if sending is not None and not sending.done():
+            # Still waiting for budget or a device slot; nothing reached the phone yet
+            sending.cancel()
+        future = self.pending_commands.pop(command_id, None)
+        answered = (future is not None and future.done() and not future.cancelled()
+                    and future.exception() is None)
+        for cid in filter(None, (command_id, self.hedges.pop(command_id, None))):
+            self.pending_commands.pop(cid, None)
+            if answered:
+                # A copy still assigned lost a hedge race
+                self._finish_assignment(cid, success=None)
             else:
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠ Received response for unknown command: {command_id}")
+                self._abandon(cid, cancelled)
+        if key and self.inflight.get(key) == command_id:
+            del self.inflight[key]
+
+    def _abandon(self, command_id: str, cancelled: bool):
+        """Give up on a command nobody answered: tell its device to drop it and free the slot.
+
+        A timeout counts against the device's health; a caller leaving doesn't.
+        """
+        assignment = self.assignments.get(command_id)
+        if assignment is None:
+            return
+        client_id, _, command = assignment
+        websocket = self.active_connections.get(client_id)
+        if websocket is not None:
+            self.stats["cancelled"] += 1
+            COMMANDS_CANCELLED.inc(command=command.type.value)
+            asyncio.ensure_future(self._send_cancel(client_id, websocket, command_id))
+        self._finish_assignment(command_id, success=None if cancelled else False)
+
+    async def _send_cancel(self, client_id: str, websocket: WebSocket, command_id: str):
+        cancel = Command(
+            command_id=f"{CANCEL_PREFIX}{uuid.uuid4()}",
+            type=CommandType.CANCEL,
+            params=CancelParams(command_id=command_id).dict(),
+        )
+        try:
+            await self._send_frame(client_id, websocket, cancel.dict())
+            logger.debug("→ Cancelled command %s on %s", command_id, client_id)
+        except Exception as e:
+            logger.debug("Cancel of %s not sent to %s: %s", command_id, client_id, e)
+
+    async def handle_response(self, response_data: dict, decode_seconds: float = 0.0,
+                              raw_data: Optional[bytes] = None, client_id: Optional[str] = None):
+        try:
+            started = time.perf_counter()
+            response = Response(**response_data)
+            response._raw_data = raw_data
+            response._parse_seconds = decode_seconds + time.perf_counter() - started
+            self._resolve(response, client_id)
         except Exception as e:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] ✗ Error handling response: {e}")
-            
+            logger.warning(f"✗ Error handling response: {e}")
+
+    def _resolve(self, response: Response, client_id: Optional[str] = None):
+        """Settle the command a response answers; client_id is the device it came from."""
+        command_id = response.command_id
+        assignment = self.assignments.get(command_id)
+        if client_id is not None and assignment is not None and assignment[0] != client_id:
+            # Devices may serve different accounts; one can't answer for another
+            logger.warning(f"⚠ Ignoring response for {command_id} from {client_id}; it was sent to {assignment[0]}")
+            return
+        if assignment is not None and assignment[1] in self.limiters:
+            self.limiters[assignment[1]].record(response)
+        if response.status == ResponseStatus.ERROR and command_id in self.assignments:
+            COMMAND_ERRORS.inc(command=self.assignments[command_id][2].type.value)
+        if command_id in self.batches:
+            self._finish_assignment(command_id, success=True)
+            self._resolve_batch(response)
+        elif command_id in self.pending_commands:
+            self._finish_assignment(command_id, success=True)
+            future = self.pending_commands[command_id]
+            if not future.done():
+                future.set_result(response)
+        elif command_id in self.abandoned:
+            del self.abandoned[command_id]
+            logger.debug("Late response for abandoned command: %s", command_id)
+        else:
+            logger.warning(f"⚠ Received response for unknown command: {command_id}")
+
     async def listen(self, websocket: WebSocket, client_id: str):
         try:
             while True:
-                data = await websocket.receive_json()
+                data, raw, decode_seconds = await self._receive_frame(client_id, websocket)
+                if self.active_connections.get(client_id) is websocket:
+                    self.last_seen[client_id] = time.monotonic()
+                if isinstance(data, dict) and str(data.get("command_id", "")).startswith(
+                        (HEARTBEAT_PREFIX, CANCEL_PREFIX)):
+                    continue
                 if "command_id" in data and "status" in data:
-                    await self.handle_response(data)
+                    await self.handle_response(data, decode_seconds, raw, client_id)
                 else:
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] Received unknown message type: {data}")
+                    logger.info(f"Received unknown message type: {data}")
         except WebSocketDisconnect:
-            self.disconnect(client_id)
+            self.disconnect(client_id, websocket)
         except Exception as e:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] ✗ Error in listen loop: {e}")
-            self.disconnect(client_id)
-            
+            if self.active_connections.get(client_id) is websocket:
+                logger.warning(f"✗ Error in listen loop: {e}")
+            self.disconnect(client_id, websocket)
+
     def get_connected_clients(self) -> list:
         return list(self.active_connections.keys())
-        
+
+    def get_pools(self) -> Dict[str, List[dict]]:
+        return {
+            pool: [
+                {
+                    "client_id": client_id,
+                    "outstanding": self.outstanding.get(client_id, 0),
+                    "ejected": self.health[client_id].ejected,
+                    "scheduler": self.schedulers[client_id].info(),
+                }
+                for client_id in members
+            ]
+            for pool, members in self.pools.items()
+        }
+
+    def get_schedulers(self) -> Dict[str, dict]:
+        return {client_id: scheduler.info() for client_id, scheduler in self.schedulers.items()}
+
+    def get_reconnecting(self) -> Dict[str, float]:
+        """Dropped clients/pools still inside their grace window -> seconds left."""
+        now = time.monotonic()
+        return {name: round(until - now, 1) for name, until in self.grace_until.items() if until > now}
+
     def is_connected(self, client_id: str) -> bool:
-        return client_id in self.active_connections
+        """True if client_id is reachable here or, with the broker, through another worker."""
+        return self._is_local(client_id) or (
+            self.broker is not None and self.broker.owner(client_id) is not None
+        )
+
+    def _is_local(self, client_id: str) -> bool:
+        """True if client_id is a connected client, a pool with a live member, or
+        either of those inside its reconnect grace window."""
+        return (
+            client_id in self.active_connections
+            or bool(self.pools.get(client_id))
+            or self.grace_until.get(client_id, 0.0) > time.monotonic()
+        )
 
 manager = ConnectionManager()
+manager.broker = create_broker()
+PENDING_COMMANDS.set_function(lambda: len(manager.pending_commands))
+CONNECTED_CLIENTS.set_function(lambda: len(manager.active_connections))
@@ -0,0 +1,153 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Union
+
+import pytest
+
+from benchmarks.simulated_device import lean_frame
+from main import app
+from src.codec import CODECS, SUBPROTOCOL_PREFIX
+from src.config import settings
+from src.websocket_handler import ConnectionManager
+from src.websocket_handler import manager as app_manager
+
+
+class FakeDevice:
+    """Stands in for the iOS app's WebSocket: records the commands the server
+    writes and answers them only when a test says so, in the given codec."""
+
+    def __init__(self, codec: str = "json"):
+        self.codec = codec
+        self.scope: Dict[str, Any] = {"subprotocols": [] if codec == "json" else [SUBPROTOCOL_PREFIX + codec]}
+        self.subprotocol: Optional[str] = None
+        self.commands: List[dict] = []
+        self._written: asyncio.Queue = asyncio.Queue()
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self.listener: Optional[asyncio.Task] = None
+
+    # WebSocket interface used by ConnectionManager
+    async def accept(self, subprotocol: Optional[str] = None):
+        self.subprotocol = subprotocol
+
+    async def send_text(self, text: str):
+        self._record(json.loads(text))
+
+    async def send_bytes(self, payload: bytes):
+        self._record(CODECS[self.codec].decode(payload))
+
+    def _record(self, command: dict):
+        self.commands.append(command)
+        self._written.put_nowait(command)
+
+    async def receive(self) -> dict:
+        return await self._inbox.get()
+
+    async def close(self, code: int = 1000):
+        self._inbox.put_nowait({"type": "websocket.disconnect", "code": code})
+
+    # Test controls
+    async def next_command(self, timeout: float = 1.0) -> dict:
+        return await asyncio.wait_for(self._written.get(), timeout)
+
+    def respond(self, command: dict, data: Any = None, status: str = "success", **extra):
+        self.send_frame({"command_id": command["command_id"], "status": status, "data": data, **extra})
+
+    def send_frame(self, message: dict):
+        if self.codec == "lean":
+            self.send_raw(lean_frame(message).decode())
+        elif CODECS[self.codec].binary:
+            self.send_raw(CODECS[self.codec].encode(message))
+        else:
+            self.send_raw(json.dumps(message))
+
+    def send_raw(self, frame: Union[str, bytes]):
+        key = "bytes" if isinstance(frame, bytes) else "text"
+        self._inbox.put_nowait({"type": "websocket.receive", key: frame})
+
+    def of_type(self, command_type: str) -> List[dict]:
+        return [command for command in self.commands if command["type"] == command_type]
+
+
+class Client:
+    """Drives one HTTP request through the ASGI app and can hang up mid-request."""
+
+    def __init__(self, method: str, path: str, query: str = "", body: bytes = b"",
+                 headers: Optional[Dict[str, str]] = None):
+        self.scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+            "query_string": query.encode(), "root_path": "",
+            "headers": [(b"host", b"test"), (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        *((name.lower().encode(), value.encode()) for name, value in (headers or {}).items())],
+            "client": ("127.0.0.1", 50000), "server": ("test", 80),
+        }
+        self.body = body
+        self.hung_up = asyncio.Event()
+        self.messages: List[dict] = []
+        self.sent: asyncio.Queue = asyncio.Queue()
+        self._body_sent = False
+
+    async def receive(self) -> dict:
+        if not self._body_sent:
+            self._body_sent = True
+            return {"type": "http.request", "body": self.body, "more_body": False}
+        await self.hung_up.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message: dict):
+        self.messages.append(message)
+        self.sent.put_nowait(message)
+
+    def start(self) -> asyncio.Task:
+        return asyncio.ensure_future(app(self.scope, self.receive, self.send))
+
+    async def next_message(self, timeout: float = 1.0) -> dict:
+        return await asyncio.wait_for(self.sent.get(), timeout)
+
+    @property
+    def status(self) -> int:
+        return next(message["status"] for message in self.messages if message["type"] == "http.response.start")
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        start = next(message for message in self.messages if message["type"] == "http.response.start")
+        return {name.decode(): value.decode() for name, value in start["headers"]}
+
+
+@pytest.fixture(autouse=True)
+def quiet_settings(monkeypatch):
+    """No heartbeats, reconnect grace or API budget unless a test asks for them."""
+    monkeypatch.setattr(settings, "heartbeat_interval", 0.0)
+    monkeypatch.setattr(settings, "reconnect_grace", 0.0)
+    monkeypatch.setattr(settings, "rate_limit_enabled", False)
+
+
+@pytest.fixture
+def manager():
+    return ConnectionManager()
+
+
+async def connect(manager: ConnectionManager, client_id: str = "ios-app", codec: str = "json",
+                  pool: Optional[str] = None) -> FakeDevice:
+    device = FakeDevice(codec)
+    await manager.connect(device, client_id, pool=pool)
+    device.listener = asyncio.ensure_future(manager.listen(device, client_id))
+    return device
+
+
+@pytest.fixture
+async def device(manager):
+    device = await connect(manager)
+    yield device
+    await device.close()
+    await asyncio.wait_for(device.listener, 1.0)
+
+
+@pytest.fixture
+async def app_device():
+    """A fake device connected to the app's own manager, for requests through main.app."""
+    device = await connect(app_manager)
+    yield device
+    await device.close()
+    await asyncio.wait_for(device.listener, 1.0)
@@ -0,0 +1,119 @@
+import asyncio
+import json
+
+import pytest
+
+from src.accounts import AccountRegistry, UnknownCircle
+from src.api import accounts
+from src.broker import Broker
+from src.websocket_handler import manager as app_manager
+
+from .conftest import Client, connect
+
+
+@pytest.fixture
+async def phones():
+    """Phones for two accounts, alice and bob, connected to the app's manager."""
+    devices = {name: await connect(app_manager, name) for name in ("alice", "bob")}
+    accounts.register("alice", [{"id": "c-alice"}])
+    accounts.register("bob", [{"id": "c-bob"}, {"id": "c-shared"}])
+    yield devices
+    for device in devices.values():
+        await device.close()
+        await asyncio.wait_for(device.listener, 1.0)
+    for account in ("alice", "bob"):
+        accounts.register(account, [])
+        accounts.services.pop(account, None)
+        accounts.geo_indexes.pop(account, None)
+
+
+async def request(client: Client, device=None, data=None):
+    task = client.start()
+    if device is not None:
+        command = await device.next_command()
+        device.respond(command, data)
+    await task
+    return client
+
+
+async def test_circle_scoped_requests_reach_the_owning_phone(phones):
+    body = json.dumps({"circle_ids": ["c-bob"]}).encode()
+    client = await request(Client("POST", "/locations", "max_age=0", body), phones["bob"], {"c-bob": {}})
+
+    assert client.status == 200
+    assert phones["bob"].of_type("get_device_locations") and not phones["alice"].commands
+
+
+async def test_circles_of_different_accounts_are_rejected(phones):
+    body = json.dumps({"circle_ids": ["c-alice", "c-bob"]}).encode()
+    client = await request(Client("POST", "/locations", "max_age=0", body))
+
+    assert client.status == 400
+    assert not phones["alice"].commands and not phones["bob"].commands
+
+
+async def test_account_parameter_overrides_the_circle_lookup(phones):
+    client = await request(Client("GET", "/profile", "max_age=0&account=alice"), phones["alice"], {"id": "a"})
+
+    assert client.status == 200 and not phones["bob"].commands
+
+
+async def test_unknown_account_gets_404_and_no_service(phones):
+    client = await request(Client("GET", "/profile", "account=mallory"))
+
+    assert client.status == 404
+    assert "mallory" not in accounts.services
+
+
+async def test_circle_list_replaces_the_accounts_index(phones):
+    accounts.register("bob", [{"id": "c-bob"}])
+
+    assert accounts.circle_ids("bob") == {"c-bob"}
+    with pytest.raises(UnknownCircle):
+        accounts.account_for(["c-shared"])
+
+
+async def test_unreported_circle_is_rejected_once_several_accounts_have_circles(phones):
+    client = await request(Client("POST", "/circles/c-unknown/members", "max_age=0"))
+
+    assert client.status == 400
+    assert not phones["alice"].commands and not phones["bob"].commands
+
+
+def test_unreported_circle_goes_to_the_default_account_while_it_is_the_only_one():
+    registry = AccountRegistry(default="ios-app")
+    registry.register("ios-app", [{"id": "c1"}])
+
+    assert registry.account_for(["c-unknown"]) is None
+    assert registry.resolve(circle_ids=["c-unknown"]).client_id == "ios-app"
+
+
+def test_circle_index_is_shared_through_the_broker(tmp_path, monkeypatch):
+    other_worker = Broker(str(tmp_path), owner_ttl=0.0)
+    monkeypatch.setattr(app_manager, "broker", Broker(str(tmp_path), owner_ttl=0.0))
+    registry = AccountRegistry(default="ios-app")
+
+    other_worker.set_circles("bob", ["c-bob"])
+
+    assert registry.account_for(["c-bob"]) == "bob"
+    assert registry.for_circle("c-bob").client_id == "bob"
+    with pytest.raises(UnknownCircle):
+        registry.account_for(["c-unknown"])
+
+
+async def test_nearby_members_and_geofences_are_per_account(phones):
+    members = {"c-bob": {"members": [{"id": "bob-1", "location": {"latitude": 40.0, "longitude": -74.0}}]}}
+    body = json.dumps({"circle_ids": ["c-bob"]}).encode()
+    await request(Client("POST", "/locations", "max_age=0", body), phones["bob"], members)
+    await asyncio.sleep(0)
+    fence = json.dumps({"name": "home", "latitude": 40.0, "longitude": -74.0, "radius": 100}).encode()
+    await request(Client("POST", "/geofences", "account=alice", fence))
+
+    nearby = {
+        account: await request(Client("GET", "/locations/nearby", f"lat=40&lon=-74&radius=100&account={account}"))
+        for account in ("alice", "bob")
+    }
+
+    assert [m["member_id"] for m in json.loads(nearby["bob"].messages[1]["body"])["members"]] == ["bob-1"]
+    assert json.loads(nearby["alice"].messages[1]["body"])["count"] == 0
+    assert len(accounts.geo_indexes["alice"].fences) == 1 and not accounts.geo_indexes["bob"].fences
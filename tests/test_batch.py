@@ -0,0 +1,40 @@
+import asyncio
+import uuid
+
+from src.models import Command, CommandType, ResponseStatus
+
+
+def command(command_type: CommandType, params=None) -> Command:
+    return Command(command_id=str(uuid.uuid4()), type=command_type, params=params)
+
+
+async def test_batched_commands_share_one_frame_and_resolve_separately(manager, device):
+    profile, circles = command(CommandType.GET_PROFILE), command(CommandType.GET_CIRCLES)
+    task = asyncio.ensure_future(manager.send_batch("ios-app", [profile, circles], timeout=5.0))
+    batch = await device.next_command()
+
+    device.respond(batch, {"responses": [
+        {"command_id": circles.command_id, "status": "success", "data": {"circles": []}},
+        {"command_id": profile.command_id, "status": "success", "data": {"firstName": "Ada"}},
+    ]})
+    responses = await task
+
+    assert batch["type"] == "batch" and len(device.commands) == 1
+    assert [sub["command_id"] for sub in batch["params"]["commands"]] == [profile.command_id, circles.command_id]
+    assert [response.data for response in responses] == [{"firstName": "Ada"}, {"circles": []}]
+
+
+async def test_sub_commands_missing_from_the_answer_fail_on_their_own(manager, device):
+    profile, circles = command(CommandType.GET_PROFILE), command(CommandType.GET_CIRCLES)
+    task = asyncio.ensure_future(manager.send_batch("ios-app", [profile, circles], timeout=5.0))
+    batch = await device.next_command()
+
+    device.respond(batch, {"responses": [
+        {"command_id": profile.command_id, "status": "success", "data": {"firstName": "Ada"}},
+        {"command_id": "someone-else", "status": "success", "data": {}},
+    ]})
+    responses = await task
+
+    assert responses[0].status == ResponseStatus.SUCCESS
+    assert responses[1].status == ResponseStatus.ERROR and responses[1].error == "Missing from batch response"
+    assert not manager.pending_commands
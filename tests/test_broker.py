@@ -0,0 +1,70 @@
+import asyncio
+import uuid
+
+import pytest
+
+from src.broker import Broker, BrokerError
+from src.models import Command, CommandType
+from src.websocket_handler import ConnectionManager
+
+from .conftest import connect
+
+
+def profile_command() -> Command:
+    return Command(command_id=str(uuid.uuid4()), type=CommandType.GET_PROFILE)
+
+
+async def worker(directory, name: str) -> ConnectionManager:
+    manager = ConnectionManager()
+    manager.broker = Broker(str(directory), owner_ttl=0.0)
+    # Both workers live in this process, so they need their own socket names
+    manager.broker.worker = str(directory / f"{name}.sock")
+    await manager.start_broker()
+    return manager
+
+
+@pytest.fixture
+async def workers(tmp_path):
+    holder, other = await worker(tmp_path, "holder"), await worker(tmp_path, "other")
+    device = await connect(holder)
+    yield holder, other, device
+    await device.close()
+    await asyncio.wait_for(device.listener, 1.0)
+    for manager in (holder, other):
+        await manager.stop_broker()
+
+
+async def test_command_reaches_a_device_held_by_another_worker(workers):
+    holder, other, device = workers
+
+    task = asyncio.ensure_future(other.send_command("ios-app", profile_command(), timeout=5.0))
+    command = await device.next_command()
+    device.respond(command, {"firstName": "Ada"})
+    response = await task
+
+    assert other.is_connected("ios-app") and response.command_id == command["command_id"]
+    assert response.data == {"firstName": "Ada"}
+    assert other.broker.stats["forwarded"] == 1 and holder.broker.stats["served"] == 1
+
+
+async def test_caller_leaving_cancels_the_command_on_the_owning_worker(workers):
+    holder, other, device = workers
+
+    task = asyncio.ensure_future(other.send_command("ios-app", profile_command(), timeout=5.0))
+    command = await device.next_command()
+    task.cancel()
+
+    cancel = await device.next_command()
+    assert cancel["type"] == "cancel" and cancel["params"]["command_id"] == command["command_id"]
+    assert holder.broker.stats["cancelled"] == 1
+
+
+async def test_unreachable_worker_is_forgotten(tmp_path):
+    manager = await worker(tmp_path, "alive")
+    manager.broker.registry.register("ios-app", None, str(tmp_path / "gone.sock"))
+
+    with pytest.raises(BrokerError):
+        await manager.send_command("ios-app", profile_command(), timeout=1.0)
+
+    assert manager.broker.registry.owner("ios-app") is None and not manager.is_connected("ios-app")
+    await manager.stop_broker()
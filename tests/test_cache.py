@@ -0,0 +1,91 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from src.cache import ResponseCache, cache
+from src.models import CommandType
+
+from .conftest import Client
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+async def get_profile(device=None, data=None, query: str = "", headers=None) -> Client:
+    client = Client("GET", "/profile", query, headers=headers)
+    task = client.start()
+    if device is not None:
+        device.respond(await device.next_command(), data)
+    await asyncio.wait_for(task, 1.0)
+    return client
+
+
+async def test_second_read_is_served_from_the_cache(app_device):
+    first = await get_profile(app_device, {"firstName": "Ada"})
+    second = await get_profile()
+
+    assert second.status == 200 and second.messages[1]["body"] == b'{"firstName":"Ada"}'
+    assert second.headers["etag"] == first.headers["etag"]
+    assert second.headers["cache-control"].startswith("private, max-age=")
+    assert len(app_device.of_type("get_profile")) == 1
+
+
+async def test_matching_if_none_match_gets_304_without_a_body(app_device):
+    first = await get_profile(app_device, {"firstName": "Ada"})
+
+    client = await get_profile(headers={"if-none-match": first.headers["etag"]})
+
+    assert client.status == 304 and not client.messages[1].get("body")
+    assert client.headers["etag"] == first.headers["etag"]
+    assert len(app_device.of_type("get_profile")) == 1
+
+
+async def test_max_age_zero_goes_to_the_device_and_refreshes_the_entry(app_device):
+    await get_profile(app_device, {"firstName": "Ada"})
+    fresh = await get_profile(app_device, {"firstName": "Grace"}, "max_age=0")
+    cached = await get_profile()
+
+    assert json.loads(fresh.messages[1]["body"]) == {"firstName": "Grace"}
+    assert json.loads(cached.messages[1]["body"]) == {"firstName": "Grace"}
+    assert len(app_device.of_type("get_profile")) == 2
+
+
+async def test_expired_entry_is_served_stale_while_it_refreshes(app_device):
+    entry = cache.put(CommandType.GET_PROFILE, None, {"firstName": "Ada"})
+    entry.stored_at = time.time() - entry.ttl - 1
+
+    client = await get_profile()
+    app_device.respond(await app_device.next_command(), {"firstName": "Grace"})
+    await asyncio.sleep(0.01)
+
+    assert client.headers["x-cache-stale"] == "true"
+    assert json.loads(client.messages[1]["body"]) == {"firstName": "Ada"}
+    assert json.loads(cache.get(CommandType.GET_PROFILE).body) == {"firstName": "Grace"}
+
+
+def test_least_recently_used_entries_are_evicted_by_count_and_size():
+    small = ResponseCache({"get_circle_members": 30.0}, max_entries=2, max_bytes=100)
+    for circle_id in ("a", "b"):
+        small.put(CommandType.GET_CIRCLE_MEMBERS, {"circle_id": circle_id}, {"members": []})
+    small.get(CommandType.GET_CIRCLE_MEMBERS, {"circle_id": "a"})
+    small.put(CommandType.GET_CIRCLE_MEMBERS, {"circle_id": "c"}, {"members": []})
+
+    assert small.get(CommandType.GET_CIRCLE_MEMBERS, {"circle_id": "b"}) is None
+    assert small.get(CommandType.GET_CIRCLE_MEMBERS, {"circle_id": "a"}) is not None
+
+    small.put(CommandType.GET_CIRCLE_MEMBERS, {"circle_id": "d"}, {"members": ["x" * 80]})
+    assert len(small.entries) == 1 and small.total_bytes <= 100
+
+
+def test_accounts_do_not_share_entries():
+    cache.put(CommandType.GET_PROFILE, None, {"firstName": "Ada"})
+    cache.put(CommandType.GET_PROFILE, None, {"firstName": "Bob"}, account="bob")
+
+    assert json.loads(cache.get(CommandType.GET_PROFILE).body) == {"firstName": "Ada"}
+    assert json.loads(cache.get(CommandType.GET_PROFILE, account="bob").body) == {"firstName": "Bob"}
@@ -0,0 +1,71 @@
+import asyncio
+import uuid
+
+from src.models import Command, CommandType, ResponseStatus
+
+
+def profile_command() -> Command:
+    return Command(command_id=str(uuid.uuid4()), type=CommandType.GET_PROFILE)
+
+
+async def test_identical_reads_share_one_round_trip(manager, device):
+    first = asyncio.ensure_future(manager.send_command("ios-app", profile_command(), timeout=2, coalesce=True))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(manager.send_command("ios-app", profile_command(), timeout=2, coalesce=True))
+
+    command = await device.next_command()
+    device.respond(command, {"name": "Ada"})
+    responses = await asyncio.gather(first, second)
+
+    assert [response.data for response in responses] == [{"name": "Ada"}, {"name": "Ada"}]
+    assert len(device.of_type("get_profile")) == 1
+    assert manager.stats["coalesced"] == 1
+    assert not manager.pending_commands and not manager.inflight
+
+
+async def test_different_params_are_not_coalesced(manager, device):
+    commands = [
+        Command(command_id=str(uuid.uuid4()), type=CommandType.GET_CIRCLE_MEMBERS, params={"circle_id": circle_id})
+        for circle_id in ("a", "b")
+    ]
+    tasks = [asyncio.ensure_future(manager.send_command("ios-app", c, timeout=2, coalesce=True)) for c in commands]
+    for _ in commands:
+        device.respond(await device.next_command(), {})
+    await asyncio.gather(*tasks)
+
+    assert len(device.of_type("get_circle_members")) == 2
+    assert manager.stats["coalesced"] == 0
+
+
+async def test_follower_keeps_command_alive_when_leader_is_cancelled(manager, device):
+    leader = asyncio.ensure_future(manager.send_command("ios-app", profile_command(), timeout=2, coalesce=True))
+    command = await device.next_command()
+    follower = asyncio.ensure_future(manager.send_command("ios-app", profile_command(), timeout=2, coalesce=True))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    await asyncio.sleep(0.01)
+    device.respond(command, {"name": "Ada"})
+    response = await follower
+
+    assert leader.cancelled()
+    assert response.status == ResponseStatus.SUCCESS and response.data == {"name": "Ada"}
+    assert not device.of_type("cancel")
+    assert manager.stats["cancelled"] == 0
+
+
+async def test_last_caller_leaving_cancels_the_command_on_the_device(manager, device):
+    callers = [
+        asyncio.ensure_future(manager.send_command("ios-app", profile_command(), timeout=2, coalesce=True))
+        for _ in range(2)
+    ]
+    command = await device.next_command()
+    for caller in callers:
+        caller.cancel()
+
+    cancel = await device.next_command()
+
+    assert cancel["type"] == "cancel"
+    assert cancel["params"] == {"command_id": command["command_id"]}
+    assert not manager.pending_commands and not manager.assignments
+    assert manager.schedulers["ios-app"].in_flight == 0
@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+import pytest
+
+from src.api import accounts
+from src.websocket_handler import manager as app_manager
+
+from .conftest import Client, connect
+
+
+@pytest.fixture
+async def lean_device():
+    device = await connect(app_manager, codec="lean")
+    yield device
+    await device.close()
+    await asyncio.wait_for(device.listener, 1.0)
+    service = accounts.service()
+    service.deferred.clear()
+    geo_index = accounts.geo_indexes[service.client_id]
+    for fence_id in list(geo_index.fences):
+        geo_index.remove_fence(fence_id)
+
+
+def locations(circle_id: str, member_id: str = "m1") -> dict:
+    return {circle_id: {"members": [{"id": member_id, "location": {"latitude": 40.0, "longitude": -74.0}}]}}
+
+
+async def request(client: Client, device=None, data=None):
+    task = client.start()
+    if device is not None:
+        device.respond(await device.next_command(), data)
+    await task
+    return json.loads(client.messages[1]["body"]) if client.messages[1].get("body") else None
+
+
+async def test_lean_codec_is_negotiated_from_the_subprotocol(lean_device):
+    assert lean_device.subprotocol == "life360.lean"
+    assert app_manager.codecs["ios-app"].name == "lean"
+
+
+async def test_lean_data_reaches_the_http_body_byte_for_byte(lean_device):
+    client = Client("GET", "/profile", "max_age=0")
+    task = client.start()
+    command = await lean_device.next_command()
+    # Formatting a decode and re-encode would not preserve
+    lean_device.send_raw(json.dumps({"command_id": command["command_id"], "status": "success"}) +
+                         '\n{"firstName":"Ada","weight":1.50}')
+    await task
+
+    assert client.status == 200
+    assert client.messages[1]["body"] == b'{"firstName":"Ada","weight":1.50}'
+
+
+async def test_locations_stay_undecoded_until_the_geo_index_is_read(lean_device):
+    service = accounts.service()
+    body = json.dumps({"circle_ids": ["c1"]}).encode()
+    await request(Client("POST", "/locations", "max_age=0", body), lean_device, locations("c1"))
+    await asyncio.sleep(0)
+
+    (deferred,) = service.deferred.values()
+    assert deferred.data is None
+
+    nearby = await request(Client("GET", "/locations/nearby", "lat=40&lon=-74&radius=100"))
+    assert [member["member_id"] for member in nearby["members"]] == ["m1"]
+    assert not service.deferred
+
+
+async def test_locations_are_decoded_right_away_while_a_fence_watches(lean_device):
+    fence = json.dumps({"name": "home", "latitude": 40.0, "longitude": -74.0, "radius": 100}).encode()
+    await request(Client("POST", "/geofences", body=fence))
+    body = json.dumps({"circle_ids": ["c1"]}).encode()
+    await request(Client("POST", "/locations", "max_age=0", body), lean_device, locations("c1", "m2"))
+    await asyncio.sleep(0)
+
+    geo_index = accounts.geo_indexes[accounts.service().client_id]
+    assert not accounts.service().deferred
+    assert [(event.type, event.member_id) for event in geo_index.events][-1:] == [("enter", "m2")]
+
+
+async def test_only_the_latest_response_per_circle_list_is_deferred(lean_device):
+    service = accounts.service()
+    body = json.dumps({"circle_ids": ["c1"]}).encode()
+    for member_id in ("old", "new"):
+        await request(Client("POST", "/locations", "max_age=0", body), lean_device, locations("c1", member_id))
+    await asyncio.sleep(0)
+
+    assert len(service.deferred) == 1
+    assert service.deferred.popitem()[1].load_data() == locations("c1", "new")
+
+
+async def test_msgpack_frames_are_negotiated_and_decoded():
+    pytest.importorskip("msgpack")
+    device = await connect(app_manager, codec="msgpack")
+    try:
+        client = Client("GET", "/profile", "max_age=0")
+        profile = await request(client, device, {"firstName": "Ada", "avatar": None})
+
+        assert device.subprotocol == "life360.msgpack"
+        assert app_manager.codecs["ios-app"].name == "msgpack" and device.commands[-1]["type"] == "get_profile"
+        assert profile == {"firstName": "Ada", "avatar": None}
+    finally:
+        await device.close()
+        await asyncio.wait_for(device.listener, 1.0)
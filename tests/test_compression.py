@@ -0,0 +1,59 @@
+import gzip
+import json
+import zlib
+
+from .conftest import Client
+
+
+def circle_locations(circle_id: str) -> dict:
+    members = [{"id": f"m{i}", "location": {"latitude": 40.0 + i / 100, "longitude": -74.0}} for i in range(40)]
+    return {circle_id: {"members": members}}
+
+
+async def test_streamed_lines_arrive_before_the_stream_ends_with_gzip(app_device):
+    body = json.dumps({"circle_ids": ["a", "b"]}).encode()
+    client = Client("POST", "/locations/stream", body=body, headers={"accept-encoding": "gzip"})
+    request = client.start()
+    commands = {}
+    for _ in range(2):
+        command = await app_device.next_command()
+        commands[command["params"]["circle_ids"][0]] = command
+
+    app_device.respond(commands["a"], circle_locations("a"))
+    start = await client.next_message()
+    chunk = await client.next_message()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    first = json.loads(decompressor.decompress(chunk["body"]))
+
+    assert start["type"] == "http.response.start" and client.headers["content-encoding"] == "gzip"
+    assert chunk["more_body"] and first["circle_id"] == "a" and first["status"] == "success"
+    assert not request.done()
+
+    app_device.respond(commands["b"], circle_locations("b"))
+    await request
+    rest = b"".join(message.get("body", b"") for message in client.messages[2:])
+    second = json.loads(decompressor.decompress(rest) + decompressor.flush())
+    assert second["circle_id"] == "b" and decompressor.eof
+
+
+async def test_complete_response_is_gzipped_with_its_length(app_device):
+    client = Client("POST", "/locations", "max_age=0", json.dumps({"circle_ids": ["a"]}).encode(),
+                    headers={"accept-encoding": "gzip"})
+    request = client.start()
+    app_device.respond(await app_device.next_command(), circle_locations("a"))
+    await request
+
+    body = b"".join(message.get("body", b"") for message in client.messages[1:])
+    assert client.headers["content-encoding"] == "gzip"
+    assert int(client.headers["content-length"]) == len(body)
+    assert json.loads(gzip.decompress(body)) == circle_locations("a")
+
+
+async def test_small_responses_are_not_compressed(app_device):
+    client = Client("GET", "/profile", "max_age=0", headers={"accept-encoding": "gzip"})
+    request = client.start()
+    app_device.respond(await app_device.next_command(), {"firstName": "Ada"})
+    await request
+
+    assert "content-encoding" not in client.headers
+    assert json.loads(client.messages[1]["body"]) == {"firstName": "Ada"}
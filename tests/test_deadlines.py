@@ -0,0 +1,79 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from src import latency
+from src.config import settings
+from src.latency import DeadlineExceeded
+from src.models import Command, CommandType
+
+from .conftest import connect
+
+
+def ping() -> Command:
+    return Command(command_id=str(uuid.uuid4()), type=CommandType.PING)
+
+
+@pytest.fixture
+async def single_slot_device(manager, monkeypatch):
+    monkeypatch.setattr(settings, "scheduler_window", 1)
+    device = await connect(manager)
+    yield device
+    await device.close()
+    await device.listener
+
+
+async def test_queue_wait_and_response_wait_share_one_budget(manager, single_slot_device):
+    device = single_slot_device
+    busy = asyncio.ensure_future(manager.send_command("ios-app", ping(), timeout=5))
+    busy_command = await device.next_command()
+
+    started = time.monotonic()
+    budgeted = asyncio.ensure_future(manager.send_command("ios-app", ping(), timeout=0.3))
+    await asyncio.sleep(0.2)
+    device.respond(busy_command, {})
+    await busy
+    await device.next_command()  # now on the device, which never answers
+
+    with pytest.raises(DeadlineExceeded):
+        await budgeted
+    assert time.monotonic() - started < 0.4
+
+
+async def test_budget_spent_in_the_queue_never_reaches_the_device(manager, single_slot_device):
+    device = single_slot_device
+    busy = asyncio.ensure_future(manager.send_command("ios-app", ping(), timeout=5))
+    await device.next_command()
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        await manager.send_command("ios-app", ping(), timeout=0.2)
+
+    assert time.monotonic() - started < 0.3
+    assert len(device.of_type("ping")) == 1
+    busy.cancel()
+
+
+async def test_request_timeout_header_caps_the_command(manager, device):
+    token = latency._deadline.set(time.monotonic() + 0.1)
+    try:
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await manager.send_command("ios-app", ping(), timeout=5)
+    finally:
+        latency._deadline.reset(token)
+    assert time.monotonic() - started < 0.2
+
+
+async def test_reconnect_wait_counts_against_the_budget(manager, monkeypatch):
+    monkeypatch.setattr(settings, "reconnect_grace", 5.0)
+    device = await connect(manager)
+    await device.close()
+    await device.listener
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        await manager.send_command("ios-app", ping(), timeout=0.2)
+    assert time.monotonic() - started < 0.3
@@ -0,0 +1,47 @@
+import asyncio
+import json
+
+from src.websocket_handler import manager as app_manager
+
+from .conftest import Client
+
+
+async def test_get_hang_up_cancels_the_device_command(app_device):
+    client = Client("GET", "/profile", "max_age=0")
+    request = client.start()
+    command = await app_device.next_command()
+    assert command["type"] == "get_profile"
+
+    client.hung_up.set()
+    cancel = await app_device.next_command()
+    await asyncio.wait_for(request, 1.0)
+
+    assert cancel["type"] == "cancel" and cancel["params"] == {"command_id": command["command_id"]}
+    assert client.status == 499
+    assert command["command_id"] not in app_manager.pending_commands
+
+
+async def test_post_hang_up_cancels_the_device_command(app_device):
+    client = Client("POST", "/locations", "max_age=0", json.dumps({"circle_ids": ["c1"]}).encode())
+    request = client.start()
+    command = await app_device.next_command()
+
+    client.hung_up.set()
+    cancel = await app_device.next_command()
+    await asyncio.wait_for(request, 1.0)
+
+    assert cancel["params"] == {"command_id": command["command_id"]}
+    assert client.status == 499
+
+
+async def test_answered_request_is_not_cancelled(app_device):
+    client = Client("GET", "/profile", "max_age=0")
+    request = client.start()
+    command = await app_device.next_command()
+    app_device.respond(command, {"firstName": "Ada"})
+    await asyncio.wait_for(request, 1.0)
+    client.hung_up.set()
+    await asyncio.sleep(0.01)
+
+    assert client.status == 200
+    assert not app_device.of_type("cancel")
@@ -0,0 +1,65 @@
+import pytest
+
+from src.geo import GeoIndex, haversine_m
+from src.models import MemberLocation
+
+
+def at(member_id: str, latitude: float, longitude: float) -> MemberLocation:
+    return MemberLocation(member_id=member_id, circle_id="c1", latitude=latitude, longitude=longitude,
+                          timestamp=1000.0)
+
+
+@pytest.fixture
+def index():
+    index = GeoIndex()
+    # Spread out so radius queries go through the cells instead of scanning everyone
+    index.update(at(f"far-{i}", -60.0 + i, 10.0 * i) for i in range(20))
+    return index
+
+
+def test_nearby_members_come_nearest_first(index):
+    index.update([at("home", 40.0, -74.0), at("park", 40.001, -74.0), at("work", 40.05, -74.0)])
+
+    nearby = index.nearby(40.0, -74.0, 500)
+
+    assert [location.member_id for _, location in nearby] == ["home", "park"]
+    assert nearby[1][0] == pytest.approx(haversine_m(40.0, -74.0, 40.001, -74.0))
+    assert [location.member_id for _, location in index.nearby(40.0, -74.0, 500, limit=1)] == ["home"]
+
+
+def test_fences_report_enter_and_exit_once(index):
+    index.update([at("m1", 40.0, -74.0)])
+    fence = index.add_fence("home", 40.0, -74.0, 100)
+
+    index.update([at("m2", 40.0, -74.0005), at("m1", 40.0, -74.0)])
+    index.update([at("m2", 40.01, -74.0)])
+
+    assert [(event.type, event.member_id, event.fence_id) for event in index.events_since()] == [
+        ("enter", "m2", fence.id), ("exit", "m2", fence.id),
+    ]
+
+
+def test_removed_fences_stop_reporting(index):
+    fence = index.add_fence("home", 40.0, -74.0, 100)
+    assert index.remove_fence(fence.id)
+
+    index.update([at("m1", 40.0, -74.0)])
+
+    assert not index.events and not index.fence_cells
+
+
+def test_nearby_search_crosses_the_antimeridian(index):
+    index.update([at("east", -17.0, 179.9995), at("west", -17.0, -179.9995)])
+
+    assert {location.member_id for _, location in index.nearby(-17.0, 179.9999, 200)} == {"east", "west"}
+    assert {location.member_id for _, location in index.nearby(-17.0, -179.9999, 200)} == {"east", "west"}
+
+
+def test_fence_on_the_antimeridian_sees_members_on_both_sides(index):
+    fence = index.add_fence("dateline", -17.0, 179.9999, 100)
+
+    index.update([at("west", -17.0, -179.9999), at("east", -17.0, 179.9995)])
+
+    assert {(event.type, event.member_id) for event in index.events_since()} == {("enter", "west"), ("enter", "east")}
+    assert index._cell(-17.0, 180.0) == index._cell(-17.0, -180.0)
+    assert index.remove_fence(fence.id) and not index.fence_cells
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from src.history import HistoryStore
+from src.models import MemberLocation
+
+
+def sample(member_id: str, timestamp: float, latitude: float = 40.0) -> MemberLocation:
+    return MemberLocation(
+        member_id=member_id, circle_id="c1", latitude=latitude, longitude=-74.0,
+        accuracy=5.0, timestamp=timestamp,
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    history = HistoryStore(str(tmp_path / "history"), segment_size=4)
+    yield history
+    history.close()
+
+
+def test_range_query_spans_segments(store):
+    store.record(sample("m1", 1000.0 + i, latitude=40.0 + i / 1000) for i in range(10))
+    store.close()
+
+    samples = store.query("m1", start=1002.0, end=1006.0)
+
+    assert [s["timestamp"] for s in samples] == [1002.0, 1003.0, 1004.0, 1005.0, 1006.0]
+    assert samples[0]["latitude"] == pytest.approx(40.002) and samples[0]["accuracy"] == 5.0
+    assert len(store.members[store._directory("m1")].segments) == 3
+    assert store.info()["written"] == 10
+
+
+def test_out_of_order_samples_are_skipped(store):
+    store.record([sample("m1", 1000.0), sample("m1", 999.0), sample("m1", 1000.0), sample("m1", 1001.0)])
+    store.close()
+
+    assert [s["timestamp"] for s in store.query("m1")] == [1000.0, 1001.0]
+    assert store.stats["skipped"] == 2
+
+
+def test_limit_stops_at_the_oldest_samples(store):
+    store.record(sample("m1", 1000.0 + i) for i in range(10))
+    store.close()
+
+    assert [s["timestamp"] for s in store.query("m1", limit=3)] == [1000.0, 1001.0, 1002.0]
+
+
+def test_old_segments_are_pruned(tmp_path):
+    store = HistoryStore(str(tmp_path), segment_size=2, retention_days=1)
+    day = 86400.0
+    store.record(sample("m1", t) for t in (10.0, 11.0, 2 * day, 2 * day + 1, 3 * day + 1))
+    store.close()
+
+    assert [s["timestamp"] for s in store.query("m1")] == [2 * day, 2 * day + 1, 3 * day + 1]
+
+
+@pytest.mark.parametrize("member_id", ["..", ".", "../outside", "/etc"])
+def test_member_ids_cannot_leave_the_history_directory(tmp_path, member_id):
+    root = tmp_path / "history"
+    store = HistoryStore(str(root))
+    store.record([sample(member_id, 1000.0)])
+    store.close()
+
+    assert os.path.dirname(store._directory(member_id)) == str(root)
+    assert [s["timestamp"] for s in store.query(member_id)] == [1000.0]
+    assert sorted(os.listdir(tmp_path)) == ["history"]
+
+
+def test_ids_differing_only_in_unsafe_characters_do_not_share_samples(store):
+    store.record([sample("a b", 1000.0), sample("a_b", 2000.0)])
+    store.close()
+    reopened = HistoryStore(store.root)
+
+    assert [s["timestamp"] for s in reopened.query("a b")] == [1000.0]
+    assert [s["timestamp"] for s in reopened.query("a_b")] == [2000.0]
+    reopened.close()
+
+
+def test_unknown_member_has_no_history(store):
+    assert store.query("nobody") == []
+    assert store.query("..") == []
+
+
+def test_accounts_keep_separate_histories(store):
+    store.record([sample("m1", 1000.0)])
+    store.record([sample("m1", 2000.0)], account="bob")
+    store.close()
+
+    assert [s["timestamp"] for s in store.query("m1")] == [1000.0]
+    assert [s["timestamp"] for s in store.query("m1", account="bob")] == [2000.0]
+    assert store.query("m1", account="alice") == []
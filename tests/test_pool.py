@@ -0,0 +1,48 @@
+import asyncio
+import uuid
+
+import pytest
+
+from src.models import Command, CommandType
+
+from .conftest import connect
+
+
+def members_command(circle_id: str) -> Command:
+    return Command(command_id=str(uuid.uuid4()), type=CommandType.GET_CIRCLE_MEMBERS, params={"circle_id": circle_id})
+
+
+@pytest.fixture
+async def phones(manager):
+    phones = [await connect(manager, client_id, pool="family") for client_id in ("phone-a", "phone-b")]
+    yield phones
+    for phone in phones:
+        await phone.close()
+    await asyncio.wait_for(asyncio.gather(*(phone.listener for phone in phones)), 1.0)
+
+
+async def test_commands_go_to_the_member_with_the_fewest_outstanding(manager, phones):
+    first = asyncio.ensure_future(manager.send_command("family", members_command("c1"), timeout=5.0))
+    await phones[0].next_command()
+    second = asyncio.ensure_future(manager.send_command("family", members_command("c2"), timeout=5.0))
+    command = await phones[1].next_command()
+
+    assert command["params"] == {"circle_id": "c2"} and len(phones[0].commands) == 1
+    phones[1].respond(command, {"members": []})
+    assert (await second).data == {"members": []}
+    first.cancel()
+    await asyncio.gather(first, return_exceptions=True)
+
+
+async def test_in_flight_command_moves_to_another_member_when_its_phone_drops(manager, phones):
+    task = asyncio.ensure_future(manager.send_command("family", members_command("c1"), timeout=5.0))
+    lost = await phones[0].next_command()
+
+    await phones[0].close()
+    await asyncio.wait_for(phones[0].listener, 1.0)
+    retried = await phones[1].next_command()
+    phones[1].respond(retried, {"members": ["m1"]})
+
+    assert retried["command_id"] == lost["command_id"]
+    assert (await task).data == {"members": ["m1"]} and manager.stats["retried"] == 1
+    assert manager.get_pools()["family"][0]["client_id"] == "phone-b"
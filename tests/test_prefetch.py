@@ -0,0 +1,71 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from src import api
+from src.api import accounts
+from src.prefetch import Prefetcher
+
+from .conftest import Client
+
+LOCATIONS = {"members": [{"id": "m1", "location": {"latitude": 40.0, "longitude": -74.0}}]}
+
+
+@pytest.fixture
+async def prefetcher(monkeypatch):
+    prefetcher = Prefetcher(accounts, circles="c1", min_interval=60.0, budget=60.0)
+    monkeypatch.setattr(api, "prefetcher", prefetcher)
+    yield prefetcher
+    await prefetcher.stop()
+
+
+async def prefetch(prefetcher, app_device):
+    prefetcher.start()
+    app_device.respond(await app_device.next_command(), {"c1": LOCATIONS})
+    for _ in range(100):
+        if prefetcher.states.get("c1") and prefetcher.states["c1"].body is not None:
+            return prefetcher.states["c1"]
+        await asyncio.sleep(0.01)
+    raise AssertionError("circle was not prefetched")
+
+
+async def locations(query: str = "") -> Client:
+    client = Client("POST", "/locations", query, json.dumps({"circle_ids": ["c1"]}).encode())
+    await asyncio.wait_for(client.start(), 1.0)
+    return client
+
+
+async def test_prefetched_locations_are_served_without_a_command(prefetcher, app_device):
+    await prefetch(prefetcher, app_device)
+
+    client = await locations()
+
+    assert client.status == 200 and "x-prefetched-at" in client.headers
+    assert json.loads(client.messages[1]["body"]) == {"c1": LOCATIONS}
+    assert len(app_device.of_type("get_device_locations")) == 1
+
+
+async def test_prefetched_data_expires_with_the_location_cache(prefetcher, app_device, monkeypatch):
+    monkeypatch.setitem(api.cache.ttls, "get_device_locations", 5.0)
+    monkeypatch.setattr(api.settings, "stale_while_revalidate", 10.0)
+    state = await prefetch(prefetcher, app_device)
+
+    state.fetched_at = time.time() - 14.0
+    assert prefetcher.get(["c1"]) is not None
+    assert prefetcher.get(["c1"], max_age=10.0) is None
+
+    state.fetched_at = time.time() - 16.0
+    assert prefetcher.get(["c1"]) is None
+    request = asyncio.ensure_future(locations("max_age=0"))
+    app_device.respond(await app_device.next_command(), {"c1": LOCATIONS})
+    client = await request
+    assert client.status == 200 and "x-prefetched-at" not in client.headers
+
+
+async def test_circles_missing_from_the_prefetch_are_not_served(prefetcher, app_device):
+    await prefetch(prefetcher, app_device)
+
+    assert prefetcher.get(["c1", "c2"]) is None
+    assert prefetcher.get([]) is None
@@ -0,0 +1,84 @@
+import asyncio
+import uuid
+
+import pytest
+
+from src.config import settings
+from src.latency import DeadlineExceeded
+from src.models import Command, CommandType, Response, ResponseStatus
+from src.ratelimit import RateLimited, RateLimiter
+
+from .conftest import connect
+
+
+def profile() -> Command:
+    return Command(command_id=str(uuid.uuid4()), type=CommandType.GET_PROFILE)
+
+
+def limiter(rate: float = 1.0, **kwargs) -> RateLimiter:
+    return RateLimiter("ios-app", {"account": rate}, per_circle=0.0, burst_seconds=1.0, **kwargs)
+
+
+def tokens(rate_limiter: RateLimiter) -> float:
+    return rate_limiter.buckets["account"].tokens
+
+
+async def test_commands_within_burst_are_admitted_immediately():
+    rate_limiter = limiter(rate=2.0)
+    await asyncio.wait_for(asyncio.gather(rate_limiter.acquire(profile()), rate_limiter.acquire(profile())), 0.05)
+    assert rate_limiter.stats["admitted"] == 2 and rate_limiter.stats["delayed"] == 0
+
+
+async def test_waiting_longer_than_max_wait_is_rejected():
+    rate_limiter = limiter(rate=1.0)
+    await rate_limiter.acquire(profile())
+    with pytest.raises(RateLimited):
+        await rate_limiter.acquire(profile(), max_wait=0.1)
+    assert tokens(rate_limiter) == pytest.approx(0.0, abs=0.01)
+
+
+async def test_tokens_come_back_when_a_waiting_command_is_cancelled():
+    rate_limiter = limiter(rate=1.0)
+    await rate_limiter.acquire(profile())
+    before = tokens(rate_limiter)
+    waiting = asyncio.ensure_future(rate_limiter.acquire(profile()))
+    await asyncio.sleep(0.05)
+    assert tokens(rate_limiter) < before - 0.5
+
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+    assert tokens(rate_limiter) == pytest.approx(before, abs=0.01)
+
+
+async def test_upstream_429_halves_the_rate_and_pauses():
+    rate_limiter = limiter(rate=1.0)
+    rate_limiter.record(Response(
+        command_id="x", status=ResponseStatus.ERROR, rate_limited={"retry_after": 30},
+    ))
+    assert rate_limiter.factor == 0.5
+    with pytest.raises(RateLimited) as error:
+        await rate_limiter.acquire(profile())
+    assert error.value.scope == "upstream 429"
+
+
+async def test_command_that_never_reaches_the_device_is_refunded(manager, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_enabled", True)
+    monkeypatch.setattr(settings, "rate_limits", {"account": 1.0, "auth": 1.0})
+    monkeypatch.setattr(settings, "rate_limit_burst_seconds", 5.0)
+    monkeypatch.setattr(settings, "scheduler_window", 1)
+    device = await connect(manager)
+    busy = asyncio.ensure_future(manager.send_command("ios-app", profile(), timeout=5))
+    await device.next_command()
+    before = tokens(manager.limiters["ios-app"])
+
+    with pytest.raises(DeadlineExceeded):
+        await manager.send_command(
+            "ios-app", Command(command_id=str(uuid.uuid4()), type=CommandType.GET_CIRCLES), timeout=0.1
+        )
+
+    assert tokens(manager.limiters["ios-app"]) == pytest.approx(before, abs=0.2)
+    busy.cancel()
+    await device.close()
+    await device.listener
@@ -0,0 +1,77 @@
+import asyncio
+import uuid
+
+import pytest
+
+from src.config import settings
+from src.latency import DeadlineExceeded
+from src.models import Command, CommandType
+from src.scheduler import DeviceScheduler, QueueFull
+
+from .conftest import connect
+
+
+async def test_waiters_are_admitted_by_priority_then_arrival():
+    scheduler = DeviceScheduler("ios-app", window=1, max_queue=8)
+    await scheduler.acquire(priority=3)
+    order = []
+
+    async def wait(priority, name):
+        await scheduler.acquire(priority)
+        order.append(name)
+
+    tasks = [
+        asyncio.ensure_future(wait(priority, name))
+        for priority, name in [(3, "profile"), (2, "locations-1"), (0, "otp"), (2, "locations-2")]
+    ]
+    await asyncio.sleep(0)
+    for _ in tasks:
+        scheduler.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+    assert order == ["otp", "locations-1", "locations-2", "profile"]
+
+
+async def test_full_queue_evicts_a_less_important_waiter():
+    scheduler = DeviceScheduler("ios-app", window=1, max_queue=1)
+    await scheduler.acquire(priority=0)
+    low = asyncio.ensure_future(scheduler.acquire(priority=3))
+    await asyncio.sleep(0)
+    high = asyncio.ensure_future(scheduler.acquire(priority=1))
+    await asyncio.sleep(0)
+
+    with pytest.raises(QueueFull):
+        await low
+    with pytest.raises(QueueFull):
+        await scheduler.acquire(priority=2)
+    scheduler.release()
+    await high
+
+
+async def test_queue_wait_times_out_with_deadline_exceeded():
+    scheduler = DeviceScheduler("ios-app", window=1)
+    await scheduler.acquire(priority=0)
+    with pytest.raises(DeadlineExceeded):
+        await scheduler.acquire(priority=0, timeout=0.05)
+    assert scheduler.depth == 0
+
+
+async def test_command_waits_out_a_reconnect_within_the_grace_window(manager, monkeypatch):
+    monkeypatch.setattr(settings, "reconnect_grace", 5.0)
+    first = await connect(manager)
+    await first.close()
+    await first.listener
+
+    command = Command(command_id=str(uuid.uuid4()), type=CommandType.PING)
+    sending = asyncio.ensure_future(manager.send_command("ios-app", command, timeout=2))
+    await asyncio.sleep(0.05)
+    assert not sending.done()
+
+    second = await connect(manager)
+    second.respond(await second.next_command(), {})
+    response = await sending
+
+    assert response.command_id == command.command_id
+    await second.close()
+    await second.listener
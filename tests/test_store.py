@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from src.cache import ResponseCache
+from src.models import CommandType
+from src.store import ResponseStore
+
+TTLS = {CommandType.GET_PROFILE.value: 60.0, CommandType.GET_CIRCLE_MEMBERS.value: 60.0}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "life360.db")
+
+
+async def test_results_survive_a_restart(path):
+    store = ResponseStore(path)
+    ResponseCache(TTLS, store=store).put(CommandType.GET_PROFILE, None, {"firstName": "Ada"})
+    store.close()
+
+    restarted = ResponseCache(TTLS, store=ResponseStore(path))
+    assert restarted.get(CommandType.GET_PROFILE) is None
+    await restarted.load(CommandType.GET_PROFILE)
+
+    entry = restarted.get(CommandType.GET_PROFILE)
+    assert entry is not None and entry.body == b'{"firstName":"Ada"}'
+    restarted.store.close()
+
+
+async def test_load_reads_the_store_off_the_event_loop(path, monkeypatch):
+    store = ResponseStore(path)
+    ResponseCache(TTLS, store=store).put(CommandType.GET_PROFILE, None, {"firstName": "Ada"})
+    store.close()
+    restarted = ResponseStore(path)
+    cache = ResponseCache(TTLS, store=restarted)
+    threads = []
+    load = restarted.load
+    monkeypatch.setattr(restarted, "load", lambda key: threads.append(threading.current_thread()) or load(key))
+
+    assert cache.get(CommandType.GET_PROFILE) is None
+    await cache.load(CommandType.GET_PROFILE)
+    entry = cache.get(CommandType.GET_PROFILE)
+
+    assert entry is not None
+    assert threads and threads[0] is not threading.main_thread()
+    await cache.load(CommandType.GET_PROFILE)
+    assert len(threads) == 1
+    restarted.close()
+
+
+async def test_keys_missing_from_the_store_are_looked_up_once_within_a_bound(path):
+    store = ResponseStore(path)
+    cache = ResponseCache(TTLS, max_entries=2, store=store)
+    for i in range(20):
+        await cache.load(CommandType.GET_CIRCLE_MEMBERS, {"circle_id": f"c{i}"})
+    await cache.load(CommandType.GET_CIRCLE_MEMBERS, {"circle_id": "c19"})
+
+    assert len(cache._checked) == cache.max_checked == 8
+    assert store.stats["loaded"] == 0
+    store.close()
+
+
+def test_row_count_is_kept_without_counting(path):
+    store = ResponseStore(path)
+    cache = ResponseCache(TTLS, store=store)
+    cache.put(CommandType.GET_PROFILE, None, {"v": 1})
+    cache.put(CommandType.GET_CIRCLE_MEMBERS, {"circle_id": "c1"}, {"v": 1})
+    cache.put(CommandType.GET_PROFILE, None, {"v": 2})
+    store.close()
+
+    restarted = ResponseStore(path)
+    restarted.save("get_profile|", b"{}", 1.0)
+    restarted.save("new-key", b"{}", 1.0)
+    restarted.close()
+
+    assert store.info()["rows"] == 2
+    assert restarted.info()["rows"] == 3
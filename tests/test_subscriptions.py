@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from src.api import accounts
+from src.subscriptions import LocationHub
+
+
+@pytest.fixture
+def hub():
+    return LocationHub(accounts, refresh_interval=0.01, keepalive_interval=5.0)
+
+
+def locations(**members) -> dict:
+    return {"c1": {"members": [
+        {"id": member_id, "location": {"latitude": latitude, "longitude": longitude}}
+        for member_id, (latitude, longitude) in members.items()
+    ]}}
+
+
+async def next_event(stream, device=None, data=None):
+    event = asyncio.ensure_future(stream.__anext__())
+    if device is not None:
+        device.respond(await device.next_command(), data)
+    return await asyncio.wait_for(event, 1.0)
+
+
+async def test_subscribers_get_a_snapshot_then_only_changes(hub, app_device):
+    stream = hub.subscribe("c1")
+    event, version, snapshot = await next_event(stream, app_device, locations(a=(40.0, -74.0), b=(41.0, -74.0)))
+    assert event == "snapshot" and [member["member_id"] for member in snapshot["members"]] == ["a", "b"]
+
+    event, latest, delta = await next_event(stream, app_device, locations(a=(40.5, -74.0)))
+    await stream.aclose()
+
+    assert event == "delta" and latest > version and delta["since"] == version
+    assert [member["member_id"] for member in delta["members"]] == ["a"] and delta["removed"] == ["b"]
+
+
+async def test_reconnecting_while_the_circle_is_watched_resumes_with_a_delta(hub, app_device):
+    watcher = hub.subscribe("c1")
+    _, version, _ = await next_event(watcher, app_device, locations(a=(40.0, -74.0), b=(41.0, -74.0)))
+    await next_event(watcher, app_device, locations(a=(40.0, -74.0), b=(41.5, -74.0)))
+
+    resumed = hub.subscribe("c1", since=version)
+    event, _, delta = await next_event(resumed)
+    await resumed.aclose()
+    await watcher.aclose()
+
+    assert event == "delta" and [member["member_id"] for member in delta["members"]] == ["b"]
+
+
+async def test_topic_is_dropped_with_its_last_subscriber(hub, app_device):
+    stream = hub.subscribe("c1")
+    _, version, _ = await next_event(stream, app_device, locations(a=(40.0, -74.0)))
+    task = hub.topics["c1"].task
+
+    await stream.aclose()
+    await asyncio.sleep(0)
+
+    assert hub.topics == {} and task.cancelled()
+
+    # The recreated topic has none of the old versions to diff against
+    stream = hub.subscribe("c1", since=version)
+    event, latest, _ = await next_event(stream, app_device, locations(a=(40.0, -74.0)))
+    await stream.aclose()
+    assert event == "snapshot" and latest > version